@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NTP批量套接字I/O
+在Linux上通过ctypes调用recvmmsg/sendmmsg，一次系统调用收发多个数据报
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import socket
+import struct
+import sys
+import time
+from array import array
+from typing import Callable, Dict, Optional
+
+# 每个数据报的接收缓冲区大小（NTP请求为48字节，预留扩展字段空间）
+RECV_BUFFER_SIZE = 512
+
+# 响应缓冲区大小
+SEND_BUFFER_SIZE = 48
+
+# sockaddr_storage大小，足以容纳IPv4/IPv6地址
+SOCKADDR_SIZE = 128
+
+MSG_DONTWAIT = 0x40
+
+# 内核接收时间戳（Linux）
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+
+# 每个数据报的辅助数据缓冲区大小，足以容纳一个struct timespec控制消息
+CONTROL_BUFFER_SIZE = 64
+
+# 控制消息头(cmsghdr)与其后的struct timespec
+_CMSG_HEADER = struct.Struct('@Nii')
+_TIMESPEC = struct.Struct('@qq')
+_CMSG_DATA_OFFSET = (_CMSG_HEADER.size + ctypes.sizeof(ctypes.c_size_t) - 1) & ~(ctypes.sizeof(ctypes.c_size_t) - 1)
+
+
+class IOVec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t)
+    ]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(IOVec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int)
+    ]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', MsgHdr),
+        ('msg_len', ctypes.c_uint)
+    ]
+
+
+def _load_libc():
+    """加载libc并取得recvmmsg/sendmmsg，不支持时返回None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        recvmmsg = libc.recvmmsg
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint,
+                         ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return recvmmsg, sendmmsg
+
+
+_LIBC_FUNCS = _load_libc()
+
+
+def is_available() -> bool:
+    """当前平台是否支持批量I/O"""
+    return _LIBC_FUNCS is not None
+
+
+def parse_sockaddr(name: memoryview) -> tuple:
+    """
+    将sockaddr结构解析为(地址, 端口)元组
+    
+    Args:
+        name: sockaddr内存
+    
+    Returns:
+        tuple: 与socket.recvfrom返回格式一致的地址
+    """
+    family = int.from_bytes(name[0:2], sys.byteorder)
+    port = int.from_bytes(name[2:4], 'big')
+    if family == socket.AF_INET6:
+        return (socket.inet_ntop(socket.AF_INET6, bytes(name[8:24])), port)
+    return (socket.inet_ntop(socket.AF_INET, bytes(name[4:8])), port)
+
+
+class BatchIO:
+    """
+    基于recvmmsg/sendmmsg的批量收发器
+    
+    所有缓冲区与消息头在初始化时预分配，收发过程中不再分配内存；
+    响应直接复用请求的地址缓冲区作为目的地址。
+    启用SO_TIMESTAMPNS后，每个数据报的到达时间取自内核时间戳。
+    """
+    
+    def __init__(self, sock: socket.socket, batch_size: int = 64):
+        """
+        初始化批量收发器
+        
+        Args:
+            sock: 已绑定的非阻塞UDP套接字
+            batch_size: 每次系统调用最多处理的数据报数
+        """
+        if _LIBC_FUNCS is None:
+            raise OSError("当前平台不支持recvmmsg/sendmmsg")
+        
+        self._recvmmsg, self._sendmmsg = _LIBC_FUNCS
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.batch_size = batch_size
+        
+        # 请求内核为每个数据报附带接收时间戳，不支持时退回用户态取时
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+            self.kernel_timestamps = True
+        except OSError:
+            self.kernel_timestamps = False
+        
+        # 预分配的连续缓冲区
+        self._recv_area = bytearray(batch_size * RECV_BUFFER_SIZE)
+        self._send_area = bytearray(batch_size * SEND_BUFFER_SIZE)
+        self._name_area = bytearray(batch_size * SOCKADDR_SIZE)
+        self._control_area = bytearray(batch_size * CONTROL_BUFFER_SIZE)
+        self.recv_view = memoryview(self._recv_area)
+        self.send_view = memoryview(self._send_area)
+        self.name_view = memoryview(self._name_area)
+        self.control_view = memoryview(self._control_area)
+        
+        recv_base = ctypes.addressof(ctypes.c_char.from_buffer(self._recv_area))
+        send_base = ctypes.addressof(ctypes.c_char.from_buffer(self._send_area))
+        name_base = ctypes.addressof(ctypes.c_char.from_buffer(self._name_area))
+        control_base = ctypes.addressof(ctypes.c_char.from_buffer(self._control_area))
+        
+        self._recv_iov = (IOVec * batch_size)()
+        self._send_iov = (IOVec * batch_size)()
+        self._recv_msgs = (MMsgHdr * batch_size)()
+        self._send_msgs = (MMsgHdr * batch_size)()
+        
+        for i in range(batch_size):
+            self._recv_iov[i].iov_base = recv_base + i * RECV_BUFFER_SIZE
+            self._recv_iov[i].iov_len = RECV_BUFFER_SIZE
+            hdr = self._recv_msgs[i].msg_hdr
+            hdr.msg_name = name_base + i * SOCKADDR_SIZE
+            hdr.msg_namelen = SOCKADDR_SIZE
+            hdr.msg_iov = ctypes.pointer(self._recv_iov[i])
+            hdr.msg_iovlen = 1
+            hdr.msg_control = control_base + i * CONTROL_BUFFER_SIZE
+            hdr.msg_controllen = CONTROL_BUFFER_SIZE
+            
+            self._send_iov[i].iov_base = send_base + i * SEND_BUFFER_SIZE
+            self._send_iov[i].iov_len = SEND_BUFFER_SIZE
+            hdr = self._send_msgs[i].msg_hdr
+            hdr.msg_iov = ctypes.pointer(self._send_iov[i])
+            hdr.msg_iovlen = 1
+        
+        # 本批各响应对应请求的到达时间，供发送后统计处理延迟
+        self._arrivals = array('d', [0.0]) * batch_size
+        
+        # 批大小统计：按2的幂分桶
+        self._histogram = [0] * (batch_size.bit_length() + 1)
+        self.total_batches = 0
+        self.total_packets = 0
+        self.max_batch = 0
+        self.send_errors = 0
+    
+    def drain(self, handler: Callable[[memoryview, tuple, memoryview, float], Optional[bytes]],
+              before_send: Optional[Callable[[memoryview, int], None]] = None,
+              after_send: Optional[Callable[[array, int], None]] = None) -> int:
+        """
+        在套接字可读时调用：批量接收、逐个处理，再批量发送响应
+        
+        Args:
+            handler: 请求处理函数，参数为(数据, 客户端地址, 响应缓冲区, 到达时间)；
+                     应直接把响应写入给定的预分配缓冲区并返回它，无效请求返回None
+            before_send: 可选，sendmmsg之前调用，参数为(响应缓冲区, 响应个数)，
+                         用于在发送前一刻写入传输时间戳
+            after_send: 可选，sendmmsg之后调用，参数为(各响应对应请求的到达时间, 响应个数)
+        
+        Returns:
+            int: 本次处理的数据报总数
+        """
+        total = 0
+        while True:
+            received = self._recv()
+            if received <= 0:
+                break
+            total += received
+            
+            # 无内核时间戳时，以系统调用返回时刻作为整批的到达时间
+            fallback_arrival = time.time()
+            
+            recv_msgs = self._recv_msgs
+            send_msgs = self._send_msgs
+            pending = 0
+            for i in range(received):
+                length = recv_msgs[i].msg_len
+                offset = i * RECV_BUFFER_SIZE
+                name_offset = i * SOCKADDR_SIZE
+                addr = parse_sockaddr(self.name_view[name_offset:name_offset + SOCKADDR_SIZE])
+                
+                arrival = self._arrival_time(i) if self.kernel_timestamps else None
+                if arrival is None:
+                    arrival = fallback_arrival
+                
+                send_offset = pending * SEND_BUFFER_SIZE
+                send_buffer = self.send_view[send_offset:send_offset + SEND_BUFFER_SIZE]
+                response = handler(self.recv_view[offset:offset + length], addr, send_buffer, arrival)
+                if response is None:
+                    continue
+                
+                # 处理函数未使用预分配缓冲区时才需要复制
+                if response is not send_buffer:
+                    send_buffer[:len(response)] = response
+                self._send_iov[pending].iov_len = len(response)
+                
+                # 目的地址直接指向请求的地址缓冲区
+                send_hdr = send_msgs[pending].msg_hdr
+                recv_hdr = recv_msgs[i].msg_hdr
+                send_hdr.msg_name = recv_hdr.msg_name
+                send_hdr.msg_namelen = recv_hdr.msg_namelen
+                self._arrivals[pending] = arrival
+                pending += 1
+            
+            if pending:
+                if before_send is not None:
+                    before_send(self.send_view, pending)
+                self._send(pending)
+                if after_send is not None:
+                    after_send(self._arrivals, pending)
+            
+            self._record_batch(received)
+            if received < self.batch_size:
+                break
+        return total
+    
+    def _arrival_time(self, index: int) -> Optional[float]:
+        """
+        从辅助数据中取出内核接收时间戳
+        
+        Args:
+            index: 数据报在本批中的序号
+        
+        Returns:
+            Optional[float]: 到达时的系统时间，无时间戳时返回None
+        """
+        if self._recv_msgs[index].msg_hdr.msg_controllen < _CMSG_DATA_OFFSET + _TIMESPEC.size:
+            return None
+        offset = index * CONTROL_BUFFER_SIZE
+        _, level, cmsg_type = _CMSG_HEADER.unpack_from(self.control_view, offset)
+        if level != socket.SOL_SOCKET or cmsg_type != SCM_TIMESTAMPNS:
+            return None
+        seconds, nanoseconds = _TIMESPEC.unpack_from(self.control_view, offset + _CMSG_DATA_OFFSET)
+        return seconds + nanoseconds * 1e-9
+    
+    def _recv(self) -> int:
+        """批量接收，无数据时返回0"""
+        for i in range(self.batch_size):
+            hdr = self._recv_msgs[i].msg_hdr
+            hdr.msg_namelen = SOCKADDR_SIZE
+            hdr.msg_controllen = CONTROL_BUFFER_SIZE
+        
+        received = self._recvmmsg(self.fd, self._recv_msgs, self.batch_size, MSG_DONTWAIT, None)
+        if received < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return 0
+            raise OSError(err, f"recvmmsg失败: {errno.errorcode.get(err, err)}")
+        return received
+    
+    def _send(self, count: int):
+        """批量发送，发送缓冲区满时丢弃剩余响应（UDP语义）"""
+        sent_total = 0
+        while sent_total < count:
+            msgs = ctypes.cast(ctypes.byref(self._send_msgs, sent_total * ctypes.sizeof(MMsgHdr)),
+                               ctypes.POINTER(MMsgHdr))
+            sent = self._sendmmsg(self.fd, msgs, count - sent_total, MSG_DONTWAIT)
+            if sent < 0 and ctypes.get_errno() == errno.EINTR:
+                continue
+            if sent <= 0:
+                self.send_errors += count - sent_total
+                return
+            sent_total += sent
+    
+    def _record_batch(self, size: int):
+        """记录批大小"""
+        self._histogram[size.bit_length()] += 1
+        self.total_batches += 1
+        self.total_packets += size
+        if size > self.max_batch:
+            self.max_batch = size
+    
+    def get_stats(self) -> Dict:
+        """
+        获取批量I/O统计
+        
+        Returns:
+            Dict: 批次数、数据报数、平均/最大批大小及批大小分布
+        """
+        histogram = {}
+        for bucket, count in enumerate(self._histogram):
+            if count:
+                upper = (1 << bucket) - 1 if bucket else 0
+                histogram[f"<={upper}"] = count
+        return {
+            'batch_size': self.batch_size,
+            'kernel_timestamps': self.kernel_timestamps,
+            'batches': self.total_batches,
+            'packets': self.total_packets,
+            'avg_batch': self.total_packets / self.total_batches if self.total_batches else 0.0,
+            'max_batch': self.max_batch,
+            'send_errors': self.send_errors,
+            'histogram': histogram
+        }
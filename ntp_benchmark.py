@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NTP服务器微基准测试
+离线测量数据包创建/解析、读取时钟、统计更新与完整请求处理的每次操作耗时（ns/op），
+覆盖多个线程数，并换算为同一次运行中固定校准循环的倍数后与仓库中的基线比较；
+加上--check时热点路径变慢超过阈值以非零状态退出
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, List
+
+import ntp_metrics
+from ntp_server import NTPServer
+
+# 基线文件（与本脚本位于同一目录）
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# 默认测量的线程数
+THREAD_COUNTS = (1, 2, 4, 8)
+
+# 每个测量重复的次数，取中位数以减少噪声
+REPEAT = 7
+
+# 生成基线时的重复次数，基线的噪声会影响之后的每一次比较
+BASELINE_REPEAT = 15
+
+# 默认允许的变慢比例，超过则视为性能回归
+DEFAULT_THRESHOLD = 0.30
+
+# 允许的变慢比例至少为本次与基线中较大的离散程度的倍数，噪声大的机器上阈值随之放宽
+SPREAD_FACTOR = 3.0
+
+# 校准循环的迭代次数；每次测量前后各运行一次，用于抵消机器整体快慢（如CPU降频、其他负载）的变化
+CALIBRATION_OPERATIONS = 20000
+
+# 请求处理基准中轮流使用的客户端地址数
+CLIENT_ADDRESSES = 1024
+
+
+def _make_benchmarks(server: NTPServer) -> Dict[str, Callable[[int], Callable[[], None]]]:
+    """
+    构建各基准的操作
+    
+    每个基准是一个工厂函数，参数为线程序号，返回该线程反复调用的无参操作；
+    每个线程使用自己的缓冲区与客户端地址，与真实的服务线程一致
+    
+    Args:
+        server: 不联网、不限速的NTPServer实例
+    
+    Returns:
+        Dict: 基准名称到工厂函数的映射
+    """
+    request = server.create_ntp_packet(mode=3)
+    # 所有线程与每次测量共用一个递增的传输时间戳，否则重复的请求会被当作重放丢弃
+    transmits = itertools.count(time.time_ns())
+    
+    def create_packet(_):
+        return lambda: server.create_ntp_packet(mode=4)
+    
+    def parse_packet(_):
+        return lambda: server.parse_ntp_packet(request)
+    
+    def current_time(_):
+        return server.get_current_time
+    
+    def stats_update(thread_index):
+        counters = server.counters.acquire()
+        addresses = [f"10.{thread_index}.{i // 256}.{i % 256}" for i in range(CLIENT_ADDRESSES)]
+        state = {'i': 0}
+        
+        def update():
+            i = state['i'] = (state['i'] + 1) % CLIENT_ADDRESSES
+            now = time.time()
+            ntp_metrics.record_request(counters, 3, 4, now)
+            server.client_table.record(addresses[i], 4, now)
+        return update
+    
+    def handle_request(thread_index):
+        buffer = bytearray(48)
+        addresses = [(f"10.{thread_index}.{i // 256}.{i % 256}", 123) for i in range(CLIENT_ADDRESSES)]
+        packet = bytearray(request)
+        state = {'i': 0}
+        
+        def handle():
+            i = state['i'] = (state['i'] + 1) % CLIENT_ADDRESSES
+            struct.pack_into('!Q', packet, 40, next(transmits))
+            server.handle_request(packet, addresses[i], buffer, time.time())
+        return handle
+    
+    return {
+        'create_ntp_packet': create_packet,
+        'parse_ntp_packet': parse_packet,
+        'get_current_time': current_time,
+        'stats_update': stats_update,
+        'handle_request': handle_request
+    }
+
+
+def _calibrate() -> float:
+    """
+    运行固定的校准循环（打包时间戳并读回一个字节，与热点路径的操作类型相近）
+    
+    Returns:
+        float: 每次迭代的耗时（ns）
+    """
+    buffer = bytearray(48)
+    total = 0
+    start = time.perf_counter_ns()
+    for i in range(CALIBRATION_OPERATIONS):
+        struct.pack_into('!Q', buffer, 40, i)
+        total += buffer[47]
+    return (time.perf_counter_ns() - start) / CALIBRATION_OPERATIONS
+
+
+def _spread(values: List[float]) -> float:
+    """
+    相对离散程度：四分位距除以中位数
+    
+    Args:
+        values: 各次重复的测量值
+    
+    Returns:
+        float: 相对离散程度，少于2个值时为0
+    """
+    if len(values) < 2:
+        return 0.0
+    ordered = sorted(values)
+    half = len(ordered) // 2
+    # 下半部分与上半部分各自的中位数（个数为奇数时两部分都不含中位数本身）
+    q1 = statistics.median(ordered[:half])
+    q3 = statistics.median(ordered[-half:])
+    return (q3 - q1) / statistics.median(ordered)
+
+
+def _measure(factory: Callable[[int], Callable[[], None]], threads: int, operations: int) -> float:
+    """
+    用指定线程数运行一次测量
+    
+    Args:
+        factory: 基准的工厂函数
+        threads: 线程数
+        operations: 每个线程执行的操作数
+    
+    Returns:
+        float: 总耗时除以总操作数（ns/op），多线程时反映整体吞吐
+    """
+    operations_by_thread = [factory(index) for index in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+    
+    def run(operation):
+        barrier.wait()
+        for _ in range(operations):
+            operation()
+    
+    workers = [threading.Thread(target=run, args=(operation,)) for operation in operations_by_thread]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter_ns()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter_ns() - start
+    return elapsed / (operations * threads)
+
+
+def run_benchmarks(thread_counts=THREAD_COUNTS, operations: int = 20000, repeat: int = REPEAT,
+                   names: List[str] = None, keys: List[str] = None) -> Dict[str, Dict[str, float]]:
+    """
+    运行全部基准
+    
+    Args:
+        thread_counts: 要测量的线程数
+        operations: 每个线程每次测量执行的操作数
+        repeat: 每项测量的重复次数，取中位数
+        names: 只运行指定名称的基准，None表示全部
+        keys: 只运行指定的“基准名称@线程数”，None表示全部
+    
+    Returns:
+        Dict: “基准名称@线程数”到测量结果的映射；结果包含ns/op（ns_per_op）、
+              相对校准循环的倍数（relative）及其相对离散程度（spread），均为各次重复的中位数
+    """
+    # 不限速，避免请求处理基准混入KoD与丢弃路径
+    server = NTPServer(host='127.0.0.1', port=0, rate_limit=0)
+    benchmarks = _make_benchmarks(server)
+    
+    results = {}
+    for name, factory in benchmarks.items():
+        if names and name not in names:
+            continue
+        for threads in thread_counts:
+            key = f"{name}@{threads}"
+            if keys and key not in keys:
+                continue
+            # 预热一次，使客户端表与计数分片就绪
+            _measure(factory, threads, min(operations, 1000))
+            samples = []
+            relatives = []
+            for _ in range(repeat):
+                before = _calibrate()
+                value = _measure(factory, threads, operations)
+                calibration = (before + _calibrate()) / 2
+                samples.append(value)
+                relatives.append(value / calibration)
+            results[key] = {
+                'ns_per_op': statistics.median(samples),
+                'relative': statistics.median(relatives),
+                'spread': _spread(relatives)
+            }
+    return results
+
+
+def load_baseline(path: str = BASELINE_FILE) -> Dict:
+    """
+    读取基线文件
+    
+    Returns:
+        Dict: 基线内容，文件不存在时返回空字典；只记录了ns/op的旧格式基线无法与校准后的结果比较，
+              其中的条目被忽略
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    baseline['results'] = {name: entry for name, entry in baseline.get('results', {}).items()
+                           if isinstance(entry, dict)}
+    return baseline
+
+
+def save_baseline(results: Dict[str, Dict[str, float]], path: str = BASELINE_FILE):
+    """把测量结果写入基线文件"""
+    baseline = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': {
+            name: {
+                'ns_per_op': round(entry['ns_per_op'], 1),
+                'relative': round(entry['relative'], 3),
+                'spread': round(entry['spread'], 3)
+            }
+            for name, entry in sorted(results.items())
+        }
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, ensure_ascii=False)
+        f.write('\n')
+
+
+def allowed_slowdown(entry: Dict[str, float], base: Dict[str, float], threshold: float) -> float:
+    """
+    某项基准允许的变慢比例
+    
+    Args:
+        entry: 本次测量结果
+        base: 基线结果
+        threshold: 最小的允许变慢比例
+    
+    Returns:
+        float: threshold与SPREAD_FACTOR倍离散程度中的较大者
+    """
+    return max(threshold, SPREAD_FACTOR * max(entry['spread'], base['spread']))
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> List[str]:
+    """
+    按相对校准循环的倍数与基线比较
+    
+    Args:
+        results: 本次测量结果
+        baseline: 基线结果
+        threshold: 最小的允许变慢比例
+    
+    Returns:
+        List[str]: 超过允许变慢比例的基准名称
+    """
+    return [name for name, entry in results.items()
+            if name in baseline and entry['relative'] > baseline[name]['relative']
+            * (1 + allowed_slowdown(entry, baseline[name], threshold))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NTP服务器微基准测试')
+    parser.add_argument('-t', '--threads', type=int, nargs='+', default=list(THREAD_COUNTS),
+                        help=f'要测量的线程数 (默认: {" ".join(map(str, THREAD_COUNTS))})')
+    parser.add_argument('-n', '--operations', type=int, default=20000,
+                        help='每个线程每次测量执行的操作数 (默认: 20000)')
+    parser.add_argument('-r', '--repeat', type=int, default=None,
+                        help=f'每项测量的重复次数，取中位数 (默认: {REPEAT}，--save时为{BASELINE_REPEAT})')
+    parser.add_argument('-b', '--benchmark', action='append', default=None,
+                        help='只运行指定的基准，可重复指定')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'最小的允许变慢比例，离散程度大时按其{SPREAD_FACTOR:g}倍放宽 '
+                             f'(默认: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--check', action='store_true', help='有基准超过允许的变慢比例时以非零状态退出')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='基线文件路径')
+    parser.add_argument('--save', action='store_true', help='把本次结果保存为新的基线')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args()
+    repeat = args.repeat or (BASELINE_REPEAT if args.save else REPEAT)
+    
+    results = run_benchmarks(args.threads, args.operations, repeat, args.benchmark)
+    baseline = load_baseline(args.baseline).get('results', {})
+    regressions = compare(results, baseline, args.threshold)
+    if regressions and not args.save:
+        # 复测超过阈值的项，排除偶发的调度噪声
+        retry = run_benchmarks(args.threads, args.operations, repeat, keys=regressions)
+        for key, entry in retry.items():
+            if entry['relative'] < results[key]['relative']:
+                results[key] = entry
+        regressions = compare(results, baseline, args.threshold)
+    
+    if args.json:
+        print(json.dumps({'results': results, 'baseline': baseline, 'regressions': regressions},
+                         indent=2, ensure_ascii=False))
+    else:
+        print(f"{'基准':<24} {'ns/op':>10} {'倍数':>8} {'基线':>8} {'变化':>8} {'允许':>8}")
+        for name, entry in results.items():
+            base = baseline.get(name)
+            if base is not None:
+                change = entry['relative'] / base['relative'] - 1
+                allowed = allowed_slowdown(entry, base, args.threshold)
+                mark = '  ✗' if name in regressions else ''
+                print(f"{name:<24} {entry['ns_per_op']:>10.1f} {entry['relative']:>8.2f} "
+                      f"{base['relative']:>8.2f} {change:>+8.1%} {allowed:>+8.0%}{mark}")
+            else:
+                print(f"{name:<24} {entry['ns_per_op']:>10.1f} {entry['relative']:>8.2f} "
+                      f"{'-':>8} {'-':>8} {'-':>8}")
+    
+    if args.save:
+        save_baseline(results, args.baseline)
+        print(f"已保存基线: {args.baseline}")
+        return
+    
+    if not args.json:
+        if regressions:
+            print(f"\n✗ {len(regressions)} 项基准比基线慢且超过允许的变慢比例: {', '.join(regressions)}")
+        elif baseline:
+            print("\n✓ 所有基准均未超过允许的变慢比例")
+        else:
+            print("\n基线文件中没有可比较的结果，请先用--save生成基线")
+    if regressions and args.check:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
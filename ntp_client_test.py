@@ -12,7 +12,10 @@ import ntplib
 from datetime import datetime
 import argparse
 
-def create_ntp_request() -> bytes:
+# NTP纪元(1900-01-01)与Unix纪元(1970-01-01)之间的秒数
+NTP_EPOCH_OFFSET = 2208988800
+
+def create_ntp_request(xmit_time: float = None) -> bytes:
     """创建NTP请求数据包"""
     packet = bytearray(48)
     
@@ -26,8 +29,9 @@ def create_ntp_request() -> bytes:
     packet[3] = 0xFA  # 2^-6 = 15.625ms
     
     # 传输时间戳
-    xmit_time = time.time()
-    struct.pack_into('!Q', packet, 40, int(xmit_time * 2**32))
+    if xmit_time is None:
+        xmit_time = time.time()
+    struct.pack_into('!Q', packet, 40, int((xmit_time + NTP_EPOCH_OFFSET) * 2**32))
     
     return bytes(packet)
 
@@ -36,11 +40,11 @@ def parse_ntp_response(data: bytes) -> dict:
     if len(data) < 48:
         return None
     
-    # 解析时间戳
-    ref_time = struct.unpack('!Q', data[16:24])[0] / 2**32
-    orig_time = struct.unpack('!Q', data[24:32])[0] / 2**32
-    recv_time = struct.unpack('!Q', data[32:40])[0] / 2**32
-    xmit_time = struct.unpack('!Q', data[40:48])[0] / 2**32
+    # 解析时间戳（转换为Unix时间）
+    ref_time = struct.unpack('!Q', data[16:24])[0] / 2**32 - NTP_EPOCH_OFFSET
+    orig_time = struct.unpack('!Q', data[24:32])[0] / 2**32 - NTP_EPOCH_OFFSET
+    recv_time = struct.unpack('!Q', data[32:40])[0] / 2**32 - NTP_EPOCH_OFFSET
+    xmit_time = struct.unpack('!Q', data[40:48])[0] / 2**32 - NTP_EPOCH_OFFSET
     
     return {
         'ref_time': ref_time,
@@ -49,26 +53,29 @@ def parse_ntp_response(data: bytes) -> dict:
         'xmit_time': xmit_time
     }
 
-def test_ntp_server(host: str, port: int = 123, timeout: int = 5):
+def test_ntp_server(host: str, port: int = 123, timeout: int = 5, protocol: str = 'udp'):
     """测试NTP服务器"""
-    print(f"正在测试NTP服务器 {host}:{port}...")
+    print(f"正在测试NTP服务器 {host}:{port} ({protocol.upper()})...")
     
     try:
         # 创建套接字
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock_type = socket.SOCK_STREAM if protocol == 'tcp' else socket.SOCK_DGRAM
+        sock = socket.socket(socket.AF_INET, sock_type)
         sock.settimeout(timeout)
         
-        # 连接服务器
+        # 连接服务器（UDP下仅设置默认目的地址）
         sock.connect((host, port))
         print(f"✓ 成功连接到 {host}:{port}")
         
         # 发送NTP请求
-        request = create_ntp_request()
+        t1 = time.time()  # 发送时间
+        request = create_ntp_request(t1)
         sock.send(request)
         print("✓ 已发送NTP请求")
         
         # 接收响应
         response = sock.recv(1024)
+        t4 = time.time()  # 接收时间
         sock.close()
         
         if not response:
@@ -82,10 +89,8 @@ def test_ntp_server(host: str, port: int = 123, timeout: int = 5):
             return False
         
         # 计算时间偏移
-        t1 = time.time()  # 发送时间
         t2 = ntp_data['recv_time']  # 服务器接收时间
         t3 = ntp_data['xmit_time']  # 服务器发送时间
-        t4 = time.time()  # 接收时间
         
         delay = (t4 - t1) - (t3 - t2)
         offset = ((t2 - t1) + (t3 - t4)) / 2
@@ -134,6 +139,8 @@ def main():
                        help='连接超时时间 (默认: 5秒)')
     parser.add_argument('--compare', action='store_true',
                        help='同时测试公共NTP服务器进行对比')
+    parser.add_argument('--tcp', action='store_true',
+                       help='使用TCP代替UDP（用于旧版TCP模式的服务器）')
     
     args = parser.parse_args()
     
@@ -141,7 +148,8 @@ def main():
     print("="*50)
     
     # 测试指定的NTP服务器
-    success = test_ntp_server(args.host, args.port, args.timeout)
+    success = test_ntp_server(args.host, args.port, args.timeout,
+                              'tcp' if args.tcp else 'udp')
     
     if args.compare:
         test_public_ntp_servers()
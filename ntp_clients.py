@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NTP客户端统计表
+按客户端IP记录请求数、首次/最近访问时间、轮询间隔与NTP版本，
+容量固定，超出时淘汰最久未访问的客户端
+"""
+
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict
+
+# 默认最多记录的客户端数
+DEFAULT_CAPACITY = 10000
+
+# 分片数，每个分片有独立的锁与LRU链表
+SHARDS = 16
+
+
+class ClientRecord:
+    """单个客户端的统计记录"""
+    
+    __slots__ = ('address', 'requests', 'first_seen', 'last_seen', 'poll_interval', 'version')
+    
+    def __init__(self, address: str, now: float, version: int):
+        self.address = address
+        self.requests = 1
+        self.first_seen = now
+        self.last_seen = now
+        self.poll_interval = 0.0
+        self.version = version
+    
+    def request_rate(self, now: float) -> float:
+        """平均请求速率（次/秒），观测时间不足1秒按1秒计"""
+        return self.requests / max(now - self.first_seen, 1.0)
+    
+    def to_dict(self, now: float) -> Dict:
+        """
+        导出客户端统计
+        
+        Args:
+            now: 当前时间，用于计算请求速率
+        
+        Returns:
+            Dict: 客户端统计信息
+        """
+        return {
+            'address': self.address,
+            'requests': self.requests,
+            'request_rate': self.request_rate(now),
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'poll_interval': self.poll_interval,
+            'version': self.version
+        }
+
+
+class ClientTable:
+    """
+    容量固定的客户端统计表
+    
+    按IP哈希分为若干分片，每个分片是一个带独立锁的LRU表，
+    更新为O(1)且不同客户端之间没有全局锁竞争；总容量平均分配到各分片。
+    """
+    
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, shards: int = SHARDS):
+        """
+        初始化客户端统计表
+        
+        Args:
+            capacity: 最多记录的客户端数
+            shards: 分片数
+        """
+        self.capacity = capacity
+        self._shard_capacity = max(capacity // shards, 1)
+        self._shards = [OrderedDict() for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self.evicted = 0
+    
+    def record(self, address: str, version: int, now: float):
+        """
+        记录一次客户端请求
+        
+        Args:
+            address: 客户端IP
+            version: 请求的NTP版本号
+            now: 请求到达的本地时间
+        """
+        index = hash(address) % len(self._shards)
+        shard = self._shards[index]
+        with self._locks[index]:
+            record = shard.get(address)
+            if record is None:
+                shard[address] = ClientRecord(address, now, version)
+                if len(shard) > self._shard_capacity:
+                    shard.popitem(last=False)
+                    self.evicted += 1
+                return
+            
+            shard.move_to_end(address)
+            record.requests += 1
+            record.poll_interval = now - record.last_seen
+            record.last_seen = now
+            record.version = version
+    
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+    
+    def count_active(self, since: float) -> int:
+        """
+        统计指定时间之后有请求的客户端数
+        
+        Args:
+            since: 起始时间（Unix时间）
+        
+        Returns:
+            int: 客户端数
+        """
+        count = 0
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                # LRU顺序：从最近访问的一端向前数，遇到更早的记录即可停止
+                for record in reversed(shard.values()):
+                    if record.last_seen < since:
+                        break
+                    count += 1
+        return count
+    
+    def top(self, page: int = 1, per_page: int = 50) -> Dict:
+        """
+        按请求速率降序分页返回客户端
+        
+        Args:
+            page: 页码，从1开始
+            per_page: 每页数量
+        
+        Returns:
+            Dict: 客户端总数、页码与本页客户端列表
+        """
+        now = time.time()
+        records = []
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                records.extend(record.to_dict(now) for record in shard.values())
+        
+        start = (page - 1) * per_page
+        ranked = heapq.nlargest(start + per_page, records, key=lambda record: record['request_rate'])
+        return {
+            'total': len(records),
+            'page': page,
+            'per_page': per_page,
+            'clients': ranked[start:]
+        }
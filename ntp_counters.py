@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分片计数器
+每个写线程独占一个计数分片，自增时不加锁；读取时才把所有分片按位置汇总。
+多进程模式下各工作进程的分片位于共享内存中，主进程无需进程间通信即可汇总
+"""
+
+import threading
+from array import array
+from typing import List, Sequence
+
+
+def shared_views(raw, size: int, count: int) -> List[memoryview]:
+    """
+    把共享内存数组切分为若干个计数分片视图
+    
+    Args:
+        raw: multiprocessing的RawArray('Q', size * count)
+        size: 每个分片的计数个数
+        count: 分片数
+    
+    Returns:
+        List[memoryview]: 可直接读写共享内存的分片视图
+    """
+    view = memoryview(raw).cast('B').cast('Q')
+    return [view[i * size:(i + 1) * size] for i in range(count)]
+
+
+class ShardedCounters:
+    """
+    按线程分片的计数器
+    
+    分片通过acquire/release在线程间借还，任一时刻每个分片只有一个写者；
+    也可以用bind把共享内存中的分片绑定给当前线程。
+    """
+    
+    def __init__(self, size: int, max_indexes: Sequence[int] = ()):
+        """
+        初始化分片计数器
+        
+        Args:
+            size: 每个分片的计数个数
+            max_indexes: 汇总时取最大值而非求和的位置（如最近时间）
+        """
+        self.size = size
+        self.max_indexes = tuple(max_indexes)
+        self._shards = []
+        self._free = []
+        self._remote = []
+        self._lock = threading.Lock()  # 只保护分片的借还，不参与计数
+        self._local = threading.local()
+    
+    def acquire(self):
+        """
+        借出一个空闲分片，没有时新建
+        
+        Returns:
+            本线程独占的计数分片
+        """
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            shard = array('Q', [0]) * self.size
+            self._shards.append(shard)
+            return shard
+    
+    def release(self, shard):
+        """归还分片，其计数保留并继续参与汇总"""
+        with self._lock:
+            self._free.append(shard)
+    
+    def bind(self, shard):
+        """把分片绑定为当前线程的计数分片"""
+        self._local.shard = shard
+    
+    def local(self):
+        """
+        获取当前线程的计数分片，首次调用时借出一个并在线程生命周期内保留
+        
+        Returns:
+            当前线程的计数分片
+        """
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = self.acquire()
+            return shard
+    
+    def add_remote(self, shards: Sequence):
+        """登记其他进程写入的分片（共享内存视图），汇总时一并计入"""
+        with self._lock:
+            self._remote.extend(shards)
+    
+    def snapshot(self) -> List[int]:
+        """
+        汇总所有分片
+        
+        Returns:
+            List[int]: 各位置的合计值（max_indexes中的位置取最大值）
+        """
+        with self._lock:
+            shards = self._shards + self._remote
+        
+        rows = [shard.tolist() for shard in shards]
+        if not rows:
+            return [0] * self.size
+        
+        total = [sum(column) for column in zip(*rows)]
+        for i in self.max_indexes:
+            total[i] = max(row[i] for row in rows)
+        return total
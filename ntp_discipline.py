@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NTP时钟驯服算法
+根据连续的同步结果估计本地振荡器的频率偏差，小偏差平滑调整（slew），大偏差直接跳变（step）
+"""
+
+import time
+from typing import NamedTuple
+
+# 残差超过此值（秒）时直接跳变，而不是平滑调整
+STEP_THRESHOLD = 0.128
+
+# 频率校正上限（秒/秒），即±500ppm
+MAX_FREQUENCY = 500e-6
+
+# 平滑调整的最大速率（秒/秒）
+MAX_SLEW_RATE = 500e-6
+
+# 平滑调整的最短持续时间（秒）
+MIN_SLEW_DURATION = 1.0
+
+# 两次更新间隔不足此值（秒）时不更新频率，避免噪声主导频率估计
+MIN_FREQUENCY_INTERVAL = 16.0
+
+# 频率环路增益，每次只吸收部分频率误差以抑制测量噪声
+FREQUENCY_GAIN = 0.25
+
+
+class Correction(NamedTuple):
+    """一次驯服更新后的时钟校正参数"""
+    time_offset: float     # 相位基准：epoch时刻相对系统时钟的偏移量
+    frequency: float       # 频率校正（秒/秒）
+    epoch: float           # 基准时刻（time.monotonic()）
+    slew: float            # 待平滑调整的残差（秒）
+    slew_duration: float   # 平滑调整的持续时间（秒）
+    residual: float        # 本次测得的残差（秒）
+    stepped: bool          # 本次是否跳变
+
+
+def correction_at(time_offset: float, frequency: float, epoch: float, slew: float,
+                  slew_duration: float, monotonic_now: float) -> float:
+    """
+    计算给定时刻相对系统时钟的总校正量
+    
+    Args:
+        time_offset: 相位基准
+        frequency: 频率校正
+        epoch: 基准时刻
+        slew: 待平滑调整的残差
+        slew_duration: 平滑调整的持续时间
+        monotonic_now: 当前单调时钟
+    
+    Returns:
+        float: 总校正量（秒）
+    """
+    elapsed = monotonic_now - epoch
+    correction = time_offset + frequency * elapsed
+    if slew:
+        correction += slew * min(elapsed / slew_duration, 1.0)
+    return correction
+
+
+class ClockDiscipline:
+    """
+    时钟驯服环路
+    
+    相位：残差小于跳变阈值时以不超过500ppm的速率平滑调整，否则直接跳变；
+    频率：以两次更新之间累积的残差估计振荡器频率偏差（FLL），使同步间隔内的时间持续被修正。
+    """
+    
+    def __init__(self):
+        self.frequency = 0.0
+        self.last_update = None
+        self.last_residual = 0.0
+        self.warm = False
+    
+    def restore(self, frequency: float):
+        """
+        热启动：沿用上次运行估计的频率
+        
+        此后的首次更新在残差不超过跳变阈值时平滑调整而不跳变；
+        该次残差包含恢复状态本身的误差，不计入频率估计
+        
+        Args:
+            frequency: 保存的频率校正（秒/秒）
+        """
+        self.frequency = max(-MAX_FREQUENCY, min(MAX_FREQUENCY, frequency))
+        self.warm = True
+    
+    def update(self, measured_offset: float, time_offset: float, frequency: float, epoch: float,
+               slew: float, slew_duration: float) -> Correction:
+        """
+        根据新的测量结果更新校正参数
+        
+        Args:
+            measured_offset: 时钟选择得到的准确时间相对系统时钟的偏移量
+            time_offset: 当前相位基准
+            frequency: 当前频率校正
+            epoch: 当前基准时刻
+            slew: 当前待平滑调整的残差
+            slew_duration: 当前平滑调整的持续时间
+        
+        Returns:
+            Correction: 新的校正参数
+        """
+        now = time.monotonic()
+        current = correction_at(time_offset, frequency, epoch, slew, slew_duration, now)
+        residual = measured_offset - current
+        self.last_residual = residual
+        
+        if (self.last_update is None and not self.warm) or abs(residual) > STEP_THRESHOLD:
+            # 冷启动后的首次同步或偏差过大：直接跳变到测量值，频率估计重新开始
+            if self.last_update is not None:
+                self.frequency = 0.0
+            self.last_update = now
+            return Correction(measured_offset, self.frequency, now, 0.0, MIN_SLEW_DURATION,
+                              residual, True)
+        
+        # 残差是自上次更新以来累积的误差（热启动后的首次更新没有可比的上次更新）
+        interval = now - self.last_update if self.last_update is not None else 0.0
+        if interval >= MIN_FREQUENCY_INTERVAL:
+            # 尚未完成的平滑调整不属于频率误差
+            if slew:
+                remaining = slew * (1.0 - min((now - epoch) / slew_duration, 1.0))
+            else:
+                remaining = 0.0
+            frequency_error = (residual - remaining) / interval
+            self.frequency += FREQUENCY_GAIN * frequency_error
+            self.frequency = max(-MAX_FREQUENCY, min(MAX_FREQUENCY, self.frequency))
+        self.last_update = now
+        
+        # 以当前校正量为新基准保证服务时间连续，残差在若干秒内平滑吸收
+        duration = max(abs(residual) / MAX_SLEW_RATE, MIN_SLEW_DURATION)
+        return Correction(current, self.frequency, now, residual, duration, residual, False)
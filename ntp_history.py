@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NTP服务器指标历史
+每个指标在1秒/1分钟/1小时三个精度上各有一个容量固定的环形缓冲区（array数组），
+写入时同时累加到三个精度的时间槽中，长时间运行内存占用也保持不变
+"""
+
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+
+# 精度层级：(时间槽长度（秒）, 槽数)，分别保留1小时、1天、90天
+TIERS = ((1, 3600), (60, 1440), (3600, 2160))
+
+# 系统指标
+METRICS = ('offset', 'jitter', 'root_dispersion', 'qps', 'clients')
+
+# 按上游地址区分的指标，序列名为“指标:地址”
+PEER_METRICS = ('peer_offset', 'peer_delay', 'peer_jitter')
+
+# 查询时间范围的单位
+_RANGE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_range(text: str) -> int:
+    """
+    解析查询时间范围
+    
+    Args:
+        text: 秒数，或带单位的数值，如'30m'、'6h'、'7d'
+    
+    Returns:
+        int: 时间范围（秒）
+    
+    Raises:
+        ValueError: 格式无效或不为正数
+    """
+    text = text.strip().lower()
+    unit = _RANGE_UNITS.get(text[-1:])
+    try:
+        seconds = int(float(text[:-1]) * unit) if unit else int(text)
+    except (ValueError, OverflowError):
+        raise ValueError(f"时间范围无效: {text}")
+    if seconds <= 0:
+        raise ValueError(f"时间范围必须为正数: {text}")
+    return seconds
+
+
+class RingBuffer:
+    """
+    单个精度的环形缓冲区
+    
+    第n个时间槽位于下标n % 槽数处，同时记录槽号以识别已被覆盖的旧数据；
+    同一时间槽内的多个值累加，查询时取平均值
+    """
+    
+    __slots__ = ('resolution', 'capacity', '_slots', '_sums', '_counts')
+    
+    def __init__(self, resolution: int, capacity: int):
+        """
+        初始化环形缓冲区
+        
+        Args:
+            resolution: 时间槽长度（秒）
+            capacity: 槽数
+        """
+        self.resolution = resolution
+        self.capacity = capacity
+        self._slots = array('q', [-1]) * capacity
+        self._sums = array('d', [0.0]) * capacity
+        self._counts = array('L', [0]) * capacity
+    
+    def add(self, timestamp: float, value: float):
+        """把值累加到时间戳所在的时间槽"""
+        slot = int(timestamp // self.resolution)
+        index = slot % self.capacity
+        if self._slots[index] != slot:
+            self._slots[index] = slot
+            self._sums[index] = value
+            self._counts[index] = 1
+        else:
+            self._sums[index] += value
+            self._counts[index] += 1
+    
+    def query(self, start: float, end: float) -> Dict[int, float]:
+        """
+        读取时间范围内有数据的时间槽
+        
+        Args:
+            start: 起始时间（Unix时间）
+            end: 结束时间（Unix时间）
+        
+        Returns:
+            Dict[int, float]: 时间槽起始时间到该槽平均值的映射
+        """
+        first = max(int(start // self.resolution), int(end // self.resolution) - self.capacity + 1)
+        last = int(end // self.resolution)
+        values = {}
+        for slot in range(first, last + 1):
+            index = slot % self.capacity
+            if self._slots[index] == slot:
+                values[slot * self.resolution] = self._sums[index] / self._counts[index]
+        return values
+
+
+class History:
+    """
+    指标历史
+    
+    序列在首次写入时创建，每个序列在每个精度上各占一个RingBuffer；
+    写入为O(1)，查询按时间范围选择能覆盖该范围的最高精度
+    """
+    
+    def __init__(self, tiers=TIERS):
+        """
+        初始化指标历史
+        
+        Args:
+            tiers: 精度层级，(时间槽长度（秒）, 槽数)按精度从高到低排列
+        """
+        self.tiers = tiers
+        self._series: Dict[str, List[RingBuffer]] = {}
+        self._lock = threading.Lock()
+    
+    def record(self, name: str, value: float, now: Optional[float] = None):
+        """
+        记录一个指标值
+        
+        Args:
+            name: 序列名，系统指标为指标名，上游指标为“指标:地址”
+            value: 指标值
+            now: 时间戳（Unix时间），None表示当前时间
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            buffers = self._series.get(name)
+            if buffers is None:
+                buffers = self._series[name] = [RingBuffer(resolution, capacity)
+                                                for resolution, capacity in self.tiers]
+            for buffer in buffers:
+                buffer.add(now, value)
+    
+    def remove_peer(self, address: str):
+        """
+        删除某个上游的全部序列（该上游不再使用时调用，使序列数保持有界）
+        
+        Args:
+            address: 上游地址
+        """
+        names = [f"{metric}:{address}" for metric in PEER_METRICS]
+        with self._lock:
+            for name in names:
+                self._series.pop(name, None)
+    
+    def query(self, metric: str, range_seconds: int, now: Optional[float] = None) -> Dict:
+        """
+        按列查询指标历史
+        
+        Args:
+            metric: METRICS或PEER_METRICS中的指标名
+            range_seconds: 时间范围（秒），截至当前时间
+            now: 结束时间（Unix时间），None表示当前时间
+        
+        Returns:
+            Dict: 精度、时间列与各序列的数值列（无数据的时间点为None）；
+                  上游指标按地址各占一列，系统指标只有一列
+        
+        Raises:
+            ValueError: 未知的指标名
+        """
+        if metric not in METRICS and metric not in PEER_METRICS:
+            raise ValueError(f"未知的指标: {metric}")
+        if now is None:
+            now = time.time()
+        
+        # 选择能覆盖整个范围的最高精度，超过最长保留时间时使用最低精度
+        tier = len(self.tiers) - 1
+        for index, (resolution, capacity) in enumerate(self.tiers):
+            if resolution * capacity >= range_seconds:
+                tier = index
+                break
+        
+        with self._lock:
+            if metric in METRICS:
+                names = {metric: metric} if metric in self._series else {}
+            else:
+                names = {name.split(':', 1)[1]: name for name in self._series
+                         if name.startswith(metric + ':')}
+            series = {label: self._series[name][tier].query(now - range_seconds, now)
+                      for label, name in sorted(names.items())}
+        
+        timestamps = sorted(set().union(*series.values())) if series else []
+        return {
+            'metric': metric,
+            'range': range_seconds,
+            'resolution': self.tiers[tier][0],
+            't': timestamps,
+            'columns': {label: [values.get(timestamp) for timestamp in timestamps]
+                        for label, values in series.items()}
+        }
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NTP请求日志（二进制）
+固定大小的内存映射环形缓冲区，每个请求写入一条定长记录；
+写入只是对映射内存的赋值，不产生系统调用。
+同时作为命令行工具：按分钟统计QPS、客户端数与处理延迟，或把记录作为负载回放到测试服务器
+"""
+
+import argparse
+import itertools
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, NamedTuple
+
+import ntp_ratelimit
+
+# 文件头：魔数、格式版本、记录长度、容量（记录数）、已写入的记录总数
+HEADER = struct.Struct('<4sHHQQ8x')
+MAGIC = b'NTPJ'
+FORMAT_VERSION = 1
+COUNT_OFFSET = 16
+_COUNT_STRUCT = struct.Struct('<Q')
+
+# 记录：到达时间、客户端IPv4、端口、NTP版本、模式、处理结果、客户端传输时间戳（原始64位值）、处理耗时（纳秒）
+RECORD = struct.Struct('<d4sHBBBxxxQI')
+
+# 默认容量（记录数），约32MB
+DEFAULT_CAPACITY = 1 << 20
+
+# NTP纪元(1900-01-01)与Unix纪元(1970-01-01)之间的秒数
+NTP_EPOCH_OFFSET = 2208988800
+
+# 处理耗时字段的上限（纳秒）
+_MAX_PROCESSING_NS = 0xFFFFFFFF
+
+
+class JournalRecord(NamedTuple):
+    """一条请求记录"""
+    timestamp: float
+    address: str
+    port: int
+    version: int
+    mode: int
+    verdict: int
+    transmit: int
+    processing_ns: int
+
+
+class Journal:
+    """
+    请求日志写入端
+    
+    记录按序号取模写入环形缓冲区，写满后覆盖最旧的记录；
+    序号由itertools.count分配（在GIL下是原子的），多个线程可以同时写入。
+    文件头中的记录总数在每条记录之后更新，并发写入时可能短暂落后，读取端按此值取记录。
+    """
+    
+    def __init__(self, path: str, capacity: int = DEFAULT_CAPACITY):
+        """
+        打开或创建日志文件，格式与容量一致时从已有记录之后继续写入
+        
+        Args:
+            path: 日志文件路径
+            capacity: 最多保留的记录数
+        """
+        self.path = path
+        self.capacity = capacity
+        size = HEADER.size + capacity * RECORD.size
+        
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            count = 0
+            header = os.pread(fd, HEADER.size, 0)
+            if len(header) == HEADER.size and os.fstat(fd).st_size == size:
+                magic, version, record_size, old_capacity, old_count = HEADER.unpack(header)
+                if (magic, version, record_size, old_capacity) == (MAGIC, FORMAT_VERSION, RECORD.size, capacity):
+                    count = old_count
+            if count == 0:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        
+        HEADER.pack_into(self._mmap, 0, MAGIC, FORMAT_VERSION, RECORD.size, capacity, count)
+        self._sequence = itertools.count(count)
+    
+    def write(self, timestamp: float, address: str, port: int, version: int, mode: int,
+              verdict: int, transmit: int, processing_ns: int):
+        """
+        写入一条记录（在服务路径上调用）
+        
+        Args:
+            timestamp: 请求到达时间（Unix时间）
+            address: 客户端IPv4地址
+            port: 客户端端口
+            version: 请求的NTP版本号
+            mode: 请求的NTP模式
+            verdict: 处理结果（ntp_ratelimit.ALLOW/KOD/DROP）
+            transmit: 客户端传输时间戳（原始64位值）
+            processing_ns: 从到达到响应就绪的耗时（纳秒）
+        """
+        sequence = next(self._sequence)
+        offset = HEADER.size + (sequence % self.capacity) * RECORD.size
+        RECORD.pack_into(self._mmap, offset, timestamp, socket.inet_aton(address), port, version, mode,
+                         verdict, transmit, min(processing_ns, _MAX_PROCESSING_NS))
+        _COUNT_STRUCT.pack_into(self._mmap, COUNT_OFFSET, sequence + 1)
+    
+    def close(self):
+        """把映射内存写回文件并关闭"""
+        try:
+            self._mmap.flush()
+            self._mmap.close()
+        except (ValueError, OSError):
+            # 已关闭
+            pass
+
+
+def read_journal(path: str) -> Iterator[JournalRecord]:
+    """
+    按写入顺序读取日志文件中保留的记录（可在服务器运行时读取）
+    
+    Args:
+        path: 日志文件路径
+    
+    Yields:
+        JournalRecord: 请求记录
+    """
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version, record_size, capacity, count = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version != FORMAT_VERSION or record_size != RECORD.size:
+                raise ValueError(f"{path} 不是受支持的请求日志文件")
+            
+            first = max(count - capacity, 0)
+            for sequence in range(first, count):
+                offset = HEADER.size + (sequence % capacity) * RECORD.size
+                timestamp, address, port, ntp_version, mode, verdict, transmit, processing_ns = \
+                    RECORD.unpack_from(data, offset)
+                yield JournalRecord(timestamp, socket.inet_ntoa(address), port, ntp_version, mode,
+                                    verdict, transmit, processing_ns)
+
+
+def load_records(paths: List[str]) -> List[JournalRecord]:
+    """
+    读取多个日志文件（如多进程模式下各进程的日志）并按到达时间合并
+    
+    Args:
+        paths: 日志文件路径列表
+    
+    Returns:
+        List[JournalRecord]: 按到达时间排序的记录
+    """
+    records = []
+    for path in paths:
+        records.extend(read_journal(path))
+    records.sort(key=lambda record: record.timestamp)
+    return records
+
+
+def _percentile(sorted_values: List[int], fraction: float) -> int:
+    """已排序序列的分位数（最近秩法）"""
+    if not sorted_values:
+        return 0
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def minute_report(records: List[JournalRecord]) -> List[Dict]:
+    """
+    按分钟汇总请求记录
+    
+    Args:
+        records: 按到达时间排序的记录
+    
+    Returns:
+        List[Dict]: 每分钟的请求数、QPS、客户端数、KoD/丢弃数与处理延迟分位数（微秒）；
+                    第一分钟与最后一分钟的QPS按记录实际覆盖的时间计算
+    """
+    report = []
+    if not records:
+        return report
+    first, last = records[0].timestamp, records[-1].timestamp
+    for minute, group in itertools.groupby(records, key=lambda record: int(record.timestamp // 60)):
+        group = list(group)
+        latencies = sorted(record.processing_ns for record in group
+                           if record.verdict != ntp_ratelimit.DROP)
+        # 日志开始前与最后一条记录之后的时间不计入，至少按1秒计
+        covered = max(min(last, minute * 60 + 60) - max(first, minute * 60), 1.0)
+        report.append({
+            'minute': datetime.fromtimestamp(minute * 60).strftime('%Y-%m-%d %H:%M'),
+            'requests': len(group),
+            'qps': len(group) / covered,
+            'clients': len({record.address for record in group}),
+            'kod': sum(1 for record in group if record.verdict == ntp_ratelimit.KOD),
+            'dropped': sum(1 for record in group if record.verdict == ntp_ratelimit.DROP),
+            'p50_us': _percentile(latencies, 0.5) / 1000.0,
+            'p99_us': _percentile(latencies, 0.99) / 1000.0,
+            'max_us': (latencies[-1] if latencies else 0) / 1000.0
+        })
+    return report
+
+
+def replay(records: List[JournalRecord], host: str, port: int, speed: float = 1.0,
+           timeout: float = 2.0) -> Dict:
+    """
+    按记录的到达间隔把请求回放到测试服务器
+    
+    所有请求从同一个本地套接字发出，测试服务器应关闭限速（--rate-limit 0）。
+    
+    Args:
+        records: 按到达时间排序的记录
+        host: 测试服务器地址
+        port: 测试服务器端口
+        speed: 回放倍速，2表示以两倍速率发送，0表示不等待尽快发送
+        timeout: 发送完成后等待剩余响应的时间（秒）
+    
+    Returns:
+        Dict: 发送数、收到的响应数与实际耗时
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.settimeout(0.2)
+    received = 0
+    done = threading.Event()
+    
+    def receive():
+        nonlocal received
+        deadline = None
+        while True:
+            if done.is_set():
+                deadline = deadline or time.monotonic() + timeout
+                if time.monotonic() >= deadline:
+                    return
+            try:
+                sock.recv(1024)
+                received += 1
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+    
+    receiver = threading.Thread(target=receive, daemon=True)
+    receiver.start()
+    
+    packet = bytearray(48)
+    sent = 0
+    start = time.monotonic()
+    try:
+        if records:
+            first = records[0].timestamp
+            for record in records:
+                if speed > 0:
+                    delay = (record.timestamp - first) / speed - (time.monotonic() - start)
+                    if delay > 0:
+                        time.sleep(delay)
+                packet[0] = ((record.version & 0x07) << 3) | (record.mode & 0x07)
+                struct.pack_into('!Q', packet, 40, int((time.time() + NTP_EPOCH_OFFSET) * 2**32))
+                try:
+                    sock.sendto(packet, (host, port))
+                    sent += 1
+                except OSError:
+                    # 发送缓冲区满时丢弃本条，计入未响应
+                    pass
+    finally:
+        elapsed = time.monotonic() - start
+        done.set()
+        receiver.join()
+        sock.close()
+    
+    return {'sent': sent, 'received': received, 'elapsed': elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NTP请求日志分析与回放工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    report_parser = subparsers.add_parser('report', help='按分钟统计QPS、客户端数与处理延迟')
+    report_parser.add_argument('journals', nargs='+', help='日志文件（多进程模式下可同时指定各进程的文件）')
+    
+    replay_parser = subparsers.add_parser('replay', help='把记录作为负载回放到测试服务器')
+    replay_parser.add_argument('journals', nargs='+', help='日志文件')
+    replay_parser.add_argument('--host', default='127.0.0.1', help='测试服务器地址 (默认: 127.0.0.1)')
+    replay_parser.add_argument('-p', '--port', type=int, default=123, help='测试服务器端口 (默认: 123)')
+    replay_parser.add_argument('--speed', type=float, default=1.0,
+                               help='回放倍速，0为尽快发送 (默认: 1.0)')
+    args = parser.parse_args()
+    
+    records = load_records(args.journals)
+    if not records:
+        print("日志中没有记录")
+        return
+    
+    if args.command == 'report':
+        print(f"{'时间':<17} {'请求数':>8} {'QPS':>9} {'客户端':>7} {'KoD':>6} {'丢弃':>6} "
+              f"{'p50(us)':>9} {'p99(us)':>9} {'max(us)':>9}")
+        for row in minute_report(records):
+            print(f"{row['minute']:<17} {row['requests']:>8} {row['qps']:>9.1f} {row['clients']:>7} "
+                  f"{row['kod']:>6} {row['dropped']:>6} {row['p50_us']:>9.1f} {row['p99_us']:>9.1f} "
+                  f"{row['max_us']:>9.1f}")
+        print(f"共 {len(records)} 条记录，{len({record.address for record in records})} 个客户端")
+    else:
+        span = records[-1].timestamp - records[0].timestamp
+        print(f"回放 {len(records)} 条记录（原始时长 {span:.1f} 秒）到 {args.host}:{args.port} ...")
+        result = replay(records, args.host, args.port, args.speed)
+        lost = result['sent'] - result['received']
+        print(f"发送 {result['sent']}，收到响应 {result['received']}，未响应 {lost}，"
+              f"耗时 {result['elapsed']:.1f} 秒，平均 {result['sent'] / max(result['elapsed'], 1e-9):.0f} 请求/秒")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NTP服务器压力测试工具
+用asyncio模拟大量客户端（可分布到多个进程），通过UDP或TCP向服务器发送请求，
+统计实际QPS、丢失率与p50/p99/p999响应延迟，可输出JSON用于跟踪性能回归
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+# NTP纪元(1900-01-01)与Unix纪元(1970-01-01)之间的秒数
+NTP_EPOCH_OFFSET = 2208988800
+
+# 请求中的传输时间戳与响应中回显的原始时间戳
+_TIMESTAMP_STRUCT = struct.Struct('!Q')
+_TRANSMIT_OFFSET = 40
+_ORIGIN_OFFSET = 24
+
+# 启动本地服务器时默认使用的端口（无需root权限）
+DEFAULT_SPAWN_PORT = 10123
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    """已排序序列的分位数（最近秩法）"""
+    if not sorted_values:
+        return 0.0
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class LoadStats:
+    """
+    一个进程内所有模拟客户端共享的统计
+    
+    每个请求的传输时间戳都不相同，服务器会把它回显在响应的原始时间戳字段中，
+    据此把响应与请求对应起来
+    """
+    
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.pending: Dict[int, tuple] = {}
+        self.latencies: List[float] = []
+        self.sent = 0
+        self.received = 0
+        self.kod = 0
+        self.errors = 0
+        # 传输时间戳 = 启动时刻的NTP时间戳 + 序号，保证唯一且接近当前时间
+        base = int((time.time() + NTP_EPOCH_OFFSET) * 2**32)
+        self._origins = itertools.count(base)
+    
+    def next_request(self, packet: bytearray, future: Optional[asyncio.Future] = None) -> int:
+        """
+        为下一个请求写入唯一的传输时间戳并登记发送时间
+        
+        Args:
+            packet: 48字节的请求缓冲区
+            future: 闭环模式下等待响应的Future
+        
+        Returns:
+            int: 本请求的传输时间戳
+        """
+        origin = next(self._origins)
+        _TIMESTAMP_STRUCT.pack_into(packet, _TRANSMIT_OFFSET, origin)
+        self.pending[origin] = (time.perf_counter(), future)
+        self.sent += 1
+        return origin
+    
+    def on_response(self, data: bytes):
+        """收到响应：按原始时间戳找到请求并记录延迟，超时后才到达的响应不计入"""
+        if len(data) < 48:
+            return
+        origin = _TIMESTAMP_STRUCT.unpack_from(data, _ORIGIN_OFFSET)[0]
+        entry = self.pending.pop(origin, None)
+        if entry is None:
+            return
+        
+        sent_at, future = entry
+        self.latencies.append(time.perf_counter() - sent_at)
+        self.received += 1
+        if data[1] == 0:
+            # 层级为0：RATE死亡之吻
+            self.kod += 1
+        if future is not None and not future.done():
+            future.set_result(None)
+    
+    def expire(self):
+        """丢弃等待超过超时时间的请求（视为丢失）"""
+        cutoff = time.perf_counter() - self.timeout
+        expired = [origin for origin, (sent_at, _) in self.pending.items() if sent_at < cutoff]
+        for origin in expired:
+            del self.pending[origin]
+
+
+class _UDPClient(asyncio.DatagramProtocol):
+    """单个模拟客户端的UDP套接字"""
+    
+    def __init__(self, stats: LoadStats):
+        self.stats = stats
+    
+    def datagram_received(self, data: bytes, addr: tuple):
+        self.stats.on_response(data)
+    
+    def error_received(self, exc):
+        self.stats.errors += 1
+
+
+def _new_request(version: int = 4) -> bytearray:
+    """创建客户端模式的请求缓冲区"""
+    packet = bytearray(48)
+    packet[0] = (version << 3) | 3
+    return packet
+
+
+async def _run_client(stats: LoadStats, send, deadline: float, interval: float, start_delay: float):
+    """
+    单个模拟客户端的发送循环
+    
+    Args:
+        stats: 共享统计
+        send: 发送48字节请求的函数
+        deadline: 结束时间（事件循环时间）
+        interval: 开环模式下两次请求的间隔（秒），0表示闭环：收到响应或超时后立即发下一个
+        start_delay: 首个请求前的等待时间，使各客户端的发送时刻错开
+    """
+    loop = asyncio.get_running_loop()
+    packet = _new_request()
+    await asyncio.sleep(start_delay)
+    next_send = loop.time()
+    
+    while loop.time() < deadline:
+        if interval > 0:
+            stats.next_request(packet)
+            send(packet)
+            next_send += interval
+            await asyncio.sleep(max(next_send - loop.time(), 0))
+        else:
+            future = loop.create_future()
+            origin = stats.next_request(packet, future)
+            send(packet)
+            try:
+                await asyncio.wait_for(future, stats.timeout)
+            except asyncio.TimeoutError:
+                stats.pending.pop(origin, None)
+
+
+async def _tcp_reader(stats: LoadStats, reader: asyncio.StreamReader):
+    """读取一个TCP连接上的响应"""
+    try:
+        while True:
+            stats.on_response(await reader.readexactly(48))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+
+
+async def _run_load(host: str, port: int, protocol: str, clients: int, duration: float,
+                    rate: float, timeout: float) -> Dict:
+    """在本进程内运行一组模拟客户端，返回原始统计"""
+    loop = asyncio.get_running_loop()
+    stats = LoadStats(timeout)
+    interval = clients / rate if rate > 0 else 0.0
+    
+    transports = []
+    readers = []
+    senders = []
+    for _ in range(clients):
+        if protocol == 'tcp':
+            reader, writer = await asyncio.open_connection(host, port)
+            transports.append(writer)
+            readers.append(asyncio.ensure_future(_tcp_reader(stats, reader)))
+            senders.append(lambda packet, writer=writer: writer.write(bytes(packet)))
+        else:
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: _UDPClient(stats), remote_addr=(host, port)
+            )
+            transports.append(transport)
+            senders.append(lambda packet, transport=transport: transport.sendto(bytes(packet)))
+    
+    # 开环模式下定期清理超时请求，避免pending无限增长
+    async def expire_pending():
+        while True:
+            await asyncio.sleep(timeout)
+            stats.expire()
+    
+    expirer = asyncio.ensure_future(expire_pending())
+    start = loop.time()
+    deadline = start + duration
+    spread = interval if interval > 0 else min(timeout, 0.1)
+    await asyncio.gather(*(
+        _run_client(stats, send, deadline, interval, spread * i / clients)
+        for i, send in enumerate(senders)
+    ))
+    elapsed = loop.time() - start
+    
+    # 等待最后一批响应
+    if stats.pending:
+        await asyncio.sleep(timeout)
+    expirer.cancel()
+    for task in readers:
+        task.cancel()
+    for transport in transports:
+        transport.close()
+    
+    return {
+        'sent': stats.sent,
+        'received': stats.received,
+        'kod': stats.kod,
+        'errors': stats.errors,
+        'elapsed': elapsed,
+        'latencies': stats.latencies
+    }
+
+
+def _run_process(args: tuple) -> Dict:
+    """工作进程入口"""
+    return asyncio.run(_run_load(*args))
+
+
+def run_load_test(host: str = '127.0.0.1', port: int = 123, protocol: str = 'udp', clients: int = 100,
+                  duration: float = 10.0, rate: float = 0.0, timeout: float = 1.0,
+                  processes: int = 1) -> Dict:
+    """
+    运行压力测试
+    
+    Args:
+        host: 服务器地址
+        port: 服务器端口
+        protocol: 'udp'或'tcp'
+        clients: 模拟客户端总数（每个客户端一个套接字）
+        duration: 测试时长（秒）
+        rate: 目标总请求速率（次/秒），大于0为开环模式，按固定间隔发送而不等待响应；
+              0为闭环模式，每个客户端收到响应或超时后立即发送下一个请求
+        timeout: 请求超时时间（秒），超时未收到响应视为丢失
+        processes: 发压进程数，客户端与速率平均分配到各进程
+    
+    Returns:
+        Dict: 测试参数、请求数、QPS、丢失率与延迟分位数（毫秒）
+    """
+    processes = max(1, min(processes, clients))
+    jobs = []
+    for index in range(processes):
+        share = clients // processes + (1 if index < clients % processes else 0)
+        jobs.append((host, port, protocol, share, duration, rate * share / clients, timeout))
+    
+    if processes == 1:
+        results = [_run_process(jobs[0])]
+    else:
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            results = pool.map(_run_process, jobs)
+    
+    sent = sum(result['sent'] for result in results)
+    received = sum(result['received'] for result in results)
+    elapsed = max(result['elapsed'] for result in results)
+    latencies = sorted(latency for result in results for latency in result['latencies'])
+    
+    return {
+        'host': host,
+        'port': port,
+        'protocol': protocol,
+        'mode': 'open' if rate > 0 else 'closed',
+        'clients': clients,
+        'processes': processes,
+        'target_rate': rate,
+        'duration': elapsed,
+        'sent': sent,
+        'received': received,
+        'lost': sent - received,
+        'loss_rate': (sent - received) / sent if sent else 0.0,
+        'kod': sum(result['kod'] for result in results),
+        'errors': sum(result['errors'] for result in results),
+        'qps': received / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'p50': _percentile(latencies, 0.5) * 1000,
+            'p99': _percentile(latencies, 0.99) * 1000,
+            'p999': _percentile(latencies, 0.999) * 1000,
+            'max': (latencies[-1] if latencies else 0.0) * 1000,
+            'mean': (sum(latencies) / len(latencies) if latencies else 0.0) * 1000
+        }
+    }
+
+
+def spawn_server(port: int, protocol: str = 'udp', workers: int = 1, batch_size: int = 0,
+                 startup_timeout: float = 10.0) -> subprocess.Popen:
+    """
+    在子进程中启动一个只监听127.0.0.1、关闭限速且不使用状态文件的NTPServer，等待其可以应答后返回
+    
+    Args:
+        port: 监听端口
+        protocol: 'udp'或'tcp'
+        workers: 服务器工作进程数
+        batch_size: 服务器批量I/O大小
+        startup_timeout: 等待服务器就绪的最长时间（秒）
+    
+    Returns:
+        subprocess.Popen: 服务器进程
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ntp_server.py')
+    command = [sys.executable, script, '--host', '127.0.0.1', '--port', str(port),
+               '--workers', str(workers), '--batch', str(batch_size), '--rate-limit', '0',
+               # 不读写当前目录下正式服务器使用的时钟状态文件
+               '--no-state']
+    if protocol == 'tcp':
+        command.append('--tcp')
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"NTP服务器进程意外退出，退出码 {process.returncode}")
+        if _probe(port, protocol):
+            return process
+        time.sleep(0.2)
+    
+    process.terminate()
+    raise RuntimeError(f"NTP服务器在 {startup_timeout} 秒内未就绪")
+
+
+def _probe(port: int, protocol: str) -> bool:
+    """发送一个请求，检查本地服务器是否已可以应答"""
+    kind = socket.SOCK_STREAM if protocol == 'tcp' else socket.SOCK_DGRAM
+    try:
+        with socket.socket(socket.AF_INET, kind) as sock:
+            sock.settimeout(0.5)
+            sock.connect(('127.0.0.1', port))
+            sock.send(bytes(_new_request()))
+            return len(sock.recv(1024)) >= 48
+    except OSError:
+        return False
+
+
+def print_report(result: Dict):
+    """以文本形式输出测试结果"""
+    latency = result['latency_ms']
+    mode = f"开环，目标 {result['target_rate']:.0f} 次/秒" if result['mode'] == 'open' else '闭环'
+    print(f"目标: {result['host']}:{result['port']} ({result['protocol'].upper()})")
+    print(f"客户端: {result['clients']} 个，{result['processes']} 个进程，{mode}")
+    print(f"时长: {result['duration']:.1f} 秒")
+    print(f"请求: 发送 {result['sent']}，收到响应 {result['received']}，"
+          f"丢失 {result['lost']} ({result['loss_rate']:.2%})，KoD {result['kod']}")
+    print(f"QPS: {result['qps']:.0f}")
+    print(f"延迟(ms): p50 {latency['p50']:.3f}  p99 {latency['p99']:.3f}  p999 {latency['p999']:.3f}  "
+          f"max {latency['max']:.3f}  平均 {latency['mean']:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NTP服务器压力测试工具')
+    parser.add_argument('host', nargs='?', default='127.0.0.1', help='NTP服务器地址 (默认: 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=None,
+                        help=f'NTP服务器端口 (默认: 123，使用--spawn时为{DEFAULT_SPAWN_PORT})')
+    parser.add_argument('--tcp', action='store_true', help='使用TCP代替UDP（用于旧版TCP模式的服务器）')
+    parser.add_argument('-c', '--clients', type=int, default=100, help='模拟客户端数 (默认: 100)')
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help='测试时长(秒) (默认: 10)')
+    parser.add_argument('-r', '--rate', type=float, default=0.0,
+                        help='目标总请求速率(次/秒)，按固定间隔开环发送；0为闭环模式 (默认: 0)')
+    parser.add_argument('-t', '--timeout', type=float, default=1.0,
+                        help='请求超时时间(秒)，超时视为丢失 (默认: 1.0)')
+    parser.add_argument('-j', '--processes', type=int, default=1, help='发压进程数 (默认: 1)')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    parser.add_argument('--spawn', action='store_true',
+                        help='在本机启动一个关闭限速的NTP服务器进行测试，测试结束后停止')
+    parser.add_argument('--server-workers', type=int, default=1, help='--spawn时服务器的工作进程数 (默认: 1)')
+    parser.add_argument('--server-batch', type=int, default=0, help='--spawn时服务器的批量I/O大小 (默认: 0)')
+    args = parser.parse_args()
+    
+    protocol = 'tcp' if args.tcp else 'udp'
+    port = args.port or (DEFAULT_SPAWN_PORT if args.spawn else 123)
+    host = '127.0.0.1' if args.spawn else args.host
+    
+    server = None
+    if args.spawn:
+        server = spawn_server(port, protocol, args.server_workers, args.server_batch)
+    try:
+        result = run_load_test(host, port, protocol, args.clients, args.duration, args.rate,
+                               args.timeout, args.processes)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+    
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    else:
+        print_report(result)
+
+
+if __name__ == '__main__':
+    main()
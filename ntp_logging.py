@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NTP服务器日志配置
+服务线程只把日志记录放入队列，由后台监听线程写入文件与控制台；
+日志文件按大小轮转，逐客户端的日志按时间窗口限量输出
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# 日志格式
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# 单个日志文件的大小上限（字节）与保留的历史文件数
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+# Web管理界面定时轮询的接口，其访问日志不写入文件
+POLLING_PATHS = ('/api/status', '/api/clients', '/api/sync/', '/api/history', '/metrics')
+
+_lock = threading.Lock()
+_handlers = []
+_listeners = []
+
+
+def setup_logging(log_file: str = 'ntp_server.log', level: int = logging.INFO,
+                  max_bytes: int = MAX_BYTES, backup_count: int = BACKUP_COUNT):
+    """
+    配置根日志记录器：QueueHandler入队，QueueListener在后台线程写文件与控制台
+    
+    重复调用不会重复配置
+    
+    Args:
+        log_file: 日志文件路径
+        level: 日志级别
+        max_bytes: 单个日志文件的大小上限（字节）
+        backup_count: 保留的历史日志文件数
+    """
+    with _lock:
+        if _handlers:
+            return
+        
+        formatter = logging.Formatter(LOG_FORMAT)
+        # delay=True：只有真正写日志的进程才打开文件
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True
+        )
+        console_handler = logging.StreamHandler()
+        for handler in (file_handler, console_handler):
+            handler.setFormatter(formatter)
+            _handlers.append(handler)
+        
+        log_queue = queue.SimpleQueue()
+        _start_listener(log_queue)
+        
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        
+        # Web界面每隔几秒轮询状态，这些访问日志没有价值
+        logging.getLogger('werkzeug').addFilter(PollingAccessFilter())
+        
+        atexit.register(shutdown)
+
+
+def _start_listener(log_queue):
+    """启动把队列中的日志记录写入各处理器的后台线程（调用方需持有_lock）"""
+    listener = logging.handlers.QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+
+def listen_to(log_queue):
+    """
+    额外监听一个队列，用于接收工作进程发来的日志记录
+    
+    Args:
+        log_queue: multiprocessing队列
+    """
+    with _lock:
+        _start_listener(log_queue)
+
+
+def forward_to(log_queue):
+    """
+    在工作进程中调用：日志不再自行输出，而是发送到主进程监听的队列
+    
+    Args:
+        log_queue: 主进程创建并监听的multiprocessing队列
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+
+def shutdown():
+    """停止所有监听线程，确保队列中剩余的日志写出"""
+    with _lock:
+        listeners = list(_listeners)
+        _listeners.clear()
+    for listener in listeners:
+        try:
+            listener.stop()
+        except Exception:
+            pass
+
+
+class PollingAccessFilter(logging.Filter):
+    """过滤Web管理界面定时轮询接口的访问日志"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        return not any(f'"GET {path}' in message for path in POLLING_PATHS)
+
+
+class EventSampler:
+    """
+    逐客户端日志的限量器
+    
+    每个时间窗口内最多放行limit条，其余只计数，由调用方在汇总日志中报告被抑制的条数。
+    计数不加锁，多线程下只是近似值。
+    """
+    
+    def __init__(self, limit: int = 20, window: float = 60.0):
+        """
+        初始化限量器
+        
+        Args:
+            limit: 每个时间窗口最多输出的日志条数
+            window: 时间窗口长度（秒）
+        """
+        self.limit = limit
+        self.window = window
+        self._window_start = time.monotonic()
+        self._count = 0
+        self.suppressed = 0
+    
+    def allow(self) -> bool:
+        """
+        判断本条日志是否输出
+        
+        Returns:
+            bool: 是否输出
+        """
+        now = time.monotonic()
+        if now - self._window_start >= self.window:
+            self._window_start = now
+            self._count = 0
+        if self._count < self.limit:
+            self._count += 1
+            return True
+        self.suppressed += 1
+        return False
+    
+    def take_suppressed(self) -> int:
+        """
+        取出并清零被抑制的日志条数
+        
+        Returns:
+            int: 自上次调用以来被抑制的条数
+        """
+        suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NTP服务指标
+服务路径只对本线程独占的计数分片做整数自增，抓取时才汇总并生成Prometheus文本格式
+"""
+
+import time
+from bisect import bisect_left
+from typing import Dict, Sequence
+
+import ntp_validate
+
+# 处理延迟直方图的桶上界（秒），最后还有一个+Inf桶
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+# NTP模式名称（RFC 5905）
+MODE_NAMES = ('reserved', 'symmetric_active', 'symmetric_passive', 'client',
+              'server', 'broadcast', 'control', 'private')
+
+# 计数分片布局
+REQUESTS = 0
+MALFORMED = 1            # 未通过校验被丢弃的数据包总数，按原因的计数见DROP_BASE
+RATE_LIMITED = 2
+RATE_DROPPED = 3
+TOTAL_CONNECTIONS = 4
+ACTIVE_CONNECTIONS = 5
+LAST_REQUEST_US = 6      # 最近一次请求的时间（Unix微秒），汇总时取最大值而非求和
+MODE_BASE = 7
+VERSION_BASE = MODE_BASE + 8
+LATENCY_BASE = VERSION_BASE + 8
+LATENCY_SUM_NS = LATENCY_BASE + len(LATENCY_BUCKETS) + 1
+DROP_BASE = LATENCY_SUM_NS + 1
+SIZE = DROP_BASE + len(ntp_validate.REASONS)
+
+# 汇总时取最大值的位置
+MAX_INDEXES = (LAST_REQUEST_US,)
+
+
+def record_request(counters, mode: int, version: int, now: float):
+    """
+    记录一个有效请求
+    
+    Args:
+        counters: 当前线程的计数分片
+        mode: 请求的NTP模式
+        version: 请求的NTP版本号
+        now: 请求到达的本地时间
+    """
+    counters[REQUESTS] += 1
+    counters[MODE_BASE + mode] += 1
+    counters[VERSION_BASE + version] += 1
+    counters[LAST_REQUEST_US] = int(now * 1e6)
+
+
+def observe_latency(counters, seconds: float):
+    """
+    记录一次从收到请求到发出响应的处理延迟
+    
+    Args:
+        counters: 当前线程的计数分片
+        seconds: 处理延迟（秒）
+    """
+    if seconds < 0.0:
+        seconds = 0.0
+    counters[LATENCY_BASE + bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    counters[LATENCY_SUM_NS] += int(seconds * 1e9)
+
+
+def _escape(value: str) -> str:
+    """转义标签值"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render(counters: Sequence[int], status: Dict) -> str:
+    """
+    生成Prometheus文本格式的指标
+    
+    Args:
+        counters: 汇总后的服务计数
+        status: NTPServer.get_status()的返回值
+    
+    Returns:
+        str: Prometheus文本格式（0.0.4）
+    """
+    lines = []
+    
+    def metric(name: str, metric_type: str, help_text: str, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            if labels:
+                label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{name} {value}")
+    
+    metric('ntp_server_up', 'gauge', 'NTP服务是否正在运行',
+           [(None, 1 if status.get('running') else 0)])
+    metric('ntp_requests_total', 'counter', '已处理的有效NTP请求数',
+           [(None, counters[REQUESTS])])
+    metric('ntp_requests_by_mode_total', 'counter', '按NTP模式统计的请求数',
+           [({'mode': MODE_NAMES[mode]}, counters[MODE_BASE + mode])
+            for mode in range(8) if counters[MODE_BASE + mode]])
+    metric('ntp_requests_by_version_total', 'counter', '按NTP版本统计的请求数',
+           [({'version': version}, counters[VERSION_BASE + version])
+            for version in range(8) if counters[VERSION_BASE + version]])
+    metric('ntp_malformed_packets_total', 'counter', '未通过校验被丢弃的数据包数',
+           [(None, counters[MALFORMED])])
+    metric('ntp_dropped_packets_total', 'counter', '按原因统计的未通过校验被丢弃的数据包数',
+           [({'reason': reason}, counters[DROP_BASE + index])
+            for index, reason in enumerate(ntp_validate.REASONS)])
+    
+    metric('ntp_rate_limited_total', 'counter', '超过限速的请求数',
+           [(None, counters[RATE_LIMITED])])
+    metric('ntp_rate_dropped_total', 'counter', '因限速被丢弃的请求数',
+           [(None, counters[RATE_DROPPED])])
+    metric('ntp_tcp_connections_total', 'counter', '旧版TCP模式下接受的连接数',
+           [(None, counters[TOTAL_CONNECTIONS])])
+    metric('ntp_tcp_active_connections', 'gauge', '旧版TCP模式下的活跃连接数',
+           [(None, counters[ACTIVE_CONNECTIONS])])
+    
+    # 直方图：桶计数为累计值
+    name = 'ntp_request_latency_seconds'
+    lines.append(f"# HELP {name} 从收到请求到发出响应的进程内处理延迟")
+    lines.append(f"# TYPE {name} histogram")
+    cumulative = 0
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        cumulative += counters[LATENCY_BASE + i]
+        lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+    cumulative += counters[LATENCY_BASE + len(LATENCY_BUCKETS)]
+    lines.append(f'{name}_bucket{{le="+Inf"}} {cumulative}')
+    lines.append(f"{name}_sum {counters[LATENCY_SUM_NS] / 1e9}")
+    lines.append(f"{name}_count {cumulative}")
+    
+    # 时钟与同步状态
+    metric('ntp_stratum', 'gauge', '本服务器层级', [(None, status.get('stratum', 16))])
+    metric('ntp_time_offset_seconds', 'gauge', '相对本地系统时钟的校正量',
+           [(None, status.get('time_offset', 0.0))])
+    metric('ntp_frequency_ppm', 'gauge', '本地振荡器频率校正',
+           [(None, status.get('frequency_ppm', 0.0))])
+    metric('ntp_system_jitter_seconds', 'gauge', '系统抖动', [(None, status.get('system_jitter', 0.0))])
+    metric('ntp_root_delay_seconds', 'gauge', '根延迟', [(None, status.get('root_delay', 0.0))])
+    metric('ntp_root_dispersion_seconds', 'gauge', '根离散', [(None, status.get('root_dispersion', 0.0))])
+    metric('ntp_sync_duration_seconds', 'gauge', '最近一次同步（全量同步或单个上游的定时轮询）的耗时',
+           [(None, status.get('last_sync_duration', 0.0))])
+    
+    last_sync_time = status.get('last_sync_time') or 0
+    if last_sync_time > 0:
+        metric('ntp_time_since_last_sync_seconds', 'gauge', '距最近一次时钟更新的时间',
+               [(None, max(time.time() - last_sync_time, 0.0))])
+    
+    # 各上游对等体
+    peers = status.get('peers') or []
+    peer_samples = {'offset': [], 'delay': [], 'jitter': [], 'reach': [], 'poll_duration': []}
+    for peer in peers:
+        labels = {'server': peer['name'], 'hostname': peer.get('hostname', peer['name'])}
+        if peer['samples']:
+            peer_samples['offset'].append((labels, peer['offset']))
+            peer_samples['delay'].append((labels, peer['delay']))
+            peer_samples['jitter'].append((labels, peer['jitter']))
+        peer_samples['reach'].append((labels, int(peer['reach'], 8)))
+        peer_samples['poll_duration'].append((labels, peer.get('last_poll_duration', 0.0)))
+    metric('ntp_upstream_offset_seconds', 'gauge', '上游时钟滤波后的偏移量', peer_samples['offset'])
+    metric('ntp_upstream_delay_seconds', 'gauge', '上游往返延迟', peer_samples['delay'])
+    metric('ntp_upstream_jitter_seconds', 'gauge', '上游抖动', peer_samples['jitter'])
+    metric('ntp_upstream_reach', 'gauge', '上游可达性寄存器', peer_samples['reach'])
+    metric('ntp_upstream_poll_duration_seconds', 'gauge', '最近一次轮询上游的耗时',
+           peer_samples['poll_duration'])
+    
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NTP上游对等体与时钟选择算法
+实现RFC 5905的时钟滤波、交集（Marzullo）选择、聚类与合并算法
+"""
+
+import math
+import time
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional
+
+# 时钟滤波器移位寄存器长度
+FILTER_SIZE = 8
+
+# 频率容差（秒/秒），样本离散度随时间按此速率增长
+PHI = 15e-6
+
+# 最小离散度增量（秒）
+MIN_DISPERSION = 0.005
+
+# 最大离散度（秒），超过即视为不可用
+MAX_DISPERSION = 16.0
+
+# 根距离上限（秒），超过的对等体不参与选择
+MAX_DISTANCE = 1.5
+
+# 聚类算法保留的最少幸存者数
+MIN_CLUSTER_SURVIVORS = 3
+
+# 本地时钟精度（秒）
+LOCAL_PRECISION = 2 ** -20
+
+# 新样本偏离滤波输出不超过 POLL_GATE × 抖动 时视为稳定
+POLL_GATE = 4
+
+# 连续稳定的样本数达到此值时轮询间隔翻倍
+POLL_LIMIT = 4
+
+# 连续失败时退避的最大倍数（2的幂次）
+MAX_BACKOFF_LEVEL = 16
+
+# 对等体选择状态
+STATUS_NO_SAMPLE = 'no_sample'
+STATUS_UNREACHABLE = 'unreachable'
+STATUS_FALSETICKER = 'falseticker'
+STATUS_UNSELECTED = 'unselected'
+STATUS_OUTLIER = 'outlier'
+STATUS_CANDIDATE = 'candidate'
+STATUS_SURVIVOR = 'survivor'
+STATUS_SYSTEM_PEER = 'system_peer'
+
+
+class Sample(NamedTuple):
+    """单个时钟样本"""
+    offset: float
+    delay: float
+    dispersion: float
+    epoch: float  # 采样时刻（time.monotonic()）
+
+
+class SelectionResult(NamedTuple):
+    """时钟选择与合并的结果"""
+    offset: float            # 合并后的系统偏移量
+    jitter: float            # 系统抖动
+    system_peer: 'Peer'      # 系统对等体（根距离最小的幸存者）
+    survivors: List['Peer']  # 聚类后的幸存者
+
+
+class Peer:
+    """
+    上游对等体
+    
+    保存最近8个样本的移位寄存器，按RFC 5905时钟滤波算法选出延迟最小的样本
+    """
+    
+    def __init__(self, name: str, min_poll_interval: float = 64.0, max_poll_interval: float = 1024.0,
+                 hostname: Optional[str] = None):
+        """
+        初始化对等体
+        
+        Args:
+            name: 上游服务器名称或地址
+            min_poll_interval: 最短轮询间隔（秒）
+            max_poll_interval: 最长轮询间隔（秒）
+            hostname: 解析出该地址的上游域名
+        """
+        self.name = name
+        self.hostname = hostname or name
+        self.samples = deque(maxlen=FILTER_SIZE)
+        
+        # 时钟滤波输出
+        self.offset = 0.0
+        self.delay = 0.0
+        self.dispersion = MAX_DISPERSION
+        self.jitter = 0.0
+        self.update_epoch = 0.0
+        
+        # 上游报告的层级与根延迟/根离散
+        self.stratum = 16
+        self.root_delay = 0.0
+        self.root_dispersion = 0.0
+        
+        # 8位可达性寄存器，每次轮询左移一位，收到响应置最低位
+        self.reach = 0
+        self.status = STATUS_NO_SAMPLE
+        self.last_poll_duration = 0.0
+        
+        # 轮询间隔 = 最短间隔 × 2^poll_level，稳定时逐级增大，不稳定时减小
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max(max_poll_interval, min_poll_interval)
+        self.max_poll_level = int(math.log2(self.max_poll_interval / min_poll_interval))
+        self.poll_level = 0
+        self.poll_count = 0
+        self.failures = 0
+    
+    def add_sample(self, offset: float, delay: float, precision: float,
+                   stratum: int, root_delay: float, root_dispersion: float):
+        """
+        加入新样本并运行时钟滤波算法
+        
+        Args:
+            offset: 样本偏移量（秒）
+            delay: 往返延迟（秒）
+            precision: 上游时钟精度（秒）
+            stratum: 上游层级
+            root_delay: 上游根延迟（秒）
+            root_dispersion: 上游根离散（秒）
+        """
+        dispersion = precision + LOCAL_PRECISION + PHI * max(delay, 0.0)
+        if self.samples:
+            self._adjust_poll(abs(offset - self.offset) < POLL_GATE * max(self.jitter, MIN_DISPERSION))
+        self.failures = 0
+        self.samples.append(Sample(offset, max(delay, 0.0), dispersion, time.monotonic()))
+        self.stratum = stratum
+        self.root_delay = root_delay
+        self.root_dispersion = root_dispersion
+        self.reach = ((self.reach << 1) | 1) & 0xFF
+        self._clock_filter()
+    
+    def record_unreachable(self):
+        """记录一次无响应的轮询"""
+        self.reach = (self.reach << 1) & 0xFF
+        self.failures += 1
+        if not self.reach:
+            self.status = STATUS_UNREACHABLE
+    
+    def to_state(self) -> Dict:
+        """
+        导出需要跨重启保存的状态
+        
+        Returns:
+            Dict: 上游参数、可达性、轮询级别与滤波器中的样本（采样时刻记为样本年龄）
+        """
+        now = time.monotonic()
+        return {
+            'name': self.name,
+            'hostname': self.hostname,
+            'stratum': self.stratum,
+            'root_delay': self.root_delay,
+            'root_dispersion': self.root_dispersion,
+            'reach': self.reach,
+            'poll_level': self.poll_level,
+            'samples': [[sample.offset, sample.delay, sample.dispersion, now - sample.epoch]
+                        for sample in self.samples]
+        }
+    
+    def restore(self, state: Dict, elapsed: float):
+        """
+        恢复to_state保存的状态
+        
+        样本按保存时的年龄加上停机时长回推采样时刻，其离散度随之增大，旧样本自然让位于新样本
+        
+        Args:
+            state: to_state导出的状态
+            elapsed: 保存以来经过的时间（秒）
+        """
+        now = time.monotonic()
+        for offset, delay, dispersion, age in state['samples'][-FILTER_SIZE:]:
+            self.samples.append(Sample(offset, delay, dispersion, now - age - elapsed))
+        self.stratum = state['stratum']
+        self.root_delay = state['root_delay']
+        self.root_dispersion = state['root_dispersion']
+        self.reach = state['reach'] & 0xFF
+        self.poll_level = min(max(int(state['poll_level']), 0), self.max_poll_level)
+        if self.samples:
+            self._clock_filter()
+    
+    def _adjust_poll(self, stable: bool):
+        """
+        根据新样本是否稳定调整轮询级别
+        
+        Args:
+            stable: 新样本与滤波输出的偏差是否在抖动允许范围内
+        """
+        if stable:
+            self.poll_count += 1
+            if self.poll_count >= POLL_LIMIT:
+                self.poll_count = 0
+                self.poll_level = min(self.poll_level + 1, self.max_poll_level)
+        else:
+            # 偏差超出抖动范围时立即缩短间隔，尽快跟踪变化
+            self.poll_count = 0
+            self.poll_level = max(self.poll_level - 1, 0)
+    
+    def poll_interval(self) -> float:
+        """
+        下一次轮询的间隔，连续失败时按指数退避
+        
+        Returns:
+            float: 轮询间隔（秒），不含随机抖动
+        """
+        level = min(self.failures, MAX_BACKOFF_LEVEL) if self.failures else self.poll_level
+        return min(self.min_poll_interval * 2 ** level, self.max_poll_interval)
+    
+    def _clock_filter(self):
+        """时钟滤波：按延迟排序，取延迟最小的样本，并计算滤波离散度与抖动"""
+        now = time.monotonic()
+        
+        # 样本离散度随样本年龄增长
+        aged = sorted(
+            (sample.delay, sample.offset, sample.dispersion + PHI * (now - sample.epoch), sample.epoch)
+            for sample in self.samples
+        )
+        
+        best_delay, best_offset, _, best_epoch = aged[0]
+        self.offset = best_offset
+        self.delay = best_delay
+        self.update_epoch = best_epoch
+        
+        # 滤波离散度：按延迟顺序加权求和；
+        # 与ntpd不同，空位不按最大离散度计，使首个样本即可参与选择（本服务按需同步，没有iburst）
+        dispersion = 0.0
+        for i, (_, _, sample_dispersion, _) in enumerate(aged):
+            dispersion += min(sample_dispersion, MAX_DISPERSION) / (2 ** (i + 1))
+        self.dispersion = dispersion
+        
+        # 抖动：各样本相对最佳样本偏移量的均方根
+        if len(aged) > 1:
+            squares = sum((offset - best_offset) ** 2 for _, offset, _, _ in aged[1:])
+            self.jitter = max(math.sqrt(squares / (len(aged) - 1)), LOCAL_PRECISION)
+        else:
+            self.jitter = LOCAL_PRECISION
+    
+    def root_distance(self) -> float:
+        """
+        根距离：衡量该对等体时间的最大误差
+        
+        Returns:
+            float: 根距离（秒）
+        """
+        age = time.monotonic() - self.update_epoch
+        return (max(MIN_DISPERSION, self.root_delay + self.delay) / 2
+                + self.root_dispersion + self.dispersion + PHI * age + self.jitter)
+    
+    def is_selectable(self) -> bool:
+        """是否满足参与时钟选择的条件"""
+        return (bool(self.samples) and self.reach != 0 and self.stratum < 16
+                and self.root_distance() < MAX_DISTANCE)
+    
+    def to_dict(self) -> Dict:
+        """
+        导出对等体状态
+        
+        Returns:
+            Dict: 偏移量、延迟、抖动及选择状态
+        """
+        return {
+            'name': self.name,
+            'hostname': self.hostname,
+            'status': self.status,
+            'stratum': self.stratum,
+            'reach': f"{self.reach:03o}",
+            'offset': self.offset,
+            'delay': self.delay,
+            'dispersion': self.dispersion,
+            'jitter': self.jitter,
+            'root_distance': self.root_distance() if self.samples else None,
+            'samples': len(self.samples),
+            'poll_interval': self.poll_interval(),
+            'last_poll_duration': self.last_poll_duration
+        }
+
+
+def select_truechimers(peers: List[Peer]) -> List[Peer]:
+    """
+    交集（Marzullo）算法：找出多数对等体正确区间的公共交集，剔除假时钟
+    
+    Args:
+        peers: 可参与选择的对等体
+    
+    Returns:
+        List[Peer]: 正确区间与交集相交的真时钟，找不到多数交集时返回空列表，
+                    此时无法判断哪一方是假时钟，全部对等体标记为未选中
+    """
+    count = len(peers)
+    if not count:
+        return []
+    
+    # 每个对等体贡献下界(+1)、中点(0)、上界(-1)三个端点
+    edges = []
+    for peer in peers:
+        distance = peer.root_distance()
+        edges.append((peer.offset - distance, 1))
+        edges.append((peer.offset, 0))
+        edges.append((peer.offset + distance, -1))
+    edges.sort()
+    
+    allow = 0
+    low = high = 0.0
+    while 2 * allow < count:
+        found = 0
+        chime = 0
+        for value, edge_type in edges:
+            chime += edge_type
+            if chime >= count - allow:
+                low = value
+                break
+            if edge_type == 0:
+                found += 1
+        
+        chime = 0
+        for value, edge_type in reversed(edges):
+            chime -= edge_type
+            if chime >= count - allow:
+                high = value
+                break
+            if edge_type == 0:
+                found += 1
+        
+        if found <= allow and low < high:
+            break
+        allow += 1
+    else:
+        for peer in peers:
+            peer.status = STATUS_UNSELECTED
+        return []
+    
+    truechimers = []
+    for peer in peers:
+        distance = peer.root_distance()
+        if peer.offset - distance <= high and peer.offset + distance >= low:
+            truechimers.append(peer)
+        else:
+            peer.status = STATUS_FALSETICKER
+    return truechimers
+
+
+def cluster_survivors(truechimers: List[Peer]) -> List[Peer]:
+    """
+    聚类算法：反复剔除选择抖动最大的对等体，直到剩余对等体足够一致
+    
+    Args:
+        truechimers: 交集算法选出的真时钟
+    
+    Returns:
+        List[Peer]: 按根距离排序的幸存者
+    """
+    survivors = sorted(truechimers, key=lambda peer: peer.root_distance())
+    while len(survivors) > MIN_CLUSTER_SURVIVORS:
+        # 每个幸存者相对其他幸存者的选择抖动
+        selection_jitters = []
+        for peer in survivors:
+            squares = sum((other.offset - peer.offset) ** 2 for other in survivors)
+            selection_jitters.append(math.sqrt(squares / (len(survivors) - 1)))
+        
+        worst = max(range(len(survivors)), key=lambda i: selection_jitters[i])
+        min_peer_jitter = min(peer.jitter for peer in survivors)
+        if selection_jitters[worst] <= min_peer_jitter:
+            break
+        
+        survivors.pop(worst).status = STATUS_OUTLIER
+    return survivors
+
+
+def combine(survivors: List[Peer]) -> tuple:
+    """
+    合并算法：以根距离倒数为权重计算系统偏移量与系统抖动
+    
+    Args:
+        survivors: 聚类后的幸存者，第一个为系统对等体
+    
+    Returns:
+        tuple: (系统偏移量, 系统抖动)
+    """
+    system_peer = survivors[0]
+    weights = [1.0 / peer.root_distance() for peer in survivors]
+    total = sum(weights)
+    offset = sum(w * peer.offset for w, peer in zip(weights, survivors)) / total
+    selection_jitter = math.sqrt(
+        sum(w * (peer.offset - system_peer.offset) ** 2 for w, peer in zip(weights, survivors)) / total
+    )
+    jitter = math.sqrt(system_peer.jitter ** 2 + selection_jitter ** 2)
+    return offset, jitter
+
+
+def select_clock(peers: List[Peer]) -> Optional[SelectionResult]:
+    """
+    运行完整的时钟选择流程：筛选、交集、聚类、合并
+    
+    Args:
+        peers: 全部上游对等体
+    
+    Returns:
+        Optional[SelectionResult]: 选择结果，没有可用对等体时返回None
+    """
+    candidates = []
+    for peer in peers:
+        if peer.is_selectable():
+            peer.status = STATUS_CANDIDATE
+            candidates.append(peer)
+        elif peer.samples and peer.reach:
+            # 有样本但根距离过大或层级无效
+            peer.status = STATUS_FALSETICKER
+    
+    truechimers = select_truechimers(candidates)
+    if not truechimers:
+        return None
+    
+    survivors = cluster_survivors(truechimers)
+    offset, jitter = combine(survivors)
+    for peer in survivors[1:]:
+        peer.status = STATUS_SURVIVOR
+    survivors[0].status = STATUS_SYSTEM_PEER
+    return SelectionResult(offset, jitter, survivors[0], survivors)
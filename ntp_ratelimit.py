@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NTP客户端限速
+按源IP的令牌桶限速，客户端表为固定大小的哈希槽数组，内存占用与客户端数量无关；
+多进程模式下各工作进程共用共享内存中的同一张表
+"""
+
+import zlib
+from array import array
+
+# 判定结果
+ALLOW = 0   # 正常应答
+KOD = 1     # 超限，回复RATE死亡之吻（Kiss-o'-Death）
+DROP = 2    # 超限，静默丢弃
+
+# 默认哈希槽数（2的幂）
+DEFAULT_SLOTS = 1 << 16
+
+# 同一客户端两次KoD之间的最短间隔（秒），其余超限请求直接丢弃，避免被用于反射放大
+KOD_INTERVAL = 8.0
+
+# 每个槽的字段数：IP指纹、令牌数、最近更新时间、最近一次KoD时间
+_FIELDS = 4
+
+
+def _table_size(slots: int) -> int:
+    """槽数向上取整为2的幂"""
+    size = 1
+    while size < slots:
+        size <<= 1
+    return size
+
+
+def _stable_hash(ip: str) -> int:
+    """跨进程一致的IP指纹（内置hash的随机种子每个进程不同，不能用于共享表）"""
+    return zlib.crc32(ip.encode()) + 1
+
+
+def shared_table(ctx, slots: int = DEFAULT_SLOTS):
+    """
+    在共享内存中创建限速表
+    
+    Args:
+        ctx: multiprocessing上下文
+        slots: 哈希槽数，向上取整为2的幂
+    
+    Returns:
+        可传给工作进程的RawArray，各进程以RateLimiter(..., shared=表)共用
+    """
+    return ctx.RawArray('d', _table_size(slots) * _FIELDS)
+
+
+class RateLimiter:
+    """
+    按源IP的令牌桶限速器
+    
+    每个槽保存IP指纹、令牌数、最近更新时间与最近一次KoD时间。
+    IP经哈希映射到固定槽位；指纹不一致时新客户端直接占用该槽（以满桶开始），
+    因此冲突只会让限速变得宽松，不会误伤正常客户端。
+    使用共享表时，SO_REUSEPORT把同一客户端的请求分发到不同进程也共用一个令牌桶；
+    多个进程同时更新同一槽时可能少扣令牌，同样只会让限速略为宽松。
+    """
+    
+    def __init__(self, rate: float, burst: float, slots: int = DEFAULT_SLOTS, kod: bool = True,
+                 shared=None):
+        """
+        初始化限速器
+        
+        Args:
+            rate: 每个客户端的平均速率（请求/秒）
+            burst: 令牌桶容量，即允许的突发请求数
+            slots: 哈希槽数，向上取整为2的幂
+            kod: 超限时是否回复RATE KoD，False表示静默丢弃
+            shared: shared_table创建的共享限速表，指定时忽略slots；None表示使用本进程私有的表
+        """
+        self.rate = rate
+        self.burst = burst
+        self.kod = kod
+        
+        # 平行数组保存各槽状态，避免为每个客户端创建对象
+        if shared is None:
+            size = _table_size(slots)
+            self._hash = hash
+            self._keys = array('q', [0]) * size
+            self._tokens = array('d', [0.0]) * size
+            self._updated = array('d', [0.0]) * size
+            self._kod_sent = array('d', [0.0]) * size
+        else:
+            size = len(shared) // _FIELDS
+            self._hash = _stable_hash
+            view = memoryview(shared).cast('B')
+            width = size * 8
+            self._keys = view[:width].cast('q')
+            self._tokens = view[width:2 * width].cast('d')
+            self._updated = view[2 * width:3 * width].cast('d')
+            self._kod_sent = view[3 * width:].cast('d')
+        self._mask = size - 1
+    
+    def check(self, ip: str, now: float) -> int:
+        """
+        为一次请求消耗令牌
+        
+        Args:
+            ip: 客户端IP
+            now: 当前单调时钟（秒）
+        
+        Returns:
+            int: ALLOW、KOD或DROP
+        """
+        key = self._hash(ip) or 1
+        slot = key & self._mask
+        
+        if self._keys[slot] != key:
+            # 新客户端或哈希冲突：以满桶占用该槽
+            self._keys[slot] = key
+            self._tokens[slot] = self.burst - 1.0
+            self._updated[slot] = now
+            self._kod_sent[slot] = 0.0
+            return ALLOW
+        
+        tokens = self._tokens[slot] + (now - self._updated[slot]) * self.rate
+        if tokens > self.burst:
+            tokens = self.burst
+        self._updated[slot] = now
+        
+        if tokens >= 1.0:
+            self._tokens[slot] = tokens - 1.0
+            return ALLOW
+        
+        self._tokens[slot] = tokens
+        if self.kod and now - self._kod_sent[slot] >= KOD_INTERVAL:
+            self._kod_sent[slot] = now
+            return KOD
+        return DROP
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上游服务器地址解析缓存
+后台线程定期解析上游域名，池域名展开为多个地址，解析失败时沿用最近一次成功的结果，
+同步路径只使用缓存的地址，不做DNS查询
+"""
+
+import logging
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 解析结果的缓存时间（秒）。getaddrinfo不返回DNS记录的TTL，按固定时间刷新
+DEFAULT_TTL = 3600.0
+
+# 解析失败后的重试间隔（秒）
+RETRY_INTERVAL = 60.0
+
+# 每个池域名展开的地址数
+POOL_SIZE = 4
+
+
+def is_pool(name: str) -> bool:
+    """
+    判断是否为NTP池域名（每次解析返回一组轮换的服务器）
+    
+    Args:
+        name: 上游域名
+    
+    Returns:
+        bool: 是否为池域名
+    """
+    return name.startswith('pool.') or '.pool.' in name
+
+
+class UpstreamResolver:
+    """
+    上游地址解析缓存
+    
+    每个域名独立记录最近一次成功解析的地址与下次刷新时间。
+    地址集合变化时通过on_change回调通知调用方（新增地址, 移除地址）。
+    """
+    
+    def __init__(self, names: List[str], ttl: float = DEFAULT_TTL, pool_size: int = POOL_SIZE,
+                 family: int = socket.AF_INET,
+                 on_change: Optional[Callable[[List[str], List[str]], None]] = None,
+                 keep: Optional[Callable[[str], bool]] = None):
+        """
+        初始化解析缓存
+        
+        Args:
+            names: 上游域名或地址列表
+            ttl: 解析结果的缓存时间（秒）
+            pool_size: 每个池域名展开的地址数
+            family: 地址族，默认只解析IPv4
+            on_change: 地址集合变化时的回调
+            keep: 判断某个已有地址是否仍然可用，池域名刷新时保留可用地址以免丢失其滤波历史
+        """
+        self.names = list(names)
+        self.ttl = ttl
+        self.pool_size = pool_size
+        self.family = family
+        self.on_change = on_change
+        self.keep = keep
+        
+        self._addresses: Dict[str, List[str]] = {name: [] for name in self.names}
+        self._next_refresh: Dict[str, float] = {name: 0.0 for name in self.names}
+        self._last_success: Dict[str, Optional[float]] = {name: None for name in self.names}
+        self._last_error: Dict[str, Optional[str]] = {name: None for name in self.names}
+        
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # 串行化后台刷新与同步路径的首次解析
+        self._condition = threading.Condition(self._lock)
+        self._running = False
+        self._thread = None
+        self._resolving = False  # 是否有wait_resolved发起的解析正在进行
+    
+    def start(self):
+        """启动后台刷新线程"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='ntp-resolver', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """停止后台刷新线程"""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+    
+    def addresses(self) -> Dict[str, str]:
+        """
+        获取当前可用的上游地址
+        
+        Returns:
+            Dict[str, str]: 地址到其域名的映射
+        """
+        with self._lock:
+            return {address: name for name, addresses in self._addresses.items() for address in addresses}
+    
+    def seed(self, addresses: Dict[str, List[str]]):
+        """
+        用上次运行时保存的地址预填缓存（启动时调用）
+        
+        预填的地址可立即用于同步；域名仍按时解析，解析失败时继续沿用这些地址
+        
+        Args:
+            addresses: 域名到地址列表的映射，不在上游列表中或已有地址的域名被忽略
+        """
+        with self._lock:
+            before = set(self._all_addresses())
+            for name, cached in addresses.items():
+                if name in self._addresses and not self._addresses[name]:
+                    limit = self.pool_size if is_pool(name) else 1
+                    self._addresses[name] = list(cached)[:limit]
+            added = sorted(set(self._all_addresses()) - before)
+        
+        if added and self.on_change is not None:
+            self.on_change(added, [])
+    
+    def wait_resolved(self, timeout: float) -> bool:
+        """
+        缓存中还没有任何地址时，在后台线程中解析并最多等待timeout秒
+        
+        解析在超时后继续进行，完成时通过on_change回调通知，调用方不会被缓慢的DNS阻塞
+        
+        Args:
+            timeout: 最长等待时间（秒）
+        
+        Returns:
+            bool: 返回时缓存中是否有可用地址
+        """
+        with self._condition:
+            if self._all_addresses():
+                return True
+            if not self._resolving:
+                self._resolving = True
+                threading.Thread(target=self._resolve_once, name='ntp-resolver-once', daemon=True).start()
+            self._condition.wait_for(lambda: self._all_addresses() or not self._resolving, timeout)
+            return bool(self._all_addresses())
+    
+    def _resolve_once(self):
+        """wait_resolved发起的解析"""
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"解析上游地址失败: {e}")
+        finally:
+            with self._condition:
+                self._resolving = False
+                self._condition.notify_all()
+    
+    def refresh(self, force: bool = False):
+        """
+        解析到期的域名（阻塞执行）
+        
+        Args:
+            force: 是否忽略缓存时间，解析全部域名
+        """
+        with self._refresh_lock:
+            now = time.monotonic()
+            for name in self.names:
+                if force or self._next_refresh[name] <= now:
+                    self._refresh_name(name)
+    
+    def _run(self):
+        """后台线程：等待最早到期的域名并刷新"""
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"上游地址解析线程错误: {e}")
+            
+            with self._condition:
+                if not self._running:
+                    return
+                delay = min(self._next_refresh.values(), default=time.monotonic() + self.ttl) - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                if not self._running:
+                    return
+    
+    def _resolve(self, name: str) -> List[str]:
+        """
+        解析单个域名（可能阻塞）
+        
+        Args:
+            name: 上游域名
+        
+        Returns:
+            List[str]: 去重后的地址，保持解析器返回的顺序
+        """
+        infos = socket.getaddrinfo(name, 123, self.family, socket.SOCK_DGRAM)
+        return list(dict.fromkeys(info[4][0] for info in infos))
+    
+    def _refresh_name(self, name: str):
+        """解析单个域名并合并结果，失败时保留上次成功的地址"""
+        try:
+            resolved = self._resolve(name)
+            if not resolved:
+                raise socket.gaierror(f"{name} 没有可用地址")
+        except Exception as e:
+            with self._lock:
+                self._next_refresh[name] = time.monotonic() + RETRY_INTERVAL
+                self._last_error[name] = str(e)
+                cached = len(self._addresses[name])
+            logger.warning(f"解析上游 {name} 失败: {e}，沿用缓存的 {cached} 个地址")
+            return
+        
+        with self._lock:
+            current = self._addresses[name]
+        
+        if is_pool(name):
+            # 池域名每次解析返回不同的子集：保留仍然可用的旧地址，空位由新地址补足
+            kept = [address for address in current
+                    if address in resolved or (self.keep is not None and self.keep(address))]
+            fresh = [address for address in resolved if address not in kept]
+            addresses = (kept + fresh)[:self.pool_size]
+        else:
+            addresses = resolved[:1]
+        
+        with self._lock:
+            before = set(self._all_addresses())
+            self._addresses[name] = addresses
+            after = set(self._all_addresses())
+            self._next_refresh[name] = time.monotonic() + self.ttl
+            self._last_success[name] = time.time()
+            self._last_error[name] = None
+        
+        added = sorted(after - before)
+        removed = sorted(before - after)
+        if added or removed:
+            logger.info(f"上游 {name} 解析为 {', '.join(addresses)}")
+            if self.on_change is not None:
+                self.on_change(added, removed)
+            # 回调完成（调用方已据此创建对等体）后再唤醒wait_resolved
+            with self._condition:
+                self._condition.notify_all()
+    
+    def _all_addresses(self) -> List[str]:
+        """全部缓存地址（调用方需持有锁）"""
+        return [address for addresses in self._addresses.values() for address in addresses]
+    
+    def to_dict(self) -> Dict:
+        """
+        导出解析状态
+        
+        Returns:
+            Dict: 每个域名的地址、最近成功时间与最近错误
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: {
+                    'addresses': list(self._addresses[name]),
+                    'last_success': self._last_success[name],
+                    'last_error': self._last_error[name],
+                    'next_refresh': max(self._next_refresh[name] - now, 0.0)
+                }
+                for name in self.names
+            }
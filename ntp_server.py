@@ -5,43 +5,411 @@ NTP校时服务端
 支持从多个NTP服务器获取最新时间，并为客户端提供校时服务
 """
 
+import asyncio
+import heapq
+import multiprocessing
+import os
+import random
+import selectors
+import signal
 import socket
 import struct
 import time
 import threading
 import logging
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
 from datetime import datetime, timezone
 import ntplib
-from typing import List, Dict, Optional
+from typing import List, Dict, NamedTuple, Optional
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('ntp_server.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+import ntp_batch_io
+import ntp_clients
+import ntp_counters
+import ntp_history
+import ntp_journal
+import ntp_logging
+import ntp_metrics
+import ntp_ratelimit
+import ntp_state
+import ntp_validate
+from ntp_discipline import ClockDiscipline, correction_at
+from ntp_peer import MAX_DISTANCE, PHI, Peer, select_clock
+from ntp_resolver import UpstreamResolver
+
+# 配置日志：记录经队列由后台线程写出，日志文件按大小轮转
+ntp_logging.setup_logging()
 logger = logging.getLogger(__name__)
 
+# NTP纪元(1900-01-01)与Unix纪元(1970-01-01)之间的秒数
+NTP_EPOCH_OFFSET = 2208988800
+
+# NTP数据包长度
+NTP_PACKET_SIZE = 48
+
+# 未同步时的层级（RFC 5905）
+STRATUM_UNSYNCHRONIZED = 16
+
+# 偏移量超过此值（秒）的样本视为异常直接丢弃（与ntpd的panic阈值一致）
+PANIC_THRESHOLD = 1000.0
+
+# 响应头部：LI/VN/Mode、层级、轮询间隔、精度、根延迟、根分散、参考标识符、参考时间戳
+_HEADER_STRUCT = struct.Struct('!BBBbIIIQ')
+
+# 响应时间戳：原始、接收、传输（偏移24字节处）
+_TIMESTAMPS_STRUCT = struct.Struct('!QQQ')
+_TIMESTAMPS_OFFSET = 24
+
+# 单个64位时间戳；传输时间戳位于偏移40字节处
+_TIMESTAMP_STRUCT = struct.Struct('!Q')
+_TRANSMIT_OFFSET = 40
+
+
+def to_ntp_timestamp(unix_time: float) -> int:
+    """将Unix时间转换为64位NTP时间戳"""
+    return int((unix_time + NTP_EPOCH_OFFSET) * 2**32)
+
+
+def to_ntp_short(seconds: float) -> int:
+    """将秒转换为32位NTP短格式（16.16定点数）"""
+    return min(int(max(seconds, 0.0) * 2**16), 0xFFFFFFFF)
+
+
+def build_response_template(time_offset: float, last_sync_time: float, stratum: int,
+                            root_delay: float = 1.0, root_dispersion: float = 1.0) -> bytes:
+    """
+    构建响应头部模板
+    
+    常量字段只在同步状态变化时打包一次，每个响应只需写入三个时间戳
+    
+    Args:
+        time_offset: 时间偏移量
+        last_sync_time: 最近一次同步的本地时间
+        stratum: 本服务器层级
+        root_delay: 到主参考源的根延迟（秒）
+        root_dispersion: 相对主参考源的根离散（秒）
+    
+    Returns:
+        bytes: 48字节模板，时间戳字段为0
+    """
+    synchronized = stratum < STRATUM_UNSYNCHRONIZED
+    
+    # 闰秒指示：未同步时为3（告警）
+    leap = 0 if synchronized else 3
+    
+    # 参考时间戳为最近一次校准本地时钟的时间
+    ref_time = to_ntp_timestamp(last_sync_time + time_offset) if synchronized else 0
+    
+    template = bytearray(NTP_PACKET_SIZE)
+    _HEADER_STRUCT.pack_into(
+        template, 0,
+        (leap << 6) | (3 << 3) | 4,  # 版本号(3)和模式(4=服务器)
+        stratum,
+        4,            # 轮询间隔：16秒
+        -6,           # 精度：2^-6 = 15.625ms
+        to_ntp_short(root_delay),
+        to_ntp_short(root_dispersion),
+        0x4E545031,   # 参考标识符："NTP1"
+        ref_time
+    )
+    return bytes(template)
+
+
+# RATE死亡之吻（Kiss-o'-Death）模板：LI=3（告警）、层级0、参考标识符"RATE"
+_KOD_TEMPLATE = bytearray(NTP_PACKET_SIZE)
+_HEADER_STRUCT.pack_into(_KOD_TEMPLATE, 0, (3 << 6) | (3 << 3) | 4, 0, 4, -6, 0, 0, 0x52415445, 0)
+_KOD_TEMPLATE = bytes(_KOD_TEMPLATE)
+
+
+class ClockSnapshot(NamedTuple):
+    """
+    不可变的时钟状态快照
+    
+    同步线程构建新快照后整体替换引用，服务路径只需读取一次引用，无需加锁
+    """
+    time_offset: float       # epoch时刻相对本地系统时钟的偏移量（秒）
+    frequency: float         # 频率校正（秒/秒）
+    epoch: float             # 频率校正起点（time.monotonic()）
+    slew: float              # 自epoch起平滑调整的残差（秒）
+    slew_duration: float     # 平滑调整的持续时间（秒）
+    last_sync_time: float    # 最近一次同步的本地时间
+    stratum: int             # 本服务器层级
+    root_delay: float        # 根延迟（秒）
+    root_dispersion: float   # 根离散（秒）
+    template: bytes          # 对应的响应头部模板
+    
+    def now(self) -> float:
+        """根据快照计算当前准确时间"""
+        return self.from_system(time.time())
+    
+    def from_system(self, system_time: float) -> float:
+        """将本地系统时间（如数据包到达时间）换算为准确时间"""
+        return system_time + self.correction()
+    
+    def correction(self) -> float:
+        """当前相对本地系统时钟的总校正量：相位基准 + 频率 × 经过时间 + 已完成的平滑调整"""
+        if self.frequency or self.slew:
+            return correction_at(self.time_offset, self.frequency, self.epoch,
+                                 self.slew, self.slew_duration, time.monotonic())
+        return self.time_offset
+
+
+class NTPProtocol(asyncio.DatagramProtocol):
+    """UDP数据报协议处理器，在接收回调中直接应答请求，不创建线程"""
+    
+    def __init__(self, server: 'NTPServer'):
+        self.server = server
+        self.transport = None
+    
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def datagram_received(self, data: bytes, addr: tuple):
+        # 在用户态尽早记录到达时间
+        arrival = time.time()
+        response = self.server.handle_request(data, addr, arrival=arrival)
+        if response is not None:
+            self.transport.sendto(response, addr)
+            ntp_metrics.observe_latency(self.server.counters.local(), time.time() - arrival)
+    
+    def error_received(self, exc):
+        # UDP下的ICMP错误（如端口不可达）只影响单个客户端，不中断服务
+        logger.debug(f"UDP套接字错误: {exc}")
+
+
+class SharedClock:
+    """
+    多进程共享的时钟状态
+    
+    由主进程（唯一写者）在每次同步后发布，工作进程只读。
+    使用顺序锁（sequence lock）保证读到的是一次完整的写入。
+    """
+    
+    FIELDS = ('time_offset', 'last_sync_time', 'stratum', 'root_delay', 'root_dispersion',
+              'frequency', 'epoch', 'slew', 'slew_duration')
+    
+    def __init__(self, ctx):
+        # 第0项为序号，写入期间为奇数
+        self._data = ctx.RawArray('d', 1 + len(self.FIELDS))
+    
+    def publish(self, clock: ClockSnapshot):
+        """发布新的时钟状态（仅由主进程调用）"""
+        data = self._data
+        data[0] += 1
+        for i, field in enumerate(self.FIELDS, 1):
+            data[i] = getattr(clock, field)
+        data[0] += 1
+    
+    def read(self) -> tuple:
+        """读取一致的时钟状态，顺序与FIELDS一致"""
+        data = self._data
+        while True:
+            seq = data[0]
+            if seq % 2:
+                continue
+            values = tuple(data[1:])
+            if data[0] == seq:
+                return values
+
+
+class SyncJob:
+    """
+    一次手动触发的后台时间同步任务
+    
+    记录整体状态与每个上游的查询进度，上游查询在同步线程池中完成时更新；
+    达到多数后同步即结束，其余上游的结果仍会在到达后补记。
+    """
+    
+    def __init__(self, upstreams: Dict[str, str]):
+        """
+        初始化同步任务
+        
+        Args:
+            upstreams: 参与同步的上游地址到域名的映射
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.state = 'running'
+        self.success = None
+        self.message = '正在同步'
+        self.created = time.time()
+        self.finished = None
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._upstreams = {
+            address: {'hostname': hostname, 'state': 'pending'}
+            for address, hostname in upstreams.items()
+        }
+    
+    @property
+    def running(self) -> bool:
+        return self.state == 'running'
+    
+    def record(self, address: str, duration: float, response=None, error: Optional[Exception] = None):
+        """
+        记录单个上游的查询结果
+        
+        Args:
+            address: 上游地址
+            duration: 查询耗时（秒）
+            response: 成功时的ntplib响应
+            error: 失败时的异常
+        """
+        with self._lock:
+            upstream = self._upstreams.setdefault(address, {'hostname': address})
+            upstream['duration'] = duration
+            if error is None:
+                upstream.update(state='ok', offset=response.offset, delay=response.delay,
+                                stratum=response.stratum)
+            else:
+                upstream.update(state='failed', error=str(error))
+    
+    def finish(self, success: bool, message: str):
+        """结束任务，仍未响应的上游标记为超时（之后到达的结果仍会覆盖）"""
+        with self._lock:
+            for upstream in self._upstreams.values():
+                if upstream['state'] == 'pending':
+                    upstream['state'] = 'timeout'
+            self.success = success
+            self.message = message
+            self.finished = time.time()
+            self.state = 'succeeded' if success else 'failed'
+    
+    def to_dict(self) -> Dict:
+        """
+        导出任务状态
+        
+        Returns:
+            Dict: 任务状态、结果与各上游的进度
+        """
+        with self._lock:
+            upstreams = [dict(upstream, address=address) for address, upstream in self._upstreams.items()]
+        completed = sum(1 for upstream in upstreams if upstream['state'] in ('ok', 'failed'))
+        return {
+            'id': self.id,
+            'state': self.state,
+            'success': self.success,
+            'message': self.message,
+            'created': self.created,
+            'finished': self.finished,
+            'elapsed': (self.finished or time.time()) - self.created,
+            'coalesced': self.coalesced,
+            'completed': completed,
+            'total': len(upstreams),
+            'upstreams': upstreams
+        }
+
+
+def _run_worker(options, worker_index, shared_clock, shared_counters, shared_rate_table, log_queue):
+    """工作进程入口：只负责应答请求，时钟状态从主进程读取，计数与限速表直接使用共享内存"""
+    # Ctrl+C由主进程统一处理，工作进程随主进程退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # 日志发往主进程统一写出，避免多个进程同时写入和轮转同一个文件
+    ntp_logging.forward_to(log_queue)
+    server = NTPServer(**options)
+    server._worker_index = worker_index
+    server._parent_pid = os.getppid()
+    server._shared_clock = shared_clock
+    
+    # 事件循环线程（即本线程）的计数分片位于共享内存中属于本进程的位置
+    shard = ntp_counters.shared_views(shared_counters, ntp_metrics.SIZE, server.workers)[worker_index]
+    server.counters.bind(shard)
+    if shared_rate_table is not None:
+        server._use_shared_rate_table(shared_rate_table)
+    server.start()
+
+
 class NTPServer:
     """NTP校时服务器"""
     
-    def __init__(self, host='0.0.0.0', port=123, sync_interval=300):
+    # 工作进程从共享状态刷新时钟与上报统计的间隔（秒）
+    SHARED_REFRESH_INTERVAL = 1.0
+    
+    # 轮询定时器的随机抖动比例，避免多台服务器同步轮询上游
+    POLL_JITTER = 0.1
+    
+    # 启动时首次轮询在此时间窗口（秒）内随机分散
+    POLL_STARTUP_SPREAD = 2.0
+    
+    # 同步线程池的线程数上限，上游数量增加时不再增加线程
+    MAX_SYNC_THREADS = 8
+    
+    # 汇总日志的输出间隔（秒）
+    SUMMARY_INTERVAL = 60.0
+    
+    # 保留最近多少个手动同步任务供查询
+    MAX_SYNC_JOBS = 20
+    
+    # 停止时等待进行中的请求处理完毕的最长时间（秒）
+    DRAIN_TIMEOUT = 5.0
+    
+    # 保存状态文件的间隔（秒）
+    STATE_INTERVAL = 300.0
+    
+    # 记录指标历史的间隔（秒）；统计活跃客户端数需要遍历客户端表，间隔更长
+    HISTORY_INTERVAL = 1.0
+    HISTORY_CLIENTS_INTERVAL = 10.0
+    
+    def __init__(self, host='0.0.0.0', port=123, sync_interval=300, protocol='udp', workers=1,
+                 batch_size=0, sync_timeout=10, max_sync_interval=4800, rate_limit=1.0, rate_burst=16,
+                 rate_limit_kod=True, max_clients=10000, journal_path=None,
+                 journal_capacity=ntp_journal.DEFAULT_CAPACITY, state_path=None):
         """
         初始化NTP服务器
         
         Args:
             host: 监听地址
             port: 监听端口
-            sync_interval: 时间同步间隔（秒）
+            sync_interval: 每个上游的最短轮询间隔（秒）
+            protocol: 服务协议，'udp'为标准NTP（默认），'tcp'为旧版每连接一线程模式
+            workers: UDP工作进程数，大于1时各进程通过SO_REUSEPORT绑定同一端口
+            batch_size: 大于1时在Linux上使用recvmmsg/sendmmsg批量收发，0表示逐包处理
+            sync_timeout: 一次同步的总超时时间（秒），所有上游并发查询
+            max_sync_interval: 每个上游的最长轮询间隔（秒），样本稳定时轮询间隔逐步翻倍到此上限
+            rate_limit: 每个客户端IP的平均请求速率上限（次/秒），0表示不限速
+            rate_burst: 每个客户端IP允许的突发请求数
+            rate_limit_kod: 超限时回复RATE KoD（同一客户端每8秒最多一次），False表示静默丢弃
+            max_clients: 客户端统计表最多记录的客户端数，超出时淘汰最久未访问的客户端
+            journal_path: 二进制请求日志文件路径，None表示不记录；多进程模式下工作进程写入“路径.序号”
+            journal_capacity: 请求日志最多保留的记录数，写满后覆盖最旧的记录
+            state_path: 状态文件路径，定期保存时钟驯服状态，启动时据此热启动；None表示不保存
         """
+        if protocol not in ('udp', 'tcp'):
+            raise ValueError(f"不支持的协议: {protocol}")
+        if workers < 1:
+            raise ValueError(f"工作进程数必须大于0: {workers}")
+        
+        if workers > 1 and protocol != 'udp':
+            logger.warning("多进程模式仅支持UDP，将使用单进程")
+            workers = 1
+        if workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+            logger.warning("当前平台不支持SO_REUSEPORT，将使用单进程")
+            workers = 1
+        if batch_size > 1 and (protocol != 'udp' or not ntp_batch_io.is_available()):
+            logger.warning("当前平台或协议不支持批量I/O，将逐包处理")
+            batch_size = 0
+        
         self.host = host
         self.port = port
         self.sync_interval = sync_interval
+        self.max_sync_interval = max(max_sync_interval, sync_interval)
+        self.sync_timeout = sync_timeout
+        self.protocol = protocol
+        self.workers = workers
+        self.batch_size = batch_size
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.rate_limit_kod = rate_limit_kod
         self.running = False
         self.server_socket = None
+        self._loop = None
+        self._batch_io = None
+        
+        # 多进程模式：0号为主进程，负责时间同步并发布共享时钟
+        self._worker_index = 0
+        self._worker_processes = []
+        self._shared_clock = None
+        self._parent_pid = None
         
         # NTP服务器列表（用于时间同步）
         self.ntp_servers = [
@@ -51,128 +419,539 @@ class NTPServer:
             'ntp2.aliyun.com'
         ]
         
-        # 当前时间偏移量
-        self.time_offset = 0.0
-        self.last_sync_time = 0
+        # 当前时钟状态快照，sync_lock只用于串行化写者
+        self._clock = None
         self.sync_lock = threading.Lock()
         
-        # 客户端连接统计
-        self.client_stats = {
-            'total_connections': 0,
-            'active_connections': 0,
-            'last_client_time': None
-        }
-        self.stats_lock = threading.Lock()
+        # 时钟驯服环路：估计本地振荡器频率偏差，小偏差平滑调整
+        self.discipline = ClockDiscipline()
+        self._publish_clock(0.0, 0, STRATUM_UNSYNCHRONIZED)
+        
+        # 事件循环线程复用同一个响应缓冲区
+        self._response_buffer = bytearray(NTP_PACKET_SIZE)
+        
+        # 请求与连接计数：每个服务线程独占一个分片，读取状态或抓取指标时才汇总
+        self.counters = ntp_counters.ShardedCounters(ntp_metrics.SIZE, ntp_metrics.MAX_INDEXES)
+        
+        # 按客户端IP限速，固定大小的哈希槽表；TCP模式下多线程并发更新时令牌数为近似值
+        self._rate_limiter = None
+        if rate_limit > 0:
+            self._rate_limiter = ntp_ratelimit.RateLimiter(rate_limit, rate_burst, kod=rate_limit_kod)
+        
+        # 请求校验：无效、非客户端与重复的请求在生成响应之前丢弃
+        self._validator = ntp_validate.RequestValidator()
+        
+        # 按客户端IP的统计表，分片加锁，容量固定
+        self.client_table = ntp_clients.ClientTable(max_clients)
+        
+        # 二进制请求日志，在start()中打开（工作进程各自打开自己的文件）
+        self.journal_path = journal_path
+        self.journal_capacity = journal_capacity
+        self.journal = None
+        
+        # 逐客户端日志（异常数据包、TCP连接与断开）限量输出，其余只计入每分钟的汇总日志
+        self._client_log = ntp_logging.EventSampler()
+        self._stop_event = threading.Event()
+        
+        # 生命周期事件：套接字已绑定、已开始应答请求、首次时钟更新完成、服务循环已退出
+        self.bound = threading.Event()
+        self.ready = threading.Event()
+        self.first_sync = threading.Event()
+        self.stopped = threading.Event()
+        self.start_error = None
+        self._lifecycle = threading.Condition()
+        self._stopping = False
+        self._serve_thread = None
+        
+        # TCP模式：唤醒accept循环的套接字与正在处理的连接（套接字 -> 连接线程）
+        self._wakeup = None
+        self._connections: Dict[socket.socket, threading.Thread] = {}
+        self._connections_lock = threading.Lock()
+        
+        # 上游对等体（时钟滤波器与选择状态），按解析出的地址区分
+        self.peers: Dict[str, Peer] = {}
+        self.peers_lock = threading.Lock()
         
-        # 创建NTP客户端
+        # 上游域名在后台解析并缓存，池域名展开为多个地址，同步路径不做DNS查询
+        self.resolver = UpstreamResolver(self.ntp_servers, on_change=self._on_upstreams_changed,
+                                         keep=self._is_peer_reachable)
+        
+        # 轮询定时器堆：(到期时间, 服务器)，_poll_due记录各服务器当前有效的到期时间
+        self._poll_heap = []
+        self._poll_due: Dict[str, float] = {}
+        self._polls_in_flight = set()
+        self._poll_condition = threading.Condition()
+        self._last_clock_epoch = 0.0
+        self.system_jitter = 0.0
+        
+        # 创建NTP客户端，上游查询在线程池中并发执行
         self.ntp_client = ntplib.NTPClient()
+        self._sync_executor = None
+        self.last_sync_duration = 0.0
+        
+        # 手动同步任务：同一时刻最多一个在运行，并发的请求合并到该任务
+        self._sync_jobs = OrderedDict()
+        self._sync_jobs_lock = threading.Lock()
+        
+        # 时钟、上游与流量指标的历史，环形缓冲区容量固定（仅主进程记录）
+        self.history = ntp_history.History()
+        
+        # 状态文件：启动时恢复的状态距保存时的秒数，None表示冷启动
+        self.state_path = state_path
+        self.restored_state_age = None
+    
+    @property
+    def time_offset(self) -> float:
+        """当前相对本地系统时钟的总校正量"""
+        return self._clock.correction()
+    
+    @property
+    def last_sync_time(self) -> float:
+        """最近一次同步的本地时间"""
+        return self._clock.last_sync_time
     
-    def sync_time(self) -> bool:
+    @property
+    def stratum(self) -> int:
+        """本服务器层级"""
+        return self._clock.stratum
+    
+    def _publish_clock(self, time_offset: float, last_sync_time: float, stratum: int,
+                       root_delay: float = 1.0, root_dispersion: float = 1.0,
+                       frequency: float = 0.0, epoch: float = 0.0,
+                       slew: float = 0.0, slew_duration: float = 1.0):
         """
-        从多个NTP服务器同步时间
+        构建并发布新的时钟快照（写者需持有sync_lock或处于初始化阶段）
         
-        Returns:
-            bool: 同步是否成功
+        Args:
+            time_offset: 时间偏移量
+            last_sync_time: 最近一次同步的本地时间
+            stratum: 本服务器层级
+            root_delay: 根延迟
+            root_dispersion: 根离散
+            frequency: 频率校正
+            epoch: 频率校正起点
+            slew: 待平滑调整的残差
+            slew_duration: 平滑调整的持续时间
         """
+        stratum = int(stratum)
+        template = build_response_template(time_offset, last_sync_time, stratum,
+                                           root_delay, root_dispersion)
+        # 单次引用赋值，读者要么看到旧快照，要么看到完整的新快照
+        self._clock = ClockSnapshot(time_offset, frequency, epoch, slew, slew_duration,
+                                    last_sync_time, stratum, root_delay, root_dispersion, template)
+        
+        # 多进程模式下由主进程发布给工作进程
+        if self._shared_clock is not None and self._worker_index == 0:
+            self._shared_clock.publish(self._clock)
+    
+    def _query_upstream(self, server: str):
+        """查询单个上游NTP服务器（在同步线程池中执行）"""
+        return self.ntp_client.request(server, version=3, timeout=self.sync_timeout)
+    
+    def _poll_upstream(self, server: str):
+        """
+        轮询单个上游服务器并把结果送入对应对等体的时钟滤波器
+        
+        在同步线程池中执行；未在截止时间内被使用的结果同样会进入滤波器，供下一次选择使用。
+        无论成功与否都会按该对等体的轮询间隔重新安排下一次轮询。
+        """
+        # 轮询期间地址可能已被解析缓存移除，此时丢弃结果且不再安排轮询
         try:
-            logger.info("开始时间同步...")
+            started = time.monotonic()
+            try:
+                response = self._query_upstream(server)
+            except Exception:
+                with self.peers_lock:
+                    peer = self.peers.get(server)
+                    if peer is not None:
+                        peer.last_poll_duration = time.monotonic() - started
+                        peer.record_unreachable()
+                raise
+            duration = time.monotonic() - started
+            
+            if abs(response.offset) >= PANIC_THRESHOLD:
+                raise ValueError(f"偏移量 {response.offset:.3f}秒 超过 {PANIC_THRESHOLD:.0f}秒")
+            
+            with self.peers_lock:
+                peer = self.peers.get(server)
+                if peer is not None:
+                    peer.last_poll_duration = duration
+                    peer.add_sample(
+                        response.offset, response.delay, 2.0 ** response.precision,
+                        response.stratum, response.root_delay, response.root_dispersion
+                    )
+                    # 在peers_lock内记录，避免与移除该上游的历史交错
+                    self.history.record(f"peer_offset:{server}", response.offset)
+                    self.history.record(f"peer_delay:{server}", response.delay)
+                    self.history.record(f"peer_jitter:{server}", peer.jitter)
+            return response
+        finally:
+            with self.peers_lock:
+                peer = self.peers.get(server)
+                interval = peer.poll_interval() if peer is not None else None
+            if interval is not None:
+                self._schedule_poll(server, interval * random.uniform(1 - self.POLL_JITTER, 1 + self.POLL_JITTER))
+    
+    def _on_upstreams_changed(self, added: List[str], removed: List[str]):
+        """
+        解析缓存的地址集合变化：为新地址创建对等体并尽快轮询，移除不再使用的地址
+        
+        Args:
+            added: 新增的地址
+            removed: 移除的地址
+        """
+        addresses = self.resolver.addresses()
+        with self.peers_lock:
+            for address in removed:
+                self.peers.pop(address, None)
+                self.history.remove_peer(address)
+            for address in added:
+                if address not in self.peers:
+                    self.peers[address] = Peer(address, self.sync_interval, self.max_sync_interval,
+                                               hostname=addresses.get(address))
+        
+        # 未运行时由调度线程启动时统一安排
+        if self.running:
+            for address in added:
+                self._schedule_poll(address, random.uniform(0, self.POLL_STARTUP_SPREAD))
+    
+    def _is_peer_reachable(self, address: str) -> bool:
+        """地址对应的对等体最近8次轮询中是否有响应"""
+        with self.peers_lock:
+            peer = self.peers.get(address)
+            return peer is not None and peer.reach != 0
+    
+    def _upstream_addresses(self, timeout: float) -> List[str]:
+        """
+        当前参与同步的上游地址
+        
+        Args:
+            timeout: 尚未解析出任何地址时最多等待解析的时间（秒）
+        
+        Returns:
+            List[str]: 缓存中的地址；尚未解析过时由解析线程解析，超时仍无地址则返回空列表
+        """
+        with self.peers_lock:
+            addresses = list(self.peers)
+        if not addresses and self.resolver.wait_resolved(timeout):
+            with self.peers_lock:
+                addresses = list(self.peers)
+        return addresses
+    
+    def _get_sync_executor(self) -> ThreadPoolExecutor:
+        """
+        获取同步线程池，线程数有上限，上游再多也不会为每个上游各占一个线程
+        
+        Raises:
+            RuntimeError: 服务器正在停止或已停止，不再创建线程池
+        """
+        with self._lifecycle:
+            if self._stopping:
+                raise RuntimeError("NTP服务器正在停止或已停止")
+            if self._sync_executor is None:
+                # 线程按需创建，上一轮未响应的查询可能仍占用线程
+                self._sync_executor = ThreadPoolExecutor(
+                    max_workers=self.MAX_SYNC_THREADS,
+                    thread_name_prefix='ntp-sync'
+                )
+            return self._sync_executor
+    
+    def _schedule_poll(self, server: str, delay: float):
+        """
+        安排上游的下一次轮询
+        
+        同一服务器只有最近一次安排有效，堆中旧的条目在弹出时丢弃
+        
+        Args:
+            server: 上游服务器
+            delay: 距现在的延迟（秒）
+        """
+        due = time.monotonic() + delay
+        with self._poll_condition:
+            self._poll_due[server] = due
+            heapq.heappush(self._poll_heap, (due, server))
+            self._poll_condition.notify()
+    
+    def _collect_responses(self, job: Optional[SyncJob] = None) -> List:
+        """
+        并发查询所有上游服务器，多数服务器响应后立即返回
+        
+        Args:
+            job: 可选，记录各上游查询进度的同步任务
+        
+        Returns:
+            List: 已收到的上游响应
+        """
+        # 地址解析与上游查询共用同一个截止时间
+        deadline = time.monotonic() + self.sync_timeout
+        addresses = self._upstream_addresses(self.sync_timeout)
+        executor = self._get_sync_executor()
+        futures = {
+            executor.submit(self._poll_upstream, server): server
+            for server in addresses
+        }
+        if job is not None:
+            started = time.monotonic()
+            
+            def record(future, server):
+                # 停止时取消的查询没有结果，保持未完成状态，由job.finish标记为超时
+                if future.cancelled():
+                    return
+                error = future.exception()
+                job.record(server, time.monotonic() - started,
+                           None if error else future.result(), error)
             
-            responses = []
-            for server in self.ntp_servers:
+            for future, server in futures.items():
+                future.add_done_callback(lambda f, server=server: record(f, server))
+        quorum = len(futures) // 2 + 1
+        
+        responses = []
+        try:
+            # 按响应到达顺序收集样本，整体受同一个截止时间约束
+            for future in as_completed(futures, timeout=max(deadline - time.monotonic(), 0)):
+                if future.cancelled():
+                    continue
+                server = futures[future]
                 try:
-                    response = self.ntp_client.request(server, version=3, timeout=10)
-                    if response:
-                        responses.append(response)
-                        logger.debug(f"从 {server} 获取时间: {response.tx_time}")
+                    response = future.result()
+                    responses.append(response)
+                    logger.debug(f"从 {server} 获取时间: {response.tx_time}")
                 except Exception as e:
                     logger.warning(f"从 {server} 同步时间失败: {e}")
+                
+                if len(responses) >= quorum:
+                    break
+        except FuturesTimeoutError:
+            pending = [futures[f] for f in futures if not f.done()]
+            logger.warning(f"以下NTP服务器在 {self.sync_timeout} 秒内未响应: {', '.join(pending)}")
+        
+        return responses
+    
+    def sync_time(self, job: Optional[SyncJob] = None) -> bool:
+        """
+        立即从所有NTP服务器同步时间
+        
+        Args:
+            job: 可选，记录各上游查询进度的同步任务
+        
+        Returns:
+            bool: 同步是否成功
+        """
+        try:
+            logger.info("开始时间同步...")
+            started = time.monotonic()
+            
+            responses = self._collect_responses(job)
+            self.last_sync_duration = time.monotonic() - started
             
             if not responses:
                 logger.error("所有NTP服务器都无法连接")
                 return False
             
-            # 计算平均偏移量
-            offsets = []
-            for response in responses:
-                offset = response.offset
-                if abs(offset) < 1000.0:  # 临时放宽过滤条件，允许最大1000秒
-                    offsets.append(offset)
-            
-            if not offsets:
-                logger.warning("所有时间偏移量都被过滤")
-                return False
-            
-            # 使用中位数作为最终偏移量
-            offsets.sort()
-            median_offset = offsets[len(offsets) // 2]
-            
-            with self.sync_lock:
-                self.time_offset = median_offset
-                self.last_sync_time = time.time()
-            
-            logger.info(f"时间同步完成，偏移量: {median_offset:.6f}秒")
-            return True
-            
+            return self._update_clock()
+        
         except Exception as e:
             logger.error(f"时间同步失败: {e}")
             return False
     
-    def get_current_time(self) -> float:
+    def request_sync(self) -> SyncJob:
         """
-        获取当前准确时间（考虑偏移量）
+        在后台线程中立即同步时间，不阻塞调用方
+        
+        已有同步任务在运行时不再启动新的同步，而是返回该任务
         
         Returns:
-            float: 当前时间戳
+            SyncJob: 新建或正在运行的同步任务
+        
+        Raises:
+            RuntimeError: 服务器正在停止或已停止
         """
-        with self.sync_lock:
-            return time.time() + self.time_offset
+        if self._stopping:
+            raise RuntimeError("NTP服务器正在停止或已停止，无法同步")
+        
+        with self._sync_jobs_lock:
+            for job in self._sync_jobs.values():
+                if job.running:
+                    job.coalesced += 1
+                    return job
+            
+            with self.peers_lock:
+                upstreams = {address: peer.hostname for address, peer in self.peers.items()}
+            job = SyncJob(upstreams)
+            self._sync_jobs[job.id] = job
+            while len(self._sync_jobs) > self.MAX_SYNC_JOBS:
+                self._sync_jobs.popitem(last=False)
+        
+        threading.Thread(target=self._run_sync_job, args=(job,), name=f"ntp-sync-job-{job.id}",
+                         daemon=True).start()
+        return job
     
-    def create_ntp_packet(self, mode=3) -> bytes:
+    def _run_sync_job(self, job: SyncJob):
+        """后台执行同步任务"""
+        try:
+            success = self.sync_time(job)
+            job.finish(success, '时间同步完成' if success else '时间同步失败')
+        except Exception as e:
+            job.finish(False, f'时间同步失败: {e}')
+    
+    def get_sync_job(self, job_id: str) -> Optional[Dict]:
         """
-        创建NTP数据包
+        查询同步任务
         
         Args:
-            mode: NTP模式（3=客户端，4=服务器）
+            job_id: request_sync返回的任务ID
         
         Returns:
-            bytes: NTP数据包
+            Optional[Dict]: 任务状态，任务不存在或已被淘汰时返回None
+        """
+        with self._sync_jobs_lock:
+            job = self._sync_jobs.get(job_id)
+        return job.to_dict() if job is not None else None
+    
+    def _update_clock(self) -> bool:
         """
-        # NTP v3 数据包格式
-        packet = bytearray(48)
+        运行时钟选择，系统对等体有新样本时更新时钟驯服环路并发布新的时钟状态
         
-        # 版本号(3)和模式
-        packet[0] = (3 << 3) | mode
+        Returns:
+            bool: 是否存在可用的时钟源
+        """
+        # 时钟选择：交集算法剔除假时钟，聚类后按根距离加权合并
+        with self.peers_lock:
+            result = select_clock(list(self.peers.values()))
+        
+        if result is None:
+            logger.warning("没有满足条件的时钟源，保持当前时间")
+            return False
         
-        # 轮询间隔
-        packet[2] = 4  # 16秒
+        system_peer = result.system_peer
+        with self.sync_lock:
+            # 同一个样本只用于一次驯服更新，否则会重复计入频率误差
+            if system_peer.update_epoch <= self._last_clock_epoch:
+                return True
+            self._last_clock_epoch = system_peer.update_epoch
+            
+            clock = self._clock
+            adjustment = self.discipline.update(result.offset, clock.time_offset, clock.frequency,
+                                                clock.epoch, clock.slew, clock.slew_duration)
+            self.system_jitter = result.jitter
+            self._publish_clock(
+                adjustment.time_offset, time.time(),
+                min(system_peer.stratum + 1, STRATUM_UNSYNCHRONIZED),
+                root_delay=system_peer.root_delay + system_peer.delay,
+                root_dispersion=(system_peer.root_dispersion + system_peer.dispersion
+                                 + result.jitter),
+                frequency=adjustment.frequency,
+                epoch=adjustment.epoch,
+                slew=adjustment.slew,
+                slew_duration=adjustment.slew_duration
+            )
+        
+        if not self.first_sync.is_set():
+            self._signal(self.first_sync)
+        
+        if adjustment.stepped:
+            action = "跳变"
+        else:
+            action = f"平滑调整（{adjustment.slew_duration:.1f}秒）"
+        logger.info(f"时间同步完成，偏移量: {result.offset:.6f}秒，残差: {adjustment.residual:.6f}秒，"
+                    f"{action}，频率: {adjustment.frequency * 1e6:.3f}ppm，抖动: {result.jitter:.6f}秒，"
+                    f"系统对等体: {system_peer.name}，幸存者 {len(result.survivors)} 个")
+        return True
+    
+    def get_current_time(self) -> float:
+        """
+        获取当前准确时间（考虑偏移量）
+        
+        Returns:
+            float: 当前时间戳
+        """
+        return self._clock.now()
+    
+    def _fill_response(self, buffer, origin: int = 0, arrival: Optional[float] = None,
+                       version: int = 3) -> None:
+        """
+        基于模板在给定缓冲区中构建响应，只写入版本号与时间戳字段
         
-        # 精度
-        packet[3] = 0xFA  # 2^-6 = 15.625ms
+        Args:
+            buffer: 长度为48字节的可写缓冲区
+            origin: 原始时间戳，回显客户端请求中的传输时间戳（原始64位值）
+            arrival: 请求到达时的本地系统时间，None表示使用当前时间
+            version: 响应的NTP版本号，与请求一致
+        """
+        # 每个响应只读取一次快照，模板与时间戳来自同一时钟状态
+        clock = self._clock
+        buffer[:] = clock.template
+        if version != 3:
+            buffer[0] = (buffer[0] & 0xC7) | (version << 3)
         
-        # 根延迟
-        struct.pack_into('!I', packet, 4, 0x00010000)  # 1秒
+        if arrival is None:
+            recv_time = to_ntp_timestamp(clock.now())
+        else:
+            recv_time = to_ntp_timestamp(clock.from_system(arrival))
         
-        # 根分散
-        struct.pack_into('!I', packet, 8, 0x00010000)  # 1秒
+        # 传输时间戳最后取值，紧邻发送
+        xmit_time = to_ntp_timestamp(clock.now())
+        _TIMESTAMPS_STRUCT.pack_into(buffer, _TIMESTAMPS_OFFSET, origin, recv_time, xmit_time)
+    
+    def _fill_kod(self, buffer, origin: int, version: int) -> None:
+        """
+        构建RATE KoD响应，不携带本服务器的时间
         
-        # 参考标识符
-        struct.pack_into('!I', packet, 12, 0x4E545031)  # "NTP1"
+        Args:
+            buffer: 长度为48字节的可写缓冲区
+            origin: 客户端请求中的传输时间戳，回显于原始、接收、传输三个字段
+            version: 响应的NTP版本号，与请求一致
+        """
+        buffer[:] = _KOD_TEMPLATE
+        if version != 3:
+            buffer[0] = (buffer[0] & 0xC7) | (version << 3)
+        _TIMESTAMPS_STRUCT.pack_into(buffer, _TIMESTAMPS_OFFSET, origin, origin, origin)
+    
+    def _stamp_transmit(self, buffer, count: int):
+        """
+        批量发送前重写传输时间戳，使其反映真正的发送时刻
         
-        # 参考时间戳
-        ref_time = self.get_current_time()
-        struct.pack_into('!Q', packet, 16, int(ref_time * 2**32))
+        KoD响应（层级为0）的三个时间戳都是回显的客户端时间戳，不携带本服务器的时间，保持不变
         
-        # 原始时间戳
-        struct.pack_into('!Q', packet, 24, int(ref_time * 2**32))
+        Args:
+            buffer: 连续存放的响应缓冲区
+            count: 响应个数
+        """
+        xmit_time = to_ntp_timestamp(self._clock.now())
+        for i in range(count):
+            offset = i * NTP_PACKET_SIZE
+            if buffer[offset + 1] == 0:
+                continue
+            _TIMESTAMP_STRUCT.pack_into(buffer, offset + _TRANSMIT_OFFSET, xmit_time)
+    
+    def _observe_batch_latency(self, arrivals, count: int):
+        """
+        批量发送后记录每个响应的处理延迟
         
-        # 接收时间戳
-        recv_time = self.get_current_time()
-        struct.pack_into('!Q', packet, 32, int(recv_time * 2**32))
+        Args:
+            arrivals: 各响应对应请求的到达时间
+            count: 响应个数
+        """
+        now = time.time()
+        counters = self.counters.local()
+        observe = ntp_metrics.observe_latency
+        for i in range(count):
+            observe(counters, now - arrivals[i])
+    
+    def create_ntp_packet(self, mode=3) -> bytes:
+        """
+        创建NTP数据包
         
-        # 传输时间戳
-        xmit_time = self.get_current_time()
-        struct.pack_into('!Q', packet, 40, int(xmit_time * 2**32))
+        Args:
+            mode: NTP模式（3=客户端，4=服务器）
         
+        Returns:
+            bytes: NTP数据包
+        """
+        packet = bytearray(NTP_PACKET_SIZE)
+        self._fill_response(packet)
+        if mode != 4:
+            packet[0] = (packet[0] & 0xF8) | mode
         return bytes(packet)
     
     def parse_ntp_packet(self, data: bytes) -> Dict:
@@ -193,15 +972,70 @@ class NTPServer:
         version = (li_vn_mode >> 3) & 0x07
         mode = li_vn_mode & 0x07
         
-        # 解析时间戳
-        transmit_time = struct.unpack('!Q', data[40:48])[0] / 2**32
+        # 解析时间戳（转换为Unix时间），同时保留原始值用于回显
+        transmit_timestamp = _TIMESTAMP_STRUCT.unpack_from(data, _TRANSMIT_OFFSET)[0]
+        transmit_time = transmit_timestamp / 2**32 - NTP_EPOCH_OFFSET
         
         return {
             'version': version,
             'mode': mode,
-            'transmit_time': transmit_time
+            'transmit_time': transmit_time,
+            'transmit_timestamp': transmit_timestamp
         }
     
+    def handle_request(self, data: bytes, client_address: tuple, buffer=None,
+                       arrival: Optional[float] = None):
+        """
+        处理单个NTP请求，UDP与TCP模式共用
+        
+        Args:
+            data: 请求数据
+            client_address: 客户端地址
+            buffer: 写入响应的48字节缓冲区，默认为事件循环线程的复用缓冲区
+            arrival: 请求到达时的本地系统时间（内核时间戳或尽早取得的用户态时间）
+        
+        Returns:
+            响应数据包（即写入后的缓冲区），无效请求返回None；
+            缓冲区会被下一次请求覆盖，调用方需立即发送
+        """
+        counters = self.counters.local()
+        reason, version, mode, transmit = self._validator.validate(data, client_address[0])
+        if reason is not None:
+            counters[ntp_metrics.MALFORMED] += 1
+            counters[ntp_metrics.DROP_BASE + reason] += 1
+            if self._client_log.allow():
+                logger.warning(f"丢弃来自 {client_address} 的数据包: {ntp_validate.REASON_TEXTS[reason]}")
+            return None
+        
+        now = arrival if arrival is not None else time.time()
+        ntp_metrics.record_request(counters, mode, version, now)
+        self.client_table.record(client_address[0], version, now)
+        
+        verdict = ntp_ratelimit.ALLOW
+        if self._rate_limiter is not None:
+            verdict = self._rate_limiter.check(client_address[0], time.monotonic())
+            if verdict != ntp_ratelimit.ALLOW:
+                counters[ntp_metrics.RATE_LIMITED] += 1
+                if verdict == ntp_ratelimit.DROP:
+                    counters[ntp_metrics.RATE_DROPPED] += 1
+        
+        if verdict == ntp_ratelimit.DROP:
+            response = None
+        else:
+            if buffer is None:
+                buffer = self._response_buffer
+            if verdict == ntp_ratelimit.KOD:
+                self._fill_kod(buffer, transmit, version)
+            else:
+                self._fill_response(buffer, transmit, arrival, version)
+            response = buffer
+        
+        journal = self.journal
+        if journal is not None:
+            journal.write(now, client_address[0], client_address[1], version, mode, verdict,
+                          transmit, int((time.time() - now) * 1e9))
+        return response
+    
     def handle_client(self, client_socket: socket.socket, client_address: tuple):
         """
         处理客户端连接
@@ -210,104 +1044,678 @@ class NTPServer:
             client_socket: 客户端套接字
             client_address: 客户端地址
         """
+        # 连接线程在连接期间独占一个计数分片，断开后归还供后续连接复用
+        counters = self.counters.acquire()
+        self.counters.bind(counters)
+        counters[ntp_metrics.TOTAL_CONNECTIONS] += 1
+        counters[ntp_metrics.ACTIVE_CONNECTIONS] += 1
+        
         try:
-            with self.stats_lock:
-                self.client_stats['total_connections'] += 1
-                self.client_stats['active_connections'] += 1
-                self.client_stats['last_client_time'] = datetime.now()
+            if self._client_log.allow():
+                logger.info(f"客户端连接: {client_address}")
             
-            logger.info(f"客户端连接: {client_address}")
+            # 每个连接线程使用独立的响应缓冲区
+            buffer = bytearray(NTP_PACKET_SIZE)
             
             while self.running:
                 try:
                     # 接收客户端数据
                     data = client_socket.recv(1024)
+                    arrival = time.time()
                     if not data:
                         break
                     
-                    # 解析NTP请求
-                    request = self.parse_ntp_packet(data)
-                    if not request:
-                        logger.warning(f"无效的NTP数据包来自 {client_address}")
+                    # 解析请求并创建响应数据包
+                    response = self.handle_request(data, client_address, buffer, arrival)
+                    if response is None:
                         continue
                     
-                    # 创建响应数据包
-                    response = self.create_ntp_packet(mode=4)
-                    
                     # 发送响应
                     client_socket.send(response)
-                    
-                    logger.debug(f"为客户端 {client_address} 提供校时服务")
-                    
+                    ntp_metrics.observe_latency(counters, time.time() - arrival)
+                
                 except socket.timeout:
                     continue
                 except Exception as e:
                     logger.error(f"处理客户端 {client_address} 时出错: {e}")
                     break
-                    
+        
         except Exception as e:
             logger.error(f"客户端 {client_address} 连接错误: {e}")
         finally:
             client_socket.close()
-            with self.stats_lock:
-                self.client_stats['active_connections'] -= 1
-            logger.info(f"客户端断开连接: {client_address}")
+            with self._connections_lock:
+                self._connections.pop(client_socket, None)
+            counters[ntp_metrics.ACTIVE_CONNECTIONS] -= 1
+            self.counters.release(counters)
+            if self._client_log.allow():
+                logger.info(f"客户端断开连接: {client_address}")
     
     def start(self):
-        """启动NTP服务器"""
+        """
+        启动NTP服务器（阻塞直到服务器停止）
+        
+        绑定失败等启动错误记录在start_error中，并触发stopped事件
+        """
+        self._serve_thread = threading.current_thread()
+        if self._worker_index == 0 and self.state_path:
+            self._restore_state()
+        if self.journal_path and self.journal is None:
+            path = self.journal_path
+            if self._worker_index:
+                path = f"{path}.{self._worker_index}"
+            try:
+                self.journal = ntp_journal.Journal(path, self.journal_capacity)
+            except (OSError, ValueError) as e:
+                logger.error(f"打开请求日志 {path} 失败，将不记录请求: {e}")
+        
+        if self.protocol == 'tcp':
+            self._serve_tcp()
+        else:
+            self._serve_udp()
+    
+    def start_background(self, timeout: float = 10.0) -> threading.Thread:
+        """
+        在后台线程中启动服务器，开始应答请求后立即返回
+        
+        Args:
+            timeout: 等待服务器就绪的最长时间（秒）
+        
+        Returns:
+            threading.Thread: 运行服务循环的线程
+        
+        Raises:
+            OSError: 绑定端口等启动错误
+            TimeoutError: 超时仍未就绪（此时服务器已被停止）
+        """
+        thread = threading.Thread(target=self.start, name='ntp-server', daemon=True)
+        thread.start()
+        if not self.wait_ready(timeout):
+            self.stop()
+            raise TimeoutError(f"NTP服务器在 {timeout} 秒内未就绪")
+        return thread
+    
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待服务器开始应答请求
+        
+        Args:
+            timeout: 最长等待时间（秒），None表示一直等待
+        
+        Returns:
+            bool: 是否已就绪；超时或服务器已停止时返回False
+        
+        Raises:
+            启动失败时抛出导致失败的异常
+        """
+        with self._lifecycle:
+            self._lifecycle.wait_for(lambda: self.ready.is_set() or self.stopped.is_set(), timeout)
+        if self.start_error is not None:
+            raise self.start_error
+        return self.ready.is_set() and not self.stopped.is_set()
+    
+    def _signal(self, event: threading.Event):
+        """触发生命周期事件并唤醒等待者"""
+        with self._lifecycle:
+            event.set()
+            self._lifecycle.notify_all()
+    
+    def _finish_serving(self):
+        """服务循环退出后的清理：等待进行中的请求处理完毕后触发stopped事件，在服务线程中调用"""
+        self.stop()
+        self._drain_connections(time.monotonic() + self.DRAIN_TIMEOUT)
+        journal, self.journal = self.journal, None
+        if journal is not None:
+            journal.close()
+        if self._worker_index == 0 and self.state_path:
+            self._save_state()
+        if self._worker_index == 0 and self.ready.is_set():
+            logger.info("NTP服务器已停止")
+        self._signal(self.stopped)
+    
+    def _restore_state(self):
+        """
+        热启动：读取状态文件，预填上游地址、恢复各对等体的滤波历史与时钟驯服状态
+        
+        时钟偏移量按保存的频率外推到当前时刻，根离散按停机时长增大、层级降低一级；
+        离散过大（停机太久）或系统时间早于保存时间时不恢复时钟，仍以未同步状态启动
+        """
+        state = ntp_state.load_state(self.state_path)
+        if state is None:
+            return
+        
+        try:
+            elapsed = time.time() - state['saved_at']
+            self.resolver.seed(state['upstreams'])
+            if elapsed >= 0:
+                with self.peers_lock:
+                    for peer_state in state['peers']:
+                        peer = self.peers.get(peer_state['name'])
+                        if peer is not None and not peer.samples:
+                            peer.restore(peer_state, elapsed)
+                            # 恢复的样本已用于上次运行的驯服，不再重复计入
+                            self._last_clock_epoch = max(self._last_clock_epoch, peer.update_epoch)
+            
+            clock = state['clock']
+            root_dispersion = clock['root_dispersion'] + PHI * max(elapsed, 0.0)
+            if elapsed < 0 or clock['root_delay'] / 2 + root_dispersion >= MAX_DISTANCE:
+                logger.warning(f"状态文件保存于 {elapsed:.0f} 秒前，误差无法估计，不恢复时钟状态")
+                return
+            
+            frequency = clock['frequency']
+            self.discipline.restore(frequency)
+            self.system_jitter = clock['system_jitter']
+            with self.sync_lock:
+                self._publish_clock(
+                    clock['time_offset'] + frequency * elapsed, clock['last_sync_time'],
+                    min(clock['stratum'] + 1, STRATUM_UNSYNCHRONIZED - 1),
+                    root_delay=clock['root_delay'],
+                    root_dispersion=root_dispersion,
+                    frequency=self.discipline.frequency,
+                    epoch=time.monotonic()
+                )
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"状态文件 {self.state_path} 内容无效，将从零开始同步: {e}")
+            return
+        
+        self.restored_state_age = elapsed
+        logger.info(f"已从状态文件恢复（保存于 {elapsed:.0f} 秒前），偏移量: {self._clock.time_offset:.6f}秒，"
+                    f"频率: {frequency * 1e6:.3f}ppm，层级: {self._clock.stratum}，"
+                    f"根离散: {root_dispersion:.6f}秒")
+    
+    def _save_state(self):
+        """把当前时钟驯服状态、各对等体的滤波历史与上游地址原子地写入状态文件"""
+        # 本次运行尚未同步成功时不保存，避免热启动的降级状态被当作同步结果再次降级
+        if not self.first_sync.is_set():
+            return
+        
+        clock = self._clock
+        with self.peers_lock:
+            peers = [peer.to_state() for peer in self.peers.values()]
+        state = {
+            'saved_at': time.time(),
+            'clock': {
+                'time_offset': clock.correction(),
+                'frequency': clock.frequency,
+                'last_sync_time': clock.last_sync_time,
+                'stratum': clock.stratum,
+                'root_delay': clock.root_delay,
+                'root_dispersion': clock.root_dispersion,
+                'system_jitter': self.system_jitter
+            },
+            'peers': peers,
+            'upstreams': {name: info['addresses'] for name, info in self.resolver.to_dict().items()}
+        }
+        try:
+            ntp_state.save_state(self.state_path, state)
+        except OSError as e:
+            logger.error(f"保存状态文件 {self.state_path} 失败: {e}")
+    
+    def _create_udp_socket(self) -> socket.socket:
+        """创建并绑定UDP套接字，多进程模式下启用SO_REUSEPORT"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            if self.workers > 1:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((self.host, self.port))
+        except Exception:
+            sock.close()
+            raise
+        return sock
+    
+    def _start_worker_processes(self):
+        """启动其余工作进程，由内核按客户端流在各进程间分发请求"""
+        ctx = multiprocessing.get_context('spawn')
+        self._shared_clock = SharedClock(ctx)
+        self._shared_clock.publish(self._clock)
+        
+        # 每个工作进程在共享内存中有一个计数分片（0号位置不用，主进程使用本地分片）
+        shared_counters = ctx.RawArray('Q', self.workers * ntp_metrics.SIZE)
+        shards = ntp_counters.shared_views(shared_counters, ntp_metrics.SIZE, self.workers)
+        self.counters.add_remote(shards[1:])
+        
+        # 同一客户端的请求可能被分发到不同进程，所有进程共用一张限速表，限速对整个服务生效
+        shared_rate_table = None
+        if self._rate_limiter is not None:
+            shared_rate_table = ntp_ratelimit.shared_table(ctx)
+            self._use_shared_rate_table(shared_rate_table)
+        
+        # 工作进程的日志经此队列交给主进程的监听线程写出
+        log_queue = ctx.Queue()
+        ntp_logging.listen_to(log_queue)
+        
+        options = {
+            'host': self.host,
+            'port': self.port,
+            'sync_interval': self.sync_interval,
+            'max_sync_interval': self.max_sync_interval,
+            'workers': self.workers,
+            'batch_size': self.batch_size,
+            'rate_limit': self.rate_limit,
+            'rate_burst': self.rate_burst,
+            'rate_limit_kod': self.rate_limit_kod,
+            'max_clients': self.client_table.capacity,
+            'journal_path': self.journal_path,
+            'journal_capacity': self.journal_capacity
+        }
+        for index in range(1, self.workers):
+            process = ctx.Process(
+                target=_run_worker,
+                args=(options, index, self._shared_clock, shared_counters, shared_rate_table, log_queue),
+                name=f"ntp-worker-{index}",
+                daemon=True
+            )
+            process.start()
+            self._worker_processes.append(process)
+        logger.info(f"已启动 {self.workers - 1} 个工作进程")
+    
+    def _use_shared_rate_table(self, table):
+        """
+        改用多进程共享的限速表
+        
+        Args:
+            table: ntp_ratelimit.shared_table创建的共享内存
+        """
+        self._rate_limiter = ntp_ratelimit.RateLimiter(self.rate_limit, self.rate_burst,
+                                                       kod=self.rate_limit_kod, shared=table)
+    
+    def _refresh_shared_state(self):
+        """工作进程定时任务：读取主进程发布的时钟"""
+        if not self.running:
+            return
+        
+        # 主进程退出后，工作进程随之停止
+        if os.getppid() != self._parent_pid:
+            self.stop()
+            return
+        
+        values = self._shared_clock.read()
+        clock = self._clock
+        if values != tuple(getattr(clock, field) for field in SharedClock.FIELDS):
+            with self.sync_lock:
+                self._publish_clock(**dict(zip(SharedClock.FIELDS, values)))
+        
+        self._loop.call_later(self.SHARED_REFRESH_INTERVAL, self._refresh_shared_state)
+    
+    def _serve_udp(self):
+        """UDP模式：基于asyncio数据报协议的单线程事件循环"""
+        loop = asyncio.new_event_loop()
+        sock = None
+        transport = None
+        try:
+            sock = self._create_udp_socket()
+            self._signal(self.bound)
+            if self.batch_size > 1:
+                # 批量模式：套接字可读时一次recvmmsg取出多个请求
+                sock.setblocking(False)
+                self._batch_io = ntp_batch_io.BatchIO(sock, self.batch_size)
+                loop.add_reader(sock.fileno(), self._batch_io.drain,
+                                self.handle_request, self._stamp_transmit, self._observe_batch_latency)
+            else:
+                transport, _ = loop.run_until_complete(
+                    loop.create_datagram_endpoint(lambda: NTPProtocol(self), sock=sock)
+                )
+            
+            self._loop = loop
+            self.running = True
+            
+            if self._worker_index == 0:
+                logger.info(f"NTP服务器启动(UDP)，监听 {self.host}:{self.port}")
+                if self.workers > 1:
+                    self._start_worker_processes()
+                
+                # 只有主进程运行时间同步与汇总日志线程
+                self._start_background_threads()
+            else:
+                self._refresh_shared_state()
+            
+            # SIGTERM（kill、systemd停止、主进程结束工作进程）与Ctrl+C一样优雅停止；
+            # 只有主线程能安装信号处理器，Web界面在后台线程中启动时由其自行停止服务器
+            if threading.current_thread() is threading.main_thread():
+                try:
+                    loop.add_signal_handler(signal.SIGTERM, self._handle_sigterm)
+                except NotImplementedError:
+                    # Windows的事件循环不支持信号处理器
+                    pass
+            
+            # 事件循环开始运行后才真正开始应答请求
+            loop.call_soon(self._signal, self.ready)
+            loop.run_forever()
+        
+        except Exception as e:
+            self.start_error = e
+            logger.error(f"启动NTP服务器失败: {e}")
+        finally:
+            self._loop = None
+            if transport:
+                transport.close()
+            elif self._batch_io:
+                loop.remove_reader(sock.fileno())
+            # transport.close()只会在下一轮事件循环中关闭套接字，这里直接关闭以立即释放端口
+            if sock:
+                sock.close()
+            loop.close()
+            self._finish_serving()
+    
+    def _serve_tcp(self):
+        """TCP模式（旧版）：每个连接一个线程"""
+        selector = selectors.DefaultSelector()
+        wakeup_reader = None
         try:
             # 创建服务器套接字
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_socket.bind((self.host, self.port))
             self.server_socket.listen(5)
-            self.server_socket.settimeout(1.0)
+            self.server_socket.setblocking(False)
+            self._signal(self.bound)
+            
+            # stop()向套接字对写入一个字节即可立即唤醒accept循环，无需定时轮询
+            wakeup_reader, self._wakeup = socket.socketpair()
+            selector.register(self.server_socket, selectors.EVENT_READ)
+            selector.register(wakeup_reader, selectors.EVENT_READ)
             
             self.running = True
-            logger.info(f"NTP服务器启动，监听 {self.host}:{self.port}")
+            logger.info(f"NTP服务器启动(TCP)，监听 {self.host}:{self.port}")
             
-            # 启动时间同步线程
-            sync_thread = threading.Thread(target=self._sync_worker, daemon=True)
-            sync_thread.start()
+            # 启动时间同步与汇总日志线程
+            self._start_background_threads()
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGTERM, lambda signum, frame: self._handle_sigterm())
+            self._signal(self.ready)
             
             # 主循环处理客户端连接
-            while self.running:
-                try:
-                    client_socket, client_address = self.server_socket.accept()
+            while self.running and not self._stopping:
+                for key, _ in selector.select():
+                    if key.fileobj is not self.server_socket or not self.running:
+                        continue
+                    try:
+                        client_socket, client_address = self.server_socket.accept()
+                    except BlockingIOError:
+                        continue
+                    except OSError as e:
+                        logger.error(f"接受客户端连接时出错: {e}")
+                        continue
+                    
+                    client_socket.setblocking(True)
                     client_thread = threading.Thread(
                         target=self.handle_client,
                         args=(client_socket, client_address),
                         daemon=True
                     )
+                    with self._connections_lock:
+                        self._connections[client_socket] = client_thread
                     client_thread.start()
-                except socket.timeout:
-                    continue
-                except Exception as e:
-                    if self.running:
-                        logger.error(f"接受客户端连接时出错: {e}")
-                    break
-                    
+        
         except Exception as e:
+            self.start_error = e
             logger.error(f"启动NTP服务器失败: {e}")
         finally:
-            self.stop()
+            selector.close()
+            if wakeup_reader is not None:
+                wakeup_reader.close()
+            if self.server_socket:
+                self.server_socket.close()
+            self._finish_serving()
+    
+    def _handle_sigterm(self):
+        """收到SIGTERM：在服务线程中停止服务器，随后由服务循环完成排空与清理"""
+        if self._worker_index == 0:
+            logger.info("收到终止信号，正在停止服务器...")
+        self.stop()
+    
+    def _start_background_threads(self):
+        """启动时间同步线程与汇总日志线程（仅主进程）"""
+        self._stop_event.clear()
+        threading.Thread(target=self._sync_worker, daemon=True).start()
+        threading.Thread(target=self._summary_worker, daemon=True).start()
+        threading.Thread(target=self._history_worker, daemon=True).start()
+        if self.state_path:
+            threading.Thread(target=self._state_worker, daemon=True).start()
+    
+    def _summary_worker(self):
+        """每分钟输出一条请求汇总日志，代替逐客户端的日志"""
+        last = self.counters.snapshot()
+        while not self._stop_event.wait(self.SUMMARY_INTERVAL):
+            try:
+                current = self.counters.snapshot()
+                requests = current[ntp_metrics.REQUESTS] - last[ntp_metrics.REQUESTS]
+                rate_limited = current[ntp_metrics.RATE_LIMITED] - last[ntp_metrics.RATE_LIMITED]
+                malformed = current[ntp_metrics.MALFORMED] - last[ntp_metrics.MALFORMED]
+                suppressed = self._client_log.take_suppressed()
+                last = current
+                if not (requests or malformed or suppressed):
+                    continue
+                
+                clients = self.client_table.count_active(time.time() - self.SUMMARY_INTERVAL)
+                message = (f"最近{self.SUMMARY_INTERVAL:.0f}秒: {requests}个请求，来自{clients}个客户端，"
+                           f"限速{rate_limited}个，无效数据包{malformed}个")
+                if suppressed:
+                    message += f"，另有{suppressed}条客户端日志未输出"
+                logger.info(message)
+            except Exception as e:
+                logger.error(f"汇总日志线程错误: {e}")
+    
+    def _history_worker(self):
+        """每秒记录时钟与流量指标的历史"""
+        last_requests = self.counters.snapshot()[ntp_metrics.REQUESTS]
+        last_time = time.monotonic()
+        last_clients = 0.0
+        while not self._stop_event.wait(self.HISTORY_INTERVAL):
+            try:
+                now = time.time()
+                clock = self._clock
+                requests = self.counters.snapshot()[ntp_metrics.REQUESTS]
+                monotonic_now = time.monotonic()
+                qps = (requests - last_requests) / max(monotonic_now - last_time, 1e-9)
+                last_requests, last_time = requests, monotonic_now
+                
+                self.history.record('qps', qps, now)
+                if clock.stratum < STRATUM_UNSYNCHRONIZED:
+                    self.history.record('offset', clock.correction(), now)
+                    self.history.record('jitter', self.system_jitter, now)
+                    self.history.record('root_dispersion', clock.root_dispersion, now)
+                if now - last_clients >= self.HISTORY_CLIENTS_INTERVAL:
+                    last_clients = now
+                    clients = self.client_table.count_active(now - self.HISTORY_CLIENTS_INTERVAL)
+                    self.history.record('clients', clients, now)
+            except Exception as e:
+                logger.error(f"指标历史线程错误: {e}")
+    
+    def get_history(self, metric: str, range_seconds: int) -> Dict:
+        """
+        按列查询指标历史
+        
+        Args:
+            metric: 指标名，见ntp_history.METRICS与ntp_history.PEER_METRICS
+            range_seconds: 时间范围（秒）
+        
+        Returns:
+            Dict: 时间列与各序列的数值列
+        
+        Raises:
+            ValueError: 未知的指标名
+        """
+        return self.history.query(metric, range_seconds)
+    
+    def _state_worker(self):
+        """定期保存状态文件，停止时由_finish_serving再保存一次"""
+        while not self._stop_event.wait(self.STATE_INTERVAL):
+            self._save_state()
     
     def _sync_worker(self):
-        """时间同步工作线程"""
+        """
+        时间同步调度线程
+        
+        各上游按自己的轮询间隔排入定时器堆，本线程只等待最早到期的定时器并把轮询提交给线程池，
+        轮询完成后由_poll_upstream重新排入堆中
+        """
+        # 已解析的地址立即安排轮询，之后解析出的地址由_on_upstreams_changed安排
+        self.resolver.start()
+        with self.peers_lock:
+            addresses = list(self.peers)
+        for server in addresses:
+            self._schedule_poll(server, random.uniform(0, self.POLL_STARTUP_SPREAD))
+        
+        condition = self._poll_condition
         while self.running:
             try:
-                self.sync_time()
-                time.sleep(self.sync_interval)
+                with condition:
+                    if not self._poll_heap:
+                        condition.wait()
+                        continue
+                    
+                    due, server = self._poll_heap[0]
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        condition.wait(delay)
+                        continue
+                    
+                    heapq.heappop(self._poll_heap)
+                    # 已被重新安排、已移除或仍在轮询中的条目直接丢弃
+                    if (self._poll_due.get(server) != due or server not in self.peers
+                            or server in self._polls_in_flight):
+                        continue
+                    self._polls_in_flight.add(server)
+                
+                self._get_sync_executor().submit(self._scheduled_poll, server)
             except Exception as e:
                 logger.error(f"时间同步线程错误: {e}")
-                time.sleep(60)  # 出错时等待1分钟后重试
+                time.sleep(1)
+    
+    def _scheduled_poll(self, server: str):
+        """定时器到期后轮询单个上游，有新样本时更新时钟（在同步线程池中执行）"""
+        # 启动后的同步都由定时轮询完成，其耗时（轮询加时钟选择与驯服）同样计入最近一次同步耗时
+        started = time.monotonic()
+        try:
+            response = self._poll_upstream(server)
+            logger.debug(f"从 {server} 获取时间: {response.tx_time}")
+        except Exception as e:
+            logger.warning(f"从 {server} 同步时间失败: {e}")
+            self.last_sync_duration = time.monotonic() - started
+            return
+        finally:
+            with self._poll_condition:
+                self._polls_in_flight.discard(server)
+        
+        try:
+            self._update_clock()
+        except Exception as e:
+            logger.error(f"时间同步失败: {e}")
+        self.last_sync_duration = time.monotonic() - started
     
     def stop(self):
-        """停止NTP服务器"""
+        """
+        停止NTP服务器
+        
+        立即唤醒服务循环与后台线程，在DRAIN_TIMEOUT内等待进行中的请求处理完毕，
+        超时仍未结束的TCP连接与工作进程被强制结束
+        """
+        with self._lifecycle:
+            if self._stopping:
+                return
+            self._stopping = True
+        deadline = time.monotonic() + self.DRAIN_TIMEOUT
+        
         self.running = False
-        if self.server_socket:
-            self.server_socket.close()
-        logger.info("NTP服务器已停止")
+        self._stop_event.set()
+        wakeup = self._wakeup
+        if wakeup is not None:
+            try:
+                wakeup.send(b'\0')
+            except OSError:
+                pass
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(loop.stop)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+        
+        self.resolver.stop()
+        
+        # 唤醒调度线程使其退出
+        with self._poll_condition:
+            self._poll_heap.clear()
+            self._poll_due.clear()
+            self._poll_condition.notify_all()
+        
+        # _stopping已置位，之后不会再创建新的线程池
+        with self._lifecycle:
+            executor, self._sync_executor = self._sync_executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        
+        # 主进程负责结束工作进程：SIGTERM使其处理完当前请求后退出，超时则强制结束
+        processes, self._worker_processes = self._worker_processes, []
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"工作进程 {process.name} 未在 {self.DRAIN_TIMEOUT} 秒内退出，强制结束")
+                process.kill()
+                process.join()
+        
+        # 等待服务循环与进行中的连接处理完当前请求（在服务线程内调用时由服务线程随后完成）
+        serve_thread = self._serve_thread
+        if serve_thread is not None and serve_thread is not threading.current_thread():
+            self.stopped.wait(max(deadline - time.monotonic(), 0))
+    
+    def _drain_connections(self, deadline: float):
+        """
+        TCP模式：等待进行中的连接处理完当前请求
+        
+        关闭各连接的读方向，连接线程发送完当前响应后recv返回空数据并退出；
+        截止时间后仍未结束的连接被直接关闭
+        
+        Args:
+            deadline: 截止时间（单调时钟）
+        """
+        with self._connections_lock:
+            connections = list(self._connections.items())
+        if not connections:
+            return
+        
+        for client_socket, _ in connections:
+            try:
+                client_socket.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+        for _, thread in connections:
+            thread.join(max(deadline - time.monotonic(), 0))
+        
+        remaining = [client_socket for client_socket, thread in connections if thread.is_alive()]
+        if remaining:
+            logger.warning(f"{len(remaining)} 个TCP连接未在 {self.DRAIN_TIMEOUT} 秒内结束，强制关闭")
+            for client_socket in remaining:
+                try:
+                    client_socket.close()
+                except OSError:
+                    pass
+    
+    def get_clients(self, page: int = 1, per_page: int = 50) -> Dict:
+        """
+        按请求速率降序分页获取客户端统计（多进程模式下只包含主进程处理的客户端）
+        
+        Args:
+            page: 页码，从1开始
+            per_page: 每页数量
+        
+        Returns:
+            Dict: 客户端总数、页码与本页客户端列表
+        """
+        return self.client_table.top(page, per_page)
+    
+    def get_metrics(self) -> List[int]:
+        """
+        汇总所有线程与工作进程的计数分片
+        
+        Returns:
+            List[int]: 按ntp_metrics布局汇总的计数
+        """
+        return self.counters.snapshot()
     
     def get_status(self) -> Dict:
         """
@@ -316,23 +1724,92 @@ class NTPServer:
         Returns:
             Dict: 服务器状态信息
         """
-        with self.sync_lock:
-
-            return {
-                'running': self.running,
-                'host': self.host,
-                'port': self.port,
-                'time_offset': self.time_offset,
-                'last_sync_time': self.last_sync_time,
-                'current_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'client_stats': self.client_stats.copy()
-            }
+        counters = self.counters.snapshot()
+        last_request = counters[ntp_metrics.LAST_REQUEST_US]
+        client_stats = {
+            'total_connections': counters[ntp_metrics.TOTAL_CONNECTIONS],
+            'active_connections': counters[ntp_metrics.ACTIVE_CONNECTIONS],
+            'total_requests': counters[ntp_metrics.REQUESTS],
+            'rate_limited': counters[ntp_metrics.RATE_LIMITED],
+            'rate_dropped': counters[ntp_metrics.RATE_DROPPED],
+            'last_client_time': datetime.fromtimestamp(last_request / 1e6) if last_request else None,
+            'tracked_clients': len(self.client_table)
+        }
+        
+        with self.peers_lock:
+            peers = [peer.to_dict() for peer in self.peers.values()]
+        
+        clock = self._clock
+        return {
+            'running': self.running,
+            'ready': self.ready.is_set(),
+            'synced': self.first_sync.is_set(),
+            'restored_state_age': self.restored_state_age,
+            'host': self.host,
+            'port': self.port,
+            'protocol': self.protocol,
+            'workers': self.workers,
+            'stratum': clock.stratum,
+            'batch_io': self._batch_io.get_stats() if self._batch_io else None,
+            'time_offset': clock.correction(),
+            'frequency_ppm': clock.frequency * 1e6,
+            'last_sync_time': clock.last_sync_time,
+            'last_sync_duration': self.last_sync_duration,
+            'root_delay': clock.root_delay,
+            'root_dispersion': clock.root_dispersion,
+            'system_jitter': self.system_jitter,
+            'peers': peers,
+            'upstreams': self.resolver.to_dict(),
+            'current_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'client_stats': client_stats
+        }
 
 if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='NTP校时服务端')
+    parser.add_argument('--host', default='0.0.0.0', help='监听地址 (默认: 0.0.0.0)')
+    parser.add_argument('-p', '--port', type=int, default=123, help='监听端口 (默认: 123)')
+    parser.add_argument('--tcp', action='store_true', help='使用旧版TCP模式代替标准UDP')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='UDP工作进程数，建议设为CPU核数 (默认: 1)')
+    parser.add_argument('-b', '--batch', type=int, default=0,
+                        help='Linux下每次recvmmsg/sendmmsg处理的最大数据报数，0为逐包处理 (默认: 0)')
+    parser.add_argument('--rate-limit', type=float, default=1.0,
+                        help='每个客户端IP的平均请求速率上限(次/秒)，多进程模式下为所有工作进程合计，0为不限速 (默认: 1.0)')
+    parser.add_argument('--rate-burst', type=int, default=16,
+                        help='每个客户端IP允许的突发请求数 (默认: 16)')
+    parser.add_argument('--no-kod', action='store_true', help='超限请求静默丢弃，不回复RATE KoD')
+    parser.add_argument('--journal', default=None,
+                        help='二进制请求日志文件，可用ntp_journal.py分析或回放 (默认: 不记录)')
+    parser.add_argument('--journal-records', type=int, default=ntp_journal.DEFAULT_CAPACITY,
+                        help=f'请求日志最多保留的记录数 (默认: {ntp_journal.DEFAULT_CAPACITY})')
+    parser.add_argument('--state', default=ntp_state.DEFAULT_STATE_FILE,
+                        help=f'时钟状态文件，重启时据此热启动 (默认: {ntp_state.DEFAULT_STATE_FILE})')
+    parser.add_argument('--no-state', action='store_true', help='不保存也不恢复时钟状态')
+    args = parser.parse_args()
+    
     # 创建并启动NTP服务器
-    server = NTPServer()
+    server = NTPServer(host=args.host, port=args.port,
+                       protocol='tcp' if args.tcp else 'udp',
+                       workers=args.workers,
+                       batch_size=args.batch,
+                       rate_limit=args.rate_limit,
+                       rate_burst=args.rate_burst,
+                       rate_limit_kod=not args.no_kod,
+                       journal_path=args.journal,
+                       journal_capacity=args.journal_records,
+                       state_path=None if args.no_state else args.state)
+    
+    # 服务循环开始前收到SIGTERM时按Ctrl+C处理；开始服务后由服务循环自己的处理器优雅停止
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, terminate)
+    
     try:
         server.start()
     except KeyboardInterrupt:
         logger.info("收到中断信号，正在停止服务器...")
-        server.stop() 
\ No newline at end of file
+        server.stop()
+    if server.start_error is not None:
+        raise SystemExit(1) 
\ No newline at end of file
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NTP服务器状态文件
+定期保存时钟驯服状态（偏移量、频率、各对等体的滤波历史、上游地址），
+重启时读取，使服务器在首次同步完成前即可提供经过校正的时间
+"""
+
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 状态文件格式版本，不一致时忽略旧文件
+FORMAT_VERSION = 1
+
+# 默认状态文件路径
+DEFAULT_STATE_FILE = 'ntp_state.json'
+
+
+def save_state(path: str, state: Dict):
+    """
+    原子地写入状态文件：先写同目录下的临时文件并落盘，再替换原文件，
+    进程在任何时刻退出都不会留下写了一半的状态文件
+    
+    Args:
+        path: 状态文件路径
+        state: 要保存的状态
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.ntp_state.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(dict(state, version=FORMAT_VERSION), f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_state(path: str) -> Optional[Dict]:
+    """
+    读取状态文件
+    
+    Args:
+        path: 状态文件路径
+    
+    Returns:
+        Optional[Dict]: 保存的状态；文件不存在、已损坏或版本不符时返回None
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"读取状态文件 {path} 失败，将从零开始同步: {e}")
+        return None
+    
+    if not isinstance(state, dict) or state.get('version') != FORMAT_VERSION:
+        logger.warning(f"状态文件 {path} 的格式版本不受支持，将从零开始同步")
+        return None
+    return state
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NTP请求校验
+在生成任何响应之前用一次struct解包检查请求头部，
+丢弃过短、版本或模式不符、字段异常以及重复/重放的数据包，避免服务器被用于反射放大
+"""
+
+import struct
+from array import array
+from typing import Optional, Tuple
+
+# 完整的48字节头部：LI/VN/Mode、层级、轮询间隔、精度、根延迟、根离散、参考标识符、参考/原始/接收/传输时间戳
+REQUEST = struct.Struct('!BBbbIIIQQQQ')
+
+# 丢弃原因，下标即ntp_metrics中丢弃计数的偏移
+SHORT = 0       # 不足48字节
+VERSION = 1     # 版本号不在1~4之间
+MODE = 2        # 不是客户端请求（如服务器响应、控制或私有模式报文）
+FIELD = 3       # 字段异常：层级超出范围或原始时间戳与传输时间戳相同
+DUPLICATE = 4   # 与该客户端上一个请求的传输时间戳相同
+
+REASONS = ('short', 'version', 'mode', 'field', 'duplicate')
+REASON_TEXTS = ('数据包过短', '不支持的版本号', '不是客户端请求', '字段异常', '重复或重放的请求')
+
+# 默认哈希槽数（2的幂）
+DEFAULT_SLOTS = 1 << 16
+
+# 合法的最大层级（16表示未同步）
+MAX_STRATUM = 16
+
+
+class RequestValidator:
+    """
+    请求校验器
+    
+    重复检测与限速器相同，使用固定大小的哈希槽数组：每个槽保存客户端IP指纹与其上一个请求的传输时间戳。
+    指纹不一致时新客户端直接占用该槽，冲突只会漏检重复请求，不会误判正常请求。
+    """
+    
+    def __init__(self, slots: int = DEFAULT_SLOTS):
+        """
+        初始化校验器
+        
+        Args:
+            slots: 重复检测的哈希槽数，向上取整为2的幂
+        """
+        size = 1
+        while size < slots:
+            size <<= 1
+        self._mask = size - 1
+        self._keys = array('q', [0]) * size
+        self._transmits = array('Q', [0]) * size
+    
+    def validate(self, data: bytes, ip: str) -> Tuple[Optional[int], int, int, int]:
+        """
+        校验一个请求
+        
+        Args:
+            data: 请求数据
+            ip: 客户端IP
+        
+        Returns:
+            Tuple: (丢弃原因, 版本号, 模式, 传输时间戳原始64位值)，请求有效时丢弃原因为None
+        """
+        if len(data) < REQUEST.size:
+            return SHORT, 0, 0, 0
+        
+        li_vn_mode, stratum, _, _, _, _, _, _, origin, _, transmit = REQUEST.unpack_from(data)
+        version = (li_vn_mode >> 3) & 0x07
+        mode = li_vn_mode & 0x07
+        
+        if not 1 <= version <= 4:
+            return VERSION, version, mode, transmit
+        # NTPv1客户端的请求模式为0（RFC 5905附录A），按客户端请求处理
+        if mode != 3 and not (mode == 0 and version == 1):
+            return MODE, version, mode, transmit
+        # SNTP客户端可以只填写模式与版本号，其余字段（包括传输时间戳）全为0（RFC 4330第5节），
+        # 这类请求无法做字段与重复检查，直接应答
+        if transmit == 0:
+            return None, version, mode, transmit
+        if stratum > MAX_STRATUM or origin == transmit:
+            return FIELD, version, mode, transmit
+        
+        key = hash(ip) or 1
+        slot = key & self._mask
+        if self._keys[slot] == key and self._transmits[slot] == transmit:
+            return DUPLICATE, version, mode, transmit
+        self._keys[slot] = key
+        self._transmits[slot] = transmit
+        return None, version, mode, transmit
@@ -44,14 +44,14 @@ def start_with_waitress():
     """使用waitress启动Web服务"""
     try:
         from waitress import serve
-        from web_interface import app
+        from web_interface import app, STREAM_MAX_CLIENTS
         
         print("使用生产级WSGI服务器启动...")
         print("访问地址: http://localhost:5000")
         print("按 Ctrl+C 停止服务")
         
-        # 启动WSGI服务器
-        serve(app, host='0.0.0.0', port=5000, threads=4)
+        # 启动WSGI服务器：每个状态推送连接长期占用一个线程，线程数需覆盖推送连接上限与普通请求
+        serve(app, host='0.0.0.0', port=5000, threads=STREAM_MAX_CLIENTS + 4)
         
     except ImportError:
         print("✗ waitress未安装，回退到开发服务器")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+时钟驯服算法测试
+用合成的偏移量序列和可控的单调时钟驱动ClockDiscipline
+"""
+
+import unittest
+from unittest import mock
+
+from ntp_discipline import (MAX_FREQUENCY, MAX_SLEW_RATE, STEP_THRESHOLD, ClockDiscipline,
+                            Correction, correction_at)
+
+
+class DisciplineRunner:
+    """按服务器的用法反复调用update：保存返回的校正参数，下次更新时原样传回"""
+    
+    def __init__(self, discipline: ClockDiscipline):
+        self.discipline = discipline
+        self.now = 1000.0
+        self.correction = Correction(0.0, 0.0, self.now, 0.0, 1.0, 0.0, False)
+    
+    def update(self, measured_offset: float, elapsed: float = 0.0) -> Correction:
+        """经过elapsed秒后以measured_offset更新一次"""
+        self.now += elapsed
+        c = self.correction
+        with mock.patch('ntp_discipline.time.monotonic', return_value=self.now):
+            self.correction = self.discipline.update(measured_offset, c.time_offset, c.frequency,
+                                                     c.epoch, c.slew, c.slew_duration)
+        return self.correction
+    
+    def served_offset(self) -> float:
+        """当前时刻服务器给出的总校正量"""
+        c = self.correction
+        return correction_at(c.time_offset, c.frequency, c.epoch, c.slew, c.slew_duration, self.now)
+
+
+class ClockDisciplineTest(unittest.TestCase):
+    """跳变、平滑调整与频率估计"""
+    
+    def test_first_update_steps(self):
+        runner = DisciplineRunner(ClockDiscipline())
+        correction = runner.update(0.5)
+        self.assertTrue(correction.stepped)
+        self.assertEqual(correction.time_offset, 0.5)
+        self.assertEqual(correction.slew, 0.0)
+    
+    def test_small_residual_slews_at_bounded_rate(self):
+        runner = DisciplineRunner(ClockDiscipline())
+        runner.update(0.5)
+        correction = runner.update(0.51, elapsed=64)
+        self.assertFalse(correction.stepped)
+        self.assertAlmostEqual(correction.slew, 0.01)
+        self.assertAlmostEqual(correction.slew_duration, 0.01 / MAX_SLEW_RATE)
+        # 服务时间连续：新基准等于更新前的校正量
+        self.assertAlmostEqual(runner.served_offset(), 0.5, places=9)
+        runner.now += correction.slew_duration
+        expected = 0.51 + correction.frequency * correction.slew_duration
+        self.assertAlmostEqual(runner.served_offset(), expected, places=9)
+    
+    def test_large_residual_steps_and_resets_frequency(self):
+        runner = DisciplineRunner(ClockDiscipline())
+        runner.update(0.0)
+        runner.update(0.004, elapsed=64)
+        self.assertNotEqual(runner.discipline.frequency, 0.0)
+        correction = runner.update(0.004 + 2 * STEP_THRESHOLD, elapsed=64)
+        self.assertTrue(correction.stepped)
+        self.assertEqual(correction.frequency, 0.0)
+    
+    def test_frequency_is_clamped(self):
+        runner = DisciplineRunner(ClockDiscipline())
+        drift = 5000e-6
+        runner.update(0.0)
+        for i in range(1, 20):
+            correction = runner.update(drift * 16 * i, elapsed=16)
+            self.assertLessEqual(abs(correction.frequency), MAX_FREQUENCY)
+        self.assertEqual(runner.discipline.frequency, MAX_FREQUENCY)
+    
+    def test_fll_converges_to_oscillator_drift(self):
+        runner = DisciplineRunner(ClockDiscipline())
+        drift = 100e-6
+        start = runner.now
+        runner.update(0.01)
+        for _ in range(40):
+            correction = runner.update(0.01 + drift * (runner.now + 64 - start), elapsed=64)
+        self.assertAlmostEqual(runner.discipline.frequency, drift, delta=1e-6)
+        self.assertLess(abs(correction.residual), 1e-4)
+        self.assertFalse(correction.stepped)
+    
+    def test_warm_start_slews_first_update(self):
+        discipline = ClockDiscipline()
+        discipline.restore(50e-6)
+        runner = DisciplineRunner(discipline)
+        correction = runner.update(0.05)
+        self.assertFalse(correction.stepped)
+        self.assertAlmostEqual(correction.slew, 0.05)
+        # 热启动后的首次残差不计入频率估计
+        self.assertEqual(correction.frequency, 50e-6)
+    
+    def test_restore_clamps_frequency(self):
+        discipline = ClockDiscipline()
+        discipline.restore(-1.0)
+        self.assertEqual(discipline.frequency, -MAX_FREQUENCY)
+
+
+if __name__ == '__main__':
+    unittest.main()
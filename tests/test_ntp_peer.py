@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+时钟滤波与选择算法测试
+用构造的样本驱动，结果不依赖网络与系统时钟
+"""
+
+import unittest
+
+from ntp_peer import (MIN_CLUSTER_SURVIVORS, STATUS_FALSETICKER, STATUS_OUTLIER, STATUS_SURVIVOR,
+                      STATUS_SYSTEM_PEER, STATUS_UNREACHABLE, STATUS_UNSELECTED, Peer, select_clock)
+
+
+def make_peer(name: str, offset: float, delay: float = 0.02, stratum: int = 2) -> Peer:
+    """创建带一个样本的对等体，根距离约为11毫秒"""
+    peer = Peer(name)
+    peer.add_sample(offset, delay, 2 ** -20, stratum, 0.0, 0.001)
+    return peer
+
+
+class ClockFilterTest(unittest.TestCase):
+    """时钟滤波"""
+    
+    def test_picks_lowest_delay_sample(self):
+        peer = Peer('a')
+        for offset, delay in ((0.010, 0.050), (0.002, 0.010), (0.030, 0.080)):
+            peer.add_sample(offset, delay, 2 ** -20, 2, 0.0, 0.001)
+        self.assertEqual(peer.offset, 0.002)
+        self.assertEqual(peer.delay, 0.010)
+        self.assertEqual(peer.reach, 0o7)
+        self.assertGreater(peer.jitter, 0.0)
+    
+    def test_unreachable_after_eight_missed_polls(self):
+        peer = make_peer('a', 0.0)
+        for _ in range(7):
+            peer.record_unreachable()
+        self.assertNotEqual(peer.status, STATUS_UNREACHABLE)
+        peer.record_unreachable()
+        self.assertEqual(peer.reach, 0)
+        self.assertEqual(peer.status, STATUS_UNREACHABLE)
+        self.assertFalse(peer.is_selectable())
+
+
+class SelectClockTest(unittest.TestCase):
+    """交集、聚类与合并"""
+    
+    def test_single_peer_becomes_system_peer(self):
+        peer = make_peer('a', 0.005)
+        result = select_clock([peer])
+        self.assertIs(result.system_peer, peer)
+        self.assertAlmostEqual(result.offset, 0.005)
+        self.assertEqual(peer.status, STATUS_SYSTEM_PEER)
+    
+    def test_falseticker_is_excluded(self):
+        peers = [make_peer('a', 0.000), make_peer('b', 0.001), make_peer('c', 1.000)]
+        result = select_clock(peers)
+        self.assertEqual(peers[2].status, STATUS_FALSETICKER)
+        self.assertNotIn(peers[2], result.survivors)
+        self.assertLess(abs(result.offset), 0.002)
+    
+    def test_no_majority_marks_peers_unselected(self):
+        peers = [make_peer('a', 0.000), make_peer('b', 1.000)]
+        self.assertIsNone(select_clock(peers))
+        self.assertEqual([peer.status for peer in peers], [STATUS_UNSELECTED, STATUS_UNSELECTED])
+    
+    def test_invalid_stratum_is_falseticker(self):
+        peers = [make_peer('a', 0.000), make_peer('b', 0.000, stratum=16)]
+        result = select_clock(peers)
+        self.assertEqual(result.survivors, [peers[0]])
+        self.assertEqual(peers[1].status, STATUS_FALSETICKER)
+    
+    def test_cluster_prunes_outlier(self):
+        peers = [make_peer('a', 0.000), make_peer('b', 0.001), make_peer('c', 0.002),
+                 make_peer('d', 0.015)]
+        result = select_clock(peers)
+        self.assertEqual(len(result.survivors), MIN_CLUSTER_SURVIVORS)
+        self.assertEqual(peers[3].status, STATUS_OUTLIER)
+        for peer in result.survivors[1:]:
+            self.assertEqual(peer.status, STATUS_SURVIVOR)
+        self.assertEqual(result.system_peer.status, STATUS_SYSTEM_PEER)
+        self.assertLess(result.offset, 0.002)
+    
+    def test_combine_weights_by_root_distance(self):
+        near = make_peer('near', 0.000, delay=0.002)
+        far = make_peer('far', 0.003, delay=0.040)
+        result = select_clock([near, far])
+        self.assertIs(result.system_peer, near)
+        self.assertGreater(result.offset, 0.0)
+        self.assertLess(result.offset, 0.002)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+客户端限速测试
+时间以参数传入，结果与运行速度无关
+"""
+
+import multiprocessing
+import unittest
+
+from ntp_ratelimit import ALLOW, DROP, KOD, KOD_INTERVAL, RateLimiter, shared_table
+
+# 单调时钟起点，远大于KOD_INTERVAL，与真实的time.monotonic()取值范围一致
+START = 1000.0
+
+
+class RateLimiterTest(unittest.TestCase):
+    """令牌桶、RATE KoD与共享表"""
+    
+    def test_burst_then_kod_then_drop(self):
+        limiter = RateLimiter(rate=1.0, burst=4)
+        verdicts = [limiter.check('192.0.2.1', START) for _ in range(6)]
+        self.assertEqual(verdicts, [ALLOW] * 4 + [KOD, DROP])
+    
+    def test_tokens_refill_at_rate(self):
+        limiter = RateLimiter(rate=2.0, burst=4)
+        for _ in range(4):
+            limiter.check('192.0.2.1', START)
+        self.assertNotEqual(limiter.check('192.0.2.1', START), ALLOW)
+        # 0.5秒补充1个令牌
+        self.assertEqual(limiter.check('192.0.2.1', START + 0.5), ALLOW)
+        self.assertNotEqual(limiter.check('192.0.2.1', START + 0.5), ALLOW)
+    
+    def test_refill_is_capped_at_burst(self):
+        limiter = RateLimiter(rate=1.0, burst=3)
+        limiter.check('192.0.2.1', START)
+        verdicts = [limiter.check('192.0.2.1', START + 3600) for _ in range(4)]
+        self.assertEqual(verdicts, [ALLOW] * 3 + [KOD])
+    
+    def test_kod_at_most_once_per_interval(self):
+        limiter = RateLimiter(rate=0.001, burst=1)
+        self.assertEqual(limiter.check('192.0.2.1', START), ALLOW)
+        self.assertEqual(limiter.check('192.0.2.1', START), KOD)
+        self.assertEqual(limiter.check('192.0.2.1', START + KOD_INTERVAL / 2), DROP)
+        self.assertEqual(limiter.check('192.0.2.1', START + KOD_INTERVAL), KOD)
+    
+    def test_no_kod_drops_silently(self):
+        limiter = RateLimiter(rate=1.0, burst=1, kod=False)
+        self.assertEqual(limiter.check('192.0.2.1', START), ALLOW)
+        self.assertEqual(limiter.check('192.0.2.1', START), DROP)
+    
+    def test_clients_are_limited_independently(self):
+        limiter = RateLimiter(rate=1.0, burst=1)
+        self.assertEqual(limiter.check('192.0.2.1', START), ALLOW)
+        self.assertEqual(limiter.check('192.0.2.2', START), ALLOW)
+        self.assertEqual(limiter.check('192.0.2.1', START), KOD)
+    
+    def test_shared_table_limits_across_limiters(self):
+        table = shared_table(multiprocessing.get_context('spawn'), slots=64)
+        workers = [RateLimiter(rate=1.0, burst=4, shared=table) for _ in range(4)]
+        # 同一客户端的请求轮流落到各个进程，合计仍只允许一个突发
+        verdicts = [workers[i % 4].check('192.0.2.1', START) for i in range(8)]
+        self.assertEqual(verdicts.count(ALLOW), 4)
+        self.assertEqual(verdicts.count(KOD), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求校验测试
+用构造的数据包检查各丢弃原因、最简SNTP请求的处理以及按原因的丢弃计数
+"""
+
+import struct
+import unittest
+
+import ntp_metrics
+import ntp_validate
+from ntp_server import NTPServer
+from ntp_validate import DUPLICATE, FIELD, MODE, SHORT, VERSION, RequestValidator
+
+CLIENT = ('192.0.2.1', 40123)
+
+
+def make_request(version: int = 4, mode: int = 3, stratum: int = 0, origin: int = 0,
+                 transmit: int = 0x1234_5678_9ABC_DEF0) -> bytes:
+    """构造48字节的请求"""
+    packet = bytearray(48)
+    packet[0] = (version << 3) | mode
+    packet[1] = stratum
+    struct.pack_into('!QQ', packet, 24, origin, 0)
+    struct.pack_into('!Q', packet, 40, transmit)
+    return bytes(packet)
+
+
+class RequestValidatorTest(unittest.TestCase):
+    """各丢弃原因与放行条件"""
+    
+    def setUp(self):
+        self.validator = RequestValidator(slots=64)
+    
+    def verdict(self, data: bytes, ip: str = CLIENT[0]):
+        return self.validator.validate(data, ip)[0]
+    
+    def test_valid_request(self):
+        self.assertEqual(self.validator.validate(make_request(), CLIENT[0]),
+                         (None, 4, 3, 0x1234_5678_9ABC_DEF0))
+    
+    def test_short_packet(self):
+        self.assertEqual(self.verdict(make_request()[:47]), SHORT)
+        self.assertEqual(self.verdict(b''), SHORT)
+    
+    def test_version_out_of_range(self):
+        self.assertEqual(self.verdict(make_request(version=0)), VERSION)
+        self.assertEqual(self.verdict(make_request(version=5)), VERSION)
+    
+    def test_non_client_mode(self):
+        for mode in (1, 2, 4, 5, 6, 7):
+            self.assertEqual(self.verdict(make_request(mode=mode, transmit=mode)), MODE)
+        self.assertEqual(self.verdict(make_request(version=3, mode=0)), MODE)
+    
+    def test_ntpv1_mode_zero_is_client(self):
+        self.assertIsNone(self.verdict(make_request(version=1, mode=0)))
+    
+    def test_field_checks(self):
+        self.assertEqual(self.verdict(make_request(stratum=17, transmit=1)), FIELD)
+        self.assertEqual(self.verdict(make_request(origin=2, transmit=2)), FIELD)
+        self.assertIsNone(self.verdict(make_request(stratum=16, transmit=3)))
+    
+    def test_duplicate_transmit(self):
+        self.assertIsNone(self.verdict(make_request()))
+        self.assertEqual(self.verdict(make_request()), DUPLICATE)
+        # 其他客户端的相同传输时间戳不算重复
+        self.assertIsNone(self.verdict(make_request(), '192.0.2.2'))
+        self.assertIsNone(self.verdict(make_request(transmit=0x1234_5678_9ABC_DEF1)))
+    
+    def test_minimal_sntp_request_is_answered(self):
+        # RFC 4330：只填写版本号与模式，传输时间戳为0；不做重复检查
+        minimal = b'\x1b' + bytes(47)
+        for _ in range(3):
+            self.assertEqual(self.validator.validate(minimal, CLIENT[0]), (None, 3, 3, 0))
+
+
+class HandleRequestDropTest(unittest.TestCase):
+    """handle_request的早期丢弃与按原因计数"""
+    
+    def setUp(self):
+        self.server = NTPServer(host='127.0.0.1', port=0, rate_limit=0)
+    
+    def handle(self, data: bytes):
+        return self.server.handle_request(data, CLIENT, bytearray(48))
+    
+    def test_drops_are_counted_by_reason(self):
+        packets = [
+            make_request()[:40],                        # SHORT
+            make_request(version=7),                    # VERSION
+            make_request(mode=4),                       # MODE
+            make_request(stratum=200, transmit=5),      # FIELD
+            make_request(transmit=6),                   # 有效
+            make_request(transmit=6),                   # DUPLICATE
+        ]
+        responses = [self.handle(packet) for packet in packets]
+        self.assertEqual([response is not None for response in responses],
+                         [False, False, False, False, True, False])
+        
+        counters = self.server.counters.snapshot()
+        drops = [counters[ntp_metrics.DROP_BASE + index] for index in range(len(ntp_validate.REASONS))]
+        self.assertEqual(drops, [1, 1, 1, 1, 1])
+        self.assertEqual(counters[ntp_metrics.MALFORMED], 5)
+        self.assertEqual(counters[ntp_metrics.REQUESTS], 1)
+    
+    def test_minimal_sntp_request_gets_server_response(self):
+        response = self.handle(b'\x1b' + bytes(47))
+        self.assertIsNotNone(response)
+        self.assertEqual(response[0] & 0x07, 4)
+        self.assertEqual((response[0] >> 3) & 0x07, 3)
+        # 原始时间戳回显客户端的传输时间戳（0）
+        self.assertEqual(struct.unpack_from('!Q', response, 24)[0], 0)
+        self.assertNotEqual(struct.unpack_from('!Q', response, 40)[0], 0)
+        self.assertEqual(self.server.counters.snapshot()[ntp_metrics.MALFORMED], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,12 +5,15 @@ NTP服务器Web管理界面
 提供服务器状态监控和管理功能
 """
 
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request
 import threading
 import time
 import os
 from datetime import datetime
 from ntp_server import NTPServer
+import ntp_history
+import ntp_metrics
+import ntp_state
 import sys
 
 app = Flask(__name__)
@@ -19,21 +22,126 @@ app = Flask(__name__)
 ntp_server = None
 server_thread = None
 
+# 状态推送间隔（秒）
+STREAM_INTERVAL = 2.0
+
+# 同时推送的页面数上限（每个推送连接占用一个Web服务线程），超出时页面改为定时轮询
+STREAM_MAX_CLIENTS = 8
+
+# 单个推送连接的最长时间（秒），到期后浏览器自动重连，使服务线程得以轮换
+STREAM_MAX_DURATION = 300
+
+# 推送连接断开后浏览器的重连间隔（毫秒）
+STREAM_RETRY_MS = 3000
+
+
+class StatusBroadcaster:
+    """
+    状态推送广播器
+    
+    有页面订阅时由一个后台线程每隔固定间隔生成一次状态快照（序列化好的JSON），
+    所有推送连接共享同一份快照；没有订阅者时后台线程退出
+    """
+    
+    def __init__(self, build, interval: float = STREAM_INTERVAL, max_clients: int = STREAM_MAX_CLIENTS):
+        """
+        初始化广播器
+        
+        Args:
+            build: 生成状态快照的函数，返回可JSON序列化的字典
+            interval: 快照生成间隔（秒）
+            max_clients: 订阅者数上限
+        """
+        self.build = build
+        self.interval = interval
+        self.max_clients = max_clients
+        self._condition = threading.Condition()
+        self._subscribers = 0
+        self._sequence = 0
+        self._payload = None
+        self._thread = None
+    
+    def subscribe(self) -> bool:
+        """
+        登记一个订阅者，必要时启动后台线程
+        
+        Returns:
+            bool: 是否登记成功，订阅者已满时返回False
+        """
+        with self._condition:
+            if self._subscribers >= self.max_clients:
+                return False
+            self._subscribers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            return True
+    
+    def unsubscribe(self):
+        """注销一个订阅者"""
+        with self._condition:
+            self._subscribers -= 1
+    
+    def wait(self, sequence: int, timeout: float) -> tuple:
+        """
+        等待比sequence更新的快照
+        
+        Args:
+            sequence: 订阅者已收到的快照序号
+            timeout: 最长等待时间（秒）
+        
+        Returns:
+            tuple: (快照序号, 快照JSON)，超时返回(sequence, None)
+        """
+        with self._condition:
+            if self._sequence == sequence:
+                self._condition.wait(timeout)
+            if self._sequence == sequence or self._payload is None:
+                return sequence, None
+            return self._sequence, self._payload
+    
+    def _run(self):
+        """后台线程：每个周期生成一次快照并唤醒所有订阅者"""
+        while True:
+            with self._condition:
+                if self._subscribers <= 0:
+                    self._thread = None
+                    return
+            
+            try:
+                payload = app.json.dumps(self.build())
+            except Exception as e:
+                payload = app.json.dumps({'error': f'获取状态失败: {e}'})
+            
+            with self._condition:
+                self._sequence += 1
+                self._payload = payload
+                self._condition.notify_all()
+            time.sleep(self.interval)
+
+# 等待NTP服务器就绪的最长时间（秒）
+START_TIMEOUT = 10.0
+
+# 串行化启动请求，避免重复点击启动多个服务器
+start_lock = threading.Lock()
+
 def start_ntp_server():
-    """在后台线程中启动NTP服务器"""
-    global ntp_server
-    ntp_server = NTPServer(host='0.0.0.0', port=123, sync_interval=300)
-    ntp_server.start()
+    """在后台线程中启动NTP服务器，开始应答请求后返回，启动失败时抛出实际的错误"""
+    global ntp_server, server_thread
+    server = NTPServer(host='0.0.0.0', port=123, sync_interval=300,
+                       state_path=ntp_state.DEFAULT_STATE_FILE)
+    server_thread = server.start_background(START_TIMEOUT)
+    ntp_server = server
 
 @app.route('/')
 def index():
     """主页"""
     return render_template('index.html')
 
-@app.route('/api/status')
-def get_status():
+def build_status() -> dict:
+    """生成页面展示用的服务器状态"""
     if ntp_server is None:
-        return jsonify({
+        return {
             'error': 'NTP服务器未启动',
             'running': False,
             'host': None,
@@ -44,9 +152,13 @@ def get_status():
             'client_stats': {
                 'total_connections': 0,
                 'active_connections': 0,
+                'total_requests': 0,
+                'rate_limited': 0,
+                'rate_dropped': 0,
                 'last_client_time': None
-            }
-        })
+            },
+            'top_clients': []
+        }
     status = ntp_server.get_status()
     
     # 格式化时间信息
@@ -55,46 +167,122 @@ def get_status():
     else:
         last_sync = '从未同步'
     current_time = status['current_time']
-    return jsonify({
+    return {
         'running': status['running'],
         'host': status['host'],
         'port': status['port'],
+        'protocol': status['protocol'],
+        'stratum': status['stratum'],
         'time_offset': f"{status['time_offset']:.6f}",
+        'system_jitter': f"{status['system_jitter']:.6f}",
+        'peers': status['peers'],
         'last_sync_time': last_sync,
         'current_time': current_time,
-        'client_stats': status['client_stats']
-    })
+        'client_stats': status['client_stats'],
+        'top_clients': ntp_server.get_clients(1, 10)['clients']
+    }
+
+broadcaster = StatusBroadcaster(build_status)
+
+@app.route('/api/status')
+def get_status():
+    return jsonify(build_status())
+
+@app.route('/api/stream')
+def stream_status():
+    """以Server-Sent Events推送服务器状态，所有页面共享同一份快照"""
+    if not broadcaster.subscribe():
+        return Response('推送连接已满', status=503, mimetype='text/plain')
+    
+    def events():
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        sequence = 0
+        deadline = time.monotonic() + STREAM_MAX_DURATION
+        while time.monotonic() < deadline:
+            sequence, payload = broadcaster.wait(sequence, STREAM_INTERVAL * 2)
+            if payload is None:
+                # 心跳注释行，保持连接并及时发现已断开的页面
+                yield ": keepalive\n\n"
+            else:
+                yield f"data: {payload}\n\n"
+    
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # 连接结束（包括页面断开）时由WSGI服务器调用close()，在此注销订阅者
+    response.call_on_close(broadcaster.unsubscribe)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus指标"""
+    if ntp_server is None:
+        body = ntp_metrics.render([0] * ntp_metrics.SIZE, {'running': False})
+    else:
+        body = ntp_metrics.render(ntp_server.get_metrics(), ntp_server.get_status())
+    return Response(body, mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/clients')
+def get_clients():
+    """按请求速率分页获取客户端统计"""
+    if ntp_server is None:
+        return jsonify({'error': 'NTP服务器未启动', 'total': 0, 'clients': []})
+    
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 50, type=int), 1), 500)
+    return jsonify(ntp_server.get_clients(page, per_page))
 
 @app.route('/api/sync', methods=['POST'])
 def manual_sync():
-    """手动同步时间"""
+    """手动同步时间：在后台启动同步任务并立即返回任务ID，已有同步在运行时合并到该任务"""
     if ntp_server is None:
         return jsonify({'error': 'NTP服务器未启动'})
     
-    success = ntp_server.sync_time()
+    try:
+        job = ntp_server.request_sync()
+    except RuntimeError as e:
+        return jsonify({'error': str(e)})
     return jsonify({
-        'success': success,
-        'message': '时间同步完成' if success else '时间同步失败'
-    })
+        'success': True,
+        'job_id': job.id,
+        'coalesced': job.coalesced > 0,
+        'message': '已有同步正在进行，已合并到该任务' if job.coalesced else '已开始时间同步'
+    }), 202
 
-@app.route('/api/start', methods=['POST'])
-def start_server():
-    """启动NTP服务器"""
-    global ntp_server, server_thread
+@app.route('/api/sync/<job_id>')
+def sync_job_status(job_id):
+    """查询同步任务的进度与各上游的结果"""
+    if ntp_server is None:
+        return jsonify({'error': 'NTP服务器未启动'}), 404
     
-    if ntp_server and ntp_server.running:
-        return jsonify({'error': 'NTP服务器已在运行'})
+    job = ntp_server.get_sync_job(job_id)
+    if job is None:
+        return jsonify({'error': '同步任务不存在'}), 404
+    return jsonify(job)
+
+@app.route('/api/history')
+def get_history():
+    """按列获取指标历史，metric为指标名，range为时间范围（如'1h'、'7d'）"""
+    if ntp_server is None:
+        return jsonify({'error': 'NTP服务器未启动'}), 404
     
     try:
-        server_thread = threading.Thread(target=start_ntp_server, daemon=True)
-        server_thread.start()
-        
-        # 等待服务器启动
-        time.sleep(2)
+        range_seconds = ntp_history.parse_range(request.args.get('range', '1h'))
+        return jsonify(ntp_server.get_history(request.args.get('metric', 'offset'), range_seconds))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/start', methods=['POST'])
+def start_server():
+    """启动NTP服务器"""
+    with start_lock:
+        if ntp_server and ntp_server.running:
+            return jsonify({'error': 'NTP服务器已在运行'})
         
-        return jsonify({'success': True, 'message': 'NTP服务器启动成功'})
-    except Exception as e:
-        return jsonify({'error': f'启动失败: {str(e)}'})
+        try:
+            start_ntp_server()
+            return jsonify({'success': True, 'message': 'NTP服务器启动成功'})
+        except Exception as e:
+            return jsonify({'error': f'启动失败: {str(e)}'})
 
 @app.route('/api/stop', methods=['POST'])
 def stop_server():